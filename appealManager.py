@@ -3,11 +3,20 @@
 import os
 import json
 import psycopg
+from psycopg.types.json import Jsonb
+import time
+import uuid
 import logging
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from thefuzz import fuzz
+from rapidfuzz import fuzz
 
 import connectionChecker
+from ttlCache import TTLCache
+from similarityIndex import decision_index
+from deadlineScheduler import deadline_scheduler
+from interactionLog import InteractionLogWriter
 
 log = logging.getLogger("hjr-bot.appeal_manager")
 
@@ -21,226 +30,643 @@ def are_arguments_meaningful(text: str, min_length: int = 20) -> bool:
         return False
     return True
 
-def find_similar_appeal(decision_text: str, similarity_threshold=90):
-    """Ищет в базе апелляции с похожим предметом спора, используя fuzz.ratio."""
+# Сколько кандидатов отбирает индекс pg_trgm перед точной переоценкой fuzz.ratio.
+SIMILAR_CANDIDATES_LIMIT = 20
+# Порог триграммной похожести для отбора кандидатов. Он заведомо ниже порога
+# fuzz.ratio: метрики считаются по-разному, окончательно решает fuzz.ratio.
+TRGM_CANDIDATE_THRESHOLD = 0.3
+
+# Закрытые дела: только среди них ищутся похожие апелляции (и в SQL, и в индексе в памяти).
+CLOSED_STATUSES = ('closed', 'closed_after_review')
+
+def find_similar_appeals(decision_text: str, similarity_threshold=90, limit=5, exclude_case_id=None) -> list:
+    """
+    Ищет среди закрытых дел (CLOSED_STATUSES) апелляции с похожим предметом спора.
+    Возвращает до limit словарей {"case_id", "similarity"} по убыванию схожести (fuzz.ratio).
+    Источник кандидатов: индекс pg_trgm, иначе индекс в памяти, иначе полный перебор.
+    """
+    if not decision_text:
+        return []
+    if not connectionChecker.trgm_available and decision_index.ready:
+        return [
+            {"case_id": case_id, "similarity": round(score)}
+            for case_id, score in decision_index.query(decision_text, similarity_threshold, limit, exclude_case_id)
+        ]
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT case_id, decision_text FROM appeals")
-            records = cur.fetchall()
-
-            for record in records:
-                case_id, db_text = record
-                if not db_text: continue
-                similarity = fuzz.ratio(decision_text, db_text)
-                if similarity >= similarity_threshold:
-                    log.info(f"Найдена похожая апелляция: #{case_id} (схожесть: {similarity}%)")
-                    return {"case_id": case_id, "similarity": similarity}
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                if connectionChecker.trgm_available:
+                    cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)", (str(TRGM_CANDIDATE_THRESHOLD),))
+                    cur.execute(
+                        """
+                        SELECT case_id, decision_text FROM appeals
+                        WHERE decision_text %% %s AND case_id IS DISTINCT FROM %s AND status = ANY(%s)
+                        ORDER BY similarity(decision_text, %s) DESC
+                        LIMIT %s
+                        """,
+                        (decision_text, exclude_case_id, list(CLOSED_STATUSES), decision_text, max(limit, SIMILAR_CANDIDATES_LIMIT))
+                    )
+                else:
+                    cur.execute(
+                        "SELECT case_id, decision_text FROM appeals WHERE case_id IS DISTINCT FROM %s AND status = ANY(%s)",
+                        (exclude_case_id, list(CLOSED_STATUSES))
+                    )
+                records = cur.fetchall()
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось найти похожие апелляции: {e}")
-    return None
+        return []
+
+    matches = []
+    for case_id, db_text in records:
+        if not db_text: continue
+        similarity = round(fuzz.ratio(decision_text, db_text))
+        if similarity >= similarity_threshold:
+            matches.append({"case_id": case_id, "similarity": similarity})
+    matches.sort(key=lambda match: match["similarity"], reverse=True)
+    return matches[:limit]
+
+# Как часто перестраивать индекс целиком (изменения статусов из других процессов), секунд.
+SIMILARITY_INDEX_REBUILD_INTERVAL = float(os.getenv("SIMILARITY_INDEX_REBUILD_INTERVAL", "3600"))
+
+def build_similarity_index():
+    """Строит индекс похожих апелляций в памяти по закрытым делам (нужен, только если pg_trgm недоступен)."""
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT case_id, decision_text FROM appeals WHERE status = ANY(%s) AND decision_text IS NOT NULL",
+                    (list(CLOSED_STATUSES),)
+                )
+                decision_index.build(cur.fetchall())
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось построить индекс похожих апелляций: {e}")
+
+def start_similarity_index_rebuilds():
+    """Строит индекс похожих апелляций и перестраивает его раз в SIMILARITY_INDEX_REBUILD_INTERVAL секунд."""
+    build_similarity_index()
+    if SIMILARITY_INDEX_REBUILD_INTERVAL <= 0:
+        return
+
+    def rebuild_loop():
+        while True:
+            time.sleep(SIMILARITY_INDEX_REBUILD_INTERVAL)
+            build_similarity_index()
+
+    threading.Thread(target=rebuild_loop, name="similarity-index-rebuild", daemon=True).start()
+
+def _sync_similarity_index(case_id, status, decision_text):
+    """Держит в индексе в памяти только закрытые дела: добавляет при закрытии, убирает при возврате в работу."""
+    if status in CLOSED_STATUSES:
+        decision_index.add(case_id, decision_text)
+    else:
+        decision_index.remove(case_id)
+
+def find_similar_appeal(decision_text: str, similarity_threshold=90, exclude_case_id=None):
+    """Возвращает самую похожую апелляцию или None."""
+    matches = find_similar_appeals(decision_text, similarity_threshold, limit=1, exclude_case_id=exclude_case_id)
+    if not matches:
+        return None
+    best = matches[0]
+    log.info(f"Найдена похожая апелляция: #{best['case_id']} (схожесть: {best['similarity']}%)")
+    return best
 
+@contextmanager
 def _get_conn():
-    conn = connectionChecker.db_conn
-    if conn is None or conn.closed:
-        if connectionChecker.check_db_connection():
-            conn = connectionChecker.db_conn
-        else:
+    """
+    Берёт соединение из пула на время одного вызова и возвращает его обратно.
+    Транзакция фиксируется при выходе из блока и откатывается при исключении.
+    """
+    pool = connectionChecker.db_pool
+    if pool is None or pool.closed:
+        if not connectionChecker.check_db_connection():
             raise RuntimeError("Не удалось восстановить соединение с БД.")
-    return conn
+        pool = connectionChecker.db_pool
+    with pool.connection() as conn:
+        yield conn
+
+# Журнал действий пишется пачками в фоне; log_id выдаются из заранее выделенных блоков.
+interaction_log = InteractionLogWriter(_get_conn)
 
 def create_appeal(case_id, initial_data):
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            applicant_info_json = json.dumps(initial_data.get('applicant_info', {}))
-            cur.execute(
-                """
-                INSERT INTO appeals (case_id, applicant_chat_id, decision_text, status, created_at, applicant_info, total_voters, message_thread_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (case_id) DO UPDATE SET
-                    applicant_chat_id = EXCLUDED.applicant_chat_id, decision_text = EXCLUDED.decision_text,
-                                                 status = EXCLUDED.status, created_at = EXCLUDED.created_at,
-                                                 applicant_info = EXCLUDED.applicant_info, message_thread_id = EXCLUDED.message_thread_id;
-                """,
-                (case_id, initial_data.get('applicant_chat_id'), initial_data.get('decision_text'),
-                 initial_data.get('status'), initial_data.get('created_at'),
-                 applicant_info_json, initial_data.get('total_voters'), initial_data.get('message_thread_id'))
-            )
-        conn.commit()
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                applicant_info_json = json.dumps(initial_data.get('applicant_info', {}))
+                cur.execute(
+                    """
+                    INSERT INTO appeals (case_id, applicant_chat_id, decision_text, status, created_at, applicant_info, total_voters, message_thread_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (case_id) DO UPDATE SET
+                        applicant_chat_id = EXCLUDED.applicant_chat_id, decision_text = EXCLUDED.decision_text,
+                                                     status = EXCLUDED.status, created_at = EXCLUDED.created_at,
+                                                     applicant_info = EXCLUDED.applicant_info, message_thread_id = EXCLUDED.message_thread_id;
+                    """,
+                    (case_id, initial_data.get('applicant_chat_id'), initial_data.get('decision_text'),
+                     initial_data.get('status'), initial_data.get('created_at'),
+                     applicant_info_json, initial_data.get('total_voters'), initial_data.get('message_thread_id'))
+                )
+            conn.commit()
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось создать апелляцию #{case_id}: {e}")
 
 def get_appeal(case_id):
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM appeals WHERE case_id = %s", (case_id,))
-            record = cur.fetchone()
-            if record:
-                columns = [desc[0] for desc in cur.description]
-                return dict(zip(columns, record))
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT * FROM appeals WHERE case_id = %s", (case_id,))
+                record = cur.fetchone()
+                if record:
+                    columns = [desc[0] for desc in cur.description]
+                    return dict(zip(columns, record))
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось получить дело #{case_id}: {e}")
     return None
 
 def update_appeal(case_id, key, value):
+    update_appeal_fields(case_id, **{key: value})
+
+def update_appeal_fields(case_id, **fields) -> bool:
+    """
+    Обновляет любые колонки дела одним UPDATE в одной транзакции.
+    dict и list автоматически передаются как JSONB.
+    """
+    if not fields:
+        return True
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            if isinstance(value, (dict, list)):
-                value = json.dumps(value)
-
-            query = psycopg.sql.SQL("UPDATE appeals SET {key} = %s WHERE case_id = %s").format(
-                key=psycopg.sql.Identifier(key)
-            )
-            cur.execute(query, (value, case_id))
-        conn.commit()
+        assignments = psycopg.sql.SQL(", ").join(
+            psycopg.sql.SQL("{} = %s").format(psycopg.sql.Identifier(key)) for key in fields
+        )
+        query = psycopg.sql.SQL("UPDATE appeals SET {assignments} WHERE case_id = %s RETURNING decision_text").format(
+            assignments=assignments
+        )
+        values = [Jsonb(value) if isinstance(value, (dict, list)) else value for value in fields.values()]
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, (*values, case_id))
+                record = cur.fetchone()
+            conn.commit()
+        if "status" in fields and record:
+            _sync_similarity_index(case_id, fields["status"], record[0])
+        if "timer_expires_at" in fields:
+            deadline_scheduler.schedule(case_id, fields["timer_expires_at"])
+        return True
     except Exception as e:
-        log.error(f"[ОШИБКА] Не удалось обновить дело #{case_id} (поле {key}): {e}")
+        log.error(f"[ОШИБКА] Не удалось обновить дело #{case_id} (поля {', '.join(fields)}): {e}")
+    return False
+
+def increment_finalize_attempts(case_id):
+    """Увеличивает счётчик неудачных попыток финализации дела и возвращает новое значение (None при ошибке)."""
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE appeals SET finalize_attempts = finalize_attempts + 1 WHERE case_id = %s RETURNING finalize_attempts",
+                    (case_id,)
+                )
+                record = cur.fetchone()
+            conn.commit()
+        return record[0] if record else None
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось обновить счётчик попыток финализации дела #{case_id}: {e}")
+    return None
+
+def append_to_appeal_array(case_id, column, item, key=None):
+    """
+    Дописывает item в JSONB-массив дела одним UPDATE (без чтения строки) и возвращает новую длину массива.
+    Если задан key, массив лежит по этому ключу внутри JSONB-объекта column.
+    Возвращает None, если дело не найдено или произошла ошибка.
+    """
+    column_id = psycopg.sql.Identifier(column)
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                if key is None:
+                    query = psycopg.sql.SQL(
+                        "UPDATE appeals SET {col} = COALESCE({col}, '[]'::jsonb) || jsonb_build_array(%s::jsonb) "
+                        "WHERE case_id = %s RETURNING jsonb_array_length({col})"
+                    ).format(col=column_id)
+                    cur.execute(query, (Jsonb(item), case_id))
+                else:
+                    query = psycopg.sql.SQL(
+                        "UPDATE appeals SET {col} = jsonb_set(COALESCE({col}, '{{}}'::jsonb), %s, "
+                        "COALESCE({col} -> %s, '[]'::jsonb) || jsonb_build_array(%s::jsonb)) "
+                        "WHERE case_id = %s RETURNING jsonb_array_length({col} -> %s)"
+                    ).format(col=column_id)
+                    cur.execute(query, ([key], key, Jsonb(item), case_id, key))
+                record = cur.fetchone()
+            conn.commit()
+            return record[0] if record else None
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось дописать значение в {column} дела #{case_id}: {e}")
+    return None
+
+def set_appeal_json_key(case_id, column, key, value) -> bool:
+    """Устанавливает один ключ JSONB-объекта дела через jsonb_set, не перезаписывая остальные ключи."""
+    try:
+        query = psycopg.sql.SQL(
+            "UPDATE appeals SET {col} = jsonb_set(COALESCE({col}, '{{}}'::jsonb), %s, %s) WHERE case_id = %s"
+        ).format(col=psycopg.sql.Identifier(column))
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, ([key], Jsonb(value), case_id))
+            conn.commit()
+        return True
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось обновить {column}.{key} дела #{case_id}: {e}")
+    return False
 
 def add_council_answer(case_id, answer_data):
+    """
+    Добавляет ответ Совета к делу и возвращает новое количество ответов (None при ошибке).
+    Как только собраны все ожидаемые ответы, дело сразу передаётся на финальное рассмотрение.
+    """
     try:
-        appeal = get_appeal(case_id)
-        if appeal:
-            current_answers = appeal.get('council_answers') or []
-            current_answers.append(answer_data)
-            update_appeal(case_id, 'council_answers', current_answers)
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE appeals SET council_answers = COALESCE(council_answers, '[]'::jsonb) || jsonb_build_array(%s::jsonb)
+                    WHERE case_id = %s
+                    RETURNING jsonb_array_length(council_answers), expected_responses, status
+                    """,
+                    (Jsonb(answer_data), case_id)
+                )
+                record = cur.fetchone()
+            conn.commit()
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось добавить ответ в дело #{case_id}: {e}")
+        return None
+    if not record:
+        return None
+
+    answers_count, expected_responses, status = record
+    if status == 'collecting' and expected_responses and answers_count >= expected_responses:
+        from finalizationQueue import submit_appeal_finalization
+        log.info(f"Досрочное завершение для дела #{case_id}: получены все {expected_responses} ответов.")
+        submit_appeal_finalization(case_id)
+    return answers_count
 
 def delete_appeal(case_id):
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM appeals WHERE case_id = %s", (case_id,))
-        conn.commit()
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM appeals WHERE case_id = %s", (case_id,))
+            conn.commit()
+        decision_index.remove(case_id)
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось удалить дело #{case_id}: {e}")
 
-def get_appeals_in_collection():
+# Статусы, для которых timer_expires_at означает дедлайн, обрабатываемый планировщиком.
+TIMER_STATUSES = ('collecting', 'reviewing', 'review_poll_pending')
+# Дела, финализацию которых остановили после ошибок ИИ (см. geminiProcessor); вернуть в работу — /regenerate.
+FINALIZE_FAILED_STATUS = "finalize_failed"
+REVIEW_FINALIZE_FAILED_STATUS = "review_finalize_failed"
+
+def get_timer_deadlines():
+    """Возвращает пары (case_id, timer_expires_at) для всех дел с активным таймером."""
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM appeals WHERE status IN ('collecting', 'reviewing')")
-            records = cur.fetchall()
-            if not records: return []
-            columns = [desc[0] for desc in cur.description]
-            return [dict(zip(columns, record)) for record in records]
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT case_id, timer_expires_at FROM appeals WHERE status = ANY(%s) AND timer_expires_at IS NOT NULL",
+                    (list(TIMER_STATUSES),)
+                )
+                return cur.fetchall()
     except Exception as e:
-        log.error(f"[ОШИБКА] Не удалось получить активные апелляции: {e}")
-    return []
+        log.error(f"[ОШИБКА] Не удалось получить таймеры активных апелляций: {e}")
+        raise
 
 def get_active_appeal_by_user(user_id):
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT case_id FROM appeals WHERE (applicant_info->>'id')::bigint = %s AND status != 'closed' AND status != 'closed_after_review'",
-                (user_id,)
-            )
-            record = cur.fetchone()
-            return record[0] if record else None
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT case_id FROM appeals WHERE (applicant_info->>'id')::bigint = %s AND status != 'closed' AND status != 'closed_after_review'",
+                    (user_id,)
+                )
+                record = cur.fetchone()
+                return record[0] if record else None
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось проверить активные апелляции для user_id {user_id}: {e}")
     return None
 
+# --- Кеш user_states ---
+# Запись идёт сквозь кеш в БД; отсутствие состояния тоже кешируется, поэтому
+# обычные личные сообщения не обращаются к БД. Каждая запись получает версию
+# из user_states_version_seq и рассылает NOTIFY; другие воркеры gunicorn
+# выбрасывают из своего кеша записи со старой версией.
+USER_STATE_CACHE_TTL = float(os.getenv("USER_STATE_CACHE_TTL", "300"))
+USER_STATE_CACHE_SIZE = int(os.getenv("USER_STATE_CACHE_SIZE", "1024"))
+USER_STATES_CHANNEL = "user_states"
+
+_state_cache = TTLCache(maxsize=USER_STATE_CACHE_SIZE, ttl=USER_STATE_CACHE_TTL)
+# Идентификатор процесса в уведомлениях, чтобы не реагировать на собственные записи.
+_worker_token = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+# Счётчик чужих инвалидаций: чтение кладёт результат в кеш, только если за время
+# запроса к БД не пришло ни одного уведомления (иначе результат мог устареть).
+_state_generation = {"value": 0}
+_state_generation_lock = threading.Lock()
+
+def _on_user_state_notify(payload: str):
+    token, user_key, version = payload.rsplit(":", 2)
+    if token == _worker_token:
+        return
+    with _state_generation_lock:
+        _state_generation["value"] += 1
+    found, cached = _state_cache.peek(user_key)
+    if found and (cached is None or cached[0] < int(version)):
+        _state_cache.pop(user_key)
+
+def _on_user_state_listener_connect():
+    # Пока слушатель был отключён, уведомления могли потеряться.
+    with _state_generation_lock:
+        _state_generation["value"] += 1
+    _state_cache.clear()
+
+def start_state_cache_invalidation():
+    """Подписывается на уведомления об изменениях user_states от других процессов."""
+    connectionChecker.start_listener(USER_STATES_CHANNEL, _on_user_state_notify, _on_user_state_listener_connect)
+
+def get_user_state_cache_stats() -> dict:
+    return _state_cache.stats()
+
 def get_user_state(user_id):
     """Получает состояние по ID (может быть int для юзера или str для чата)."""
+    user_key = str(user_id)
+    found, cached = _state_cache.lookup(user_key)
+    if found:
+        return _state_record(cached)
+
+    generation = _state_generation["value"]
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT state, data FROM user_states WHERE user_id = %s", (str(user_id),))
-            record = cur.fetchone()
-            if record:
-                return {"state": record[0], "data": record[1] or {}}
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT state, data, version FROM user_states WHERE user_id = %s", (user_key,))
+                record = cur.fetchone()
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось получить состояние для user_id {user_id}: {e}")
-    return None
+        return None
+
+    entry = (record[2], record[0], record[1] or {}) if record else None
+    if generation == _state_generation["value"]:
+        _state_cache.set(user_key, entry)
+    return _state_record(entry)
+
+def _state_record(entry):
+    if entry is None:
+        return None
+    # Копия, чтобы изменения словаря в обработчиках не портили кеш.
+    return {"state": entry[1], "data": json.loads(json.dumps(entry[2]))}
 
 def set_user_state(user_id, state, data=None):
     """Устанавливает состояние по ID (может быть int для юзера или str для чата)."""
+    user_key = str(user_id)
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            data_json = json.dumps(data or {})
-            cur.execute(
-                """
-                INSERT INTO user_states (user_id, state, data)
-                VALUES (%s, %s, %s)
-                    ON CONFLICT (user_id) DO UPDATE SET
-                    state = EXCLUDED.state, data = EXCLUDED.data, updated_at = NOW();
-                """,
-                (str(user_id), state, data_json)
-            )
-        conn.commit()
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                data_json = json.dumps(data or {})
+                cur.execute(
+                    """
+                    WITH upsert AS (
+                        INSERT INTO user_states (user_id, state, data, version)
+                        VALUES (%s, %s, %s, nextval('user_states_version_seq'))
+                            ON CONFLICT (user_id) DO UPDATE SET
+                            state = EXCLUDED.state, data = EXCLUDED.data,
+                            version = EXCLUDED.version, updated_at = NOW()
+                        RETURNING version
+                    )
+                    SELECT version, pg_notify(%s, %s::text || ':' || %s::text || ':' || version) FROM upsert;
+                    """,
+                    (user_key, state, data_json, USER_STATES_CHANNEL, _worker_token, user_key)
+                )
+                version = cur.fetchone()[0]
+            conn.commit()
+        _state_cache.set(user_key, (version, state, json.loads(data_json)))
     except Exception as e:
+        _state_cache.pop(user_key)
         log.error(f"[ОШИБКА] Не удалось установить состояние для user_id {user_id}: {e}")
 
 def delete_user_state(user_id):
     """Удаляет состояние по ID (может быть int для юзера или str для чата)."""
+    user_key = str(user_id)
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM user_states WHERE user_id = %s", (str(user_id),))
-        conn.commit()
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    WITH deleted AS (
+                        DELETE FROM user_states WHERE user_id = %s
+                    ), tombstone AS (
+                        SELECT nextval('user_states_version_seq') AS version
+                    )
+                    SELECT version, pg_notify(%s, %s::text || ':' || %s::text || ':' || version) FROM tombstone;
+                    """,
+                    (user_key, USER_STATES_CHANNEL, _worker_token, user_key)
+                )
+            conn.commit()
+        _state_cache.set(user_key, None)
     except Exception as e:
+        _state_cache.pop(user_key)
         log.error(f"[ОШИБКА] Не удалось удалить состояние для user_id {user_id}: {e}")
 
+def claim_update_id(update_id) -> bool:
+    """
+    Отмечает апдейт Telegram как обработанный. Возвращает False, если он уже был отмечен.
+    При ошибке БД возвращает True: лучше обработать повтор, чем потерять апдейт.
+    """
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO processed_updates (update_id) VALUES (%s) ON CONFLICT (update_id) DO NOTHING RETURNING update_id",
+                    (update_id,)
+                )
+                claimed = cur.fetchone() is not None
+            conn.commit()
+            return claimed
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось отметить апдейт {update_id} как обработанный: {e}")
+    return True
+
+def purge_processed_updates(ttl_seconds: int):
+    """Удаляет отметки об апдейтах старше ttl_seconds."""
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM processed_updates WHERE processed_at < NOW() - make_interval(secs => %s)",
+                    (ttl_seconds,)
+                )
+            conn.commit()
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось очистить processed_updates: {e}")
+
+def get_stored_verdict(prompt_hash):
+    """Возвращает сохранённый вердикт по хешу промпта или None."""
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT verdict FROM verdict_cache WHERE prompt_hash = %s", (prompt_hash,))
+                row = cur.fetchone()
+                return row[0] if row else None
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось прочитать verdict_cache: {e}")
+    return None
+
+def store_verdict(prompt_hash, model_name, case_id, verdict):
+    """Сохраняет вердикт по хешу промпта (повторная запись заменяет старый вердикт)."""
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO verdict_cache (prompt_hash, model_name, case_id, verdict) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (prompt_hash) DO UPDATE SET verdict = EXCLUDED.verdict, created_at = NOW()
+                    """,
+                    (prompt_hash, model_name, case_id, verdict)
+                )
+            conn.commit()
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось сохранить вердикт дела #{case_id} в verdict_cache: {e}")
+
 def update_editor_list(editors_with_roles):
     """
     Полностью перезаписывает список редакторов в БД, сохраняя их роли и статус неактивности.
     """
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            # Получаем существующих редакторов, чтобы сохранить их статус is_inactive
-            cur.execute("SELECT user_id, is_inactive FROM editors")
-            existing_statuses = {row[0]: row[1] for row in cur.fetchall()}
-
-            cur.execute("TRUNCATE TABLE editors;")
-            if not editors_with_roles:
-                log.warning("Список редакторов для обновления пуст.")
-                return
-
-            editor_data = []
-            for editor_info in editors_with_roles:
-                user = editor_info['user']
-                role = editor_info['role']
-                user_id = user.id
-
-                # Сохраняем старый статус неактивности, если он был
-                is_inactive = existing_statuses.get(user_id, False)
-
-                editor_data.append((
-                    user_id,
-                    user.username,
-                    user.first_name,
-                    is_inactive,
-                    role  # Добавляем роль
-                ))
-
-            # Используем COPY для быстрой вставки
-            with cur.copy("COPY editors (user_id, username, first_name, is_inactive, role) FROM STDIN") as copy:
-                for record in editor_data:
-                    copy.write_row(record)
-
-        conn.commit()
-        log.info(f"Список редакторов обновлен. Загружено {len(editors_with_roles)} пользователей.")
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                # Получаем существующих редакторов, чтобы сохранить их статус is_inactive
+                cur.execute("SELECT user_id, is_inactive FROM editors")
+                existing_statuses = {row[0]: row[1] for row in cur.fetchall()}
+
+                cur.execute("TRUNCATE TABLE editors;")
+                if not editors_with_roles:
+                    log.warning("Список редакторов для обновления пуст.")
+                    return
+
+                editor_data = []
+                for editor_info in editors_with_roles:
+                    user = editor_info['user']
+                    role = editor_info['role']
+                    user_id = user.id
+
+                    # Сохраняем старый статус неактивности, если он был
+                    is_inactive = existing_statuses.get(user_id, False)
+
+                    editor_data.append((
+                        user_id,
+                        user.username,
+                        user.first_name,
+                        is_inactive,
+                        role  # Добавляем роль
+                    ))
+
+                # Используем COPY для быстрой вставки
+                with cur.copy("COPY editors (user_id, username, first_name, is_inactive, role) FROM STDIN") as copy:
+                    for record in editor_data:
+                        copy.write_row(record)
+
+            conn.commit()
+            log.info(f"Список редакторов обновлен. Загружено {len(editors_with_roles)} пользователей.")
+        invalidate_editor_cache()
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось обновить список редакторов: {e}", exc_info=True)
 
+# --- Кеш авторизации редакторов ---
+# Сначала проверяется TTL-кеш положительных и отрицательных ответов
+# get_chat_member, затем множество user_id из таблицы editors (её заполняет
+# sync_editors_list). Telegram API вызывается только при промахе; кеш
+# сбрасывается обработчиками chat_member/my_chat_member, а вышедшие из чата
+# удаляются из таблицы (remove_editor).
+EDITOR_CACHE_TTL = float(os.getenv("EDITOR_CACHE_TTL", "600"))
+MEMBER_STATUSES = ('creator', 'administrator', 'member')
+
+_editor_ids = {"value": None, "expires_at": 0.0}
+_editor_ids_lock = threading.Lock()
+_editor_status_cache = TTLCache(maxsize=2048, ttl=EDITOR_CACHE_TTL)
+
+def _get_editor_ids() -> set:
+    with _editor_ids_lock:
+        if _editor_ids["value"] is not None and time.monotonic() < _editor_ids["expires_at"]:
+            return _editor_ids["value"]
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT user_id FROM editors")
+                editor_ids = {row[0] for row in cur.fetchall()}
+    except Exception as e:
+        log.error(f"[AUTH_CHECK] Не удалось загрузить список редакторов из БД: {e}")
+        return set()
+    with _editor_ids_lock:
+        _editor_ids.update(value=editor_ids, expires_at=time.monotonic() + EDITOR_CACHE_TTL)
+    return editor_ids
+
+def invalidate_editor_cache(chat_id=None, user_id=None, status=None):
+    """
+    Сбрасывает кеш авторизации. С user_id — только для этого пользователя
+    (если известен новый status, он сразу кладётся в кеш), без него — весь кеш.
+    """
+    if user_id is None:
+        with _editor_ids_lock:
+            _editor_ids.update(value=None, expires_at=0.0)
+        _editor_status_cache.clear()
+        return
+    is_member = status in MEMBER_STATUSES
+    if not is_member:
+        with _editor_ids_lock:
+            if _editor_ids["value"] is not None:
+                _editor_ids["value"].discard(user_id)
+    if chat_id is None:
+        return
+    if status is not None:
+        _editor_status_cache.set((chat_id, user_id), is_member)
+    else:
+        _editor_status_cache.pop((chat_id, user_id))
+
+def remove_editor(user_id) -> bool:
+    """
+    Удаляет пользователя, покинувшего чат Совета, из таблицы editors. Иначе после
+    истечения кешей _get_editor_ids() снова загрузит его из таблицы и авторизует
+    без запроса к Telegram.
+    """
+    try:
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM editors WHERE user_id = %s", (user_id,))
+                removed = cur.rowcount > 0
+            conn.commit()
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось удалить редактора {user_id} из БД: {e}")
+        return False
+    if removed:
+        log.info(f"Редактор {user_id} покинул чат Совета и удалён из списка редакторов.")
+    return True
+
+def get_editor_cache_stats() -> dict:
+    stats = _editor_status_cache.stats()
+    stats["editors_loaded"] = len(_editor_ids["value"] or ())
+    return stats
+
 def is_user_an_editor(bot, user_id, chat_id):
-    """Проверяет, является ли пользователь участником указанного чата."""
-    log.info(f"--- [AUTH_CHECK] Начало проверки для user_id: {user_id} в чате: {chat_id} ---")
+    """Проверяет, является ли пользователь участником указанного чата (чата Совета)."""
     if not chat_id:
         log.error("[AUTH_CHECK] ПРОВАЛ: ID чата редакторов не определён.")
         return False
+
+    found, is_member = _editor_status_cache.lookup((chat_id, user_id))
+    if found:
+        return is_member
+    if user_id in _get_editor_ids():
+        _editor_status_cache.set((chat_id, user_id), True)
+        return True
+
     try:
         member = bot.get_chat_member(chat_id, user_id)
         status = member.status
-        is_member = status in ['creator', 'administrator', 'member']
-        log.info(f"[AUTH_CHECK] Результат: Пользователь {user_id} имеет статус '{status}'. Является участником: {is_member}.")
+        is_member = status in MEMBER_STATUSES
+        log.debug(f"[AUTH_CHECK] Пользователь {user_id} имеет статус '{status}'. Является участником: {is_member}.")
+        _editor_status_cache.set((chat_id, user_id), is_member)
         return is_member
     except Exception as e:
         log.error(f"[AUTH_CHECK] ПРОВАЛ: Ошибка при вызове get_chat_member для user_id {user_id}. Детали: {e}")
@@ -249,13 +675,13 @@ def is_user_an_editor(bot, user_id, chat_id):
 def find_editor_by_username(username: str):
     """Находит редактора в базе по юзернейму."""
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT user_id, username, first_name, is_inactive FROM editors WHERE username = %s", (username,))
-            record = cur.fetchone()
-            if record:
-                columns = [desc[0] for desc in cur.description]
-                return dict(zip(columns, record))
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT user_id, username, first_name, is_inactive FROM editors WHERE username = %s", (username,))
+                record = cur.fetchone()
+                if record:
+                    columns = [desc[0] for desc in cur.description]
+                    return dict(zip(columns, record))
     except Exception as e:
         log.error(f"Ошибка при поиске редактора @{username}: {e}")
     return None
@@ -263,12 +689,12 @@ def find_editor_by_username(username: str):
 def update_editor_status(user_id: int, is_inactive: bool):
     """Обновляет статус активности редактора."""
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("UPDATE editors SET is_inactive = %s WHERE user_id = %s", (is_inactive, user_id))
-        conn.commit()
-        log.info(f"Статус редактора {user_id} изменен на is_inactive={is_inactive}")
-        return True
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE editors SET is_inactive = %s WHERE user_id = %s", (is_inactive, user_id))
+            conn.commit()
+            log.info(f"Статус редактора {user_id} изменен на is_inactive={is_inactive}")
+            return True
     except Exception as e:
         log.error(f"Ошибка при обновлении статуса редактора {user_id}: {e}")
     return False
@@ -276,27 +702,21 @@ def update_editor_status(user_id: int, is_inactive: bool):
 def count_inactive_editors():
     """Считает количество неактивных редакторов."""
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM editors WHERE is_inactive = TRUE")
-            return cur.fetchone()[0]
+        with _get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM editors WHERE is_inactive = TRUE")
+                return cur.fetchone()[0]
     except Exception as e:
         log.error(f"Ошибка при подсчете неактивных редакторов: {e}")
     return 0
 
 def log_interaction(user_id, action, case_id=None, details=""):
-    """Записывает действие в лог и возвращает ID этой записи."""
-    try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            db_user_id = user_id if user_id != "SYSTEM" else None
-            cur.execute(
-                "INSERT INTO interaction_logs (user_id, case_id, action, details) VALUES (%s, %s, %s, %s) RETURNING log_id;",
-                (db_user_id, case_id, action, details)
-            )
-            log_id = cur.fetchone()[0]
-            conn.commit()
-            return log_id
-    except Exception as e:
-        log.error(f"[ОШИБКА] Не удалось записать лог для user_id {user_id}: {e}")
-    return Nonec
\ No newline at end of file
+    """
+    Ставит действие в очередь на запись (interactionLog) и сразу возвращает ID
+    этой записи из заранее выделенного блока, не дожидаясь БД.
+    """
+    db_user_id = user_id if user_id != "SYSTEM" else None
+    log_id = interaction_log.write(db_user_id, action, case_id, details)
+    if log_id is None:
+        log.error(f"[ОШИБКА] Не удалось записать лог для user_id {user_id}: нет свободного log_id.")
+    return log_id
\ No newline at end of file
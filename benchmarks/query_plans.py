@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Планы частых запросов до и после индексов из migrations.py.
+
+Скрипт работает в отдельной схеме внутри одной транзакции, которая в конце
+откатывается, поэтому рабочие таблицы не затрагиваются:
+  1. применяет миграции до версии 2 (схема без индексов) и заполняет таблицы
+     синтетическими данными;
+  2. выполняет EXPLAIN (ANALYZE, BUFFERS) для каждого запроса — «до»;
+  3. применяет миграцию 3 (индексы), делает ANALYZE и снимает планы «после».
+
+Запуск из корня репозитория (нужен DATABASE_URL):
+    python benchmarks/query_plans.py --appeals 50000
+    python benchmarks/query_plans.py --text   # полные текстовые планы
+"""
+import os
+import sys
+import json
+import argparse
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import migrations  # noqa: E402
+
+SCHEMA = "hjr_query_plans"
+INDEX_MIGRATION = 3
+
+# Те же запросы, что в appealManager.
+QUERIES = {
+    "get_timer_deadlines": (
+        "SELECT case_id, timer_expires_at FROM appeals WHERE status = ANY(%s) AND timer_expires_at IS NOT NULL",
+        (["collecting", "reviewing", "review_poll_pending"],),
+    ),
+    "get_active_appeal_by_user": (
+        "SELECT case_id FROM appeals WHERE (applicant_info->>'id')::bigint = %s AND status != 'closed' AND status != 'closed_after_review'",
+        (1_000_042,),
+    ),
+    "find_editor_by_username": (
+        "SELECT user_id, username, first_name, is_inactive FROM editors WHERE username = %s",
+        ("editor_42",),
+    ),
+    "purge_processed_updates": (
+        "DELETE FROM processed_updates WHERE processed_at < NOW() - make_interval(secs => %s)",
+        (86400,),
+    ),
+}
+
+
+def _seed(cur, appeals: int, editors: int, updates: int):
+    # ~5% дел активны, остальные закрыты — как в рабочей базе.
+    cur.execute(
+        """
+        INSERT INTO appeals (case_id, applicant_chat_id, decision_text, status, created_at, applicant_info, timer_expires_at)
+        SELECT g, 1000000 + g %% 20000, 'Решение редакции №' || g,
+               CASE WHEN g %% 20 = 0 THEN (ARRAY['collecting', 'reviewing', 'review_poll_pending'])[1 + g %% 3]
+                    WHEN g %% 2 = 0 THEN 'closed' ELSE 'closed_after_review' END,
+               NOW() - g * INTERVAL '1 minute',
+               jsonb_build_object('id', 1000000 + g %% 20000, 'username', 'user_' || g %% 20000),
+               CASE WHEN g %% 20 = 0 THEN NOW() + g * INTERVAL '1 second' END
+        FROM generate_series(1, %s) AS g
+        """,
+        (appeals,)
+    )
+    cur.execute(
+        "INSERT INTO editors (user_id, username, first_name, is_inactive) "
+        "SELECT g, 'editor_' || g, 'Редактор ' || g, g %% 10 = 0 FROM generate_series(1, %s) AS g",
+        (editors,)
+    )
+    cur.execute(
+        "INSERT INTO processed_updates (update_id, processed_at) "
+        "SELECT g, NOW() - g * INTERVAL '1 second' FROM generate_series(1, %s) AS g",
+        (updates,)
+    )
+    cur.execute("ANALYZE appeals; ANALYZE editors; ANALYZE processed_updates;")
+
+
+def _plan_nodes(plan: dict) -> list:
+    node = plan["Node Type"]
+    if plan.get("Index Name"):
+        node += f" ({plan['Index Name']})"
+    nodes = [node]
+    for child in plan.get("Plans", []):
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+
+def _explain(cur, text: bool) -> dict:
+    plans = {}
+    for name, (query, params) in QUERIES.items():
+        # DELETE тоже выполняется: всё откатится вместе с транзакцией, но в savepoint, чтобы «после» видело те же строки.
+        cur.execute("SAVEPOINT explain_query")
+        cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", params)
+        result = cur.fetchone()[0][0]
+        entry = {
+            "nodes": _plan_nodes(result["Plan"]),
+            "execution_ms": round(result["Execution Time"], 3),
+            "shared_buffers": result["Plan"].get("Shared Hit Blocks", 0) + result["Plan"].get("Shared Read Blocks", 0),
+        }
+        if text:
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params)
+            entry["plan"] = [row[0] for row in cur.fetchall()]
+        cur.execute("ROLLBACK TO SAVEPOINT explain_query")
+        plans[name] = entry
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--appeals", type=int, default=50000)
+    parser.add_argument("--editors", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=100000)
+    parser.add_argument("--text", action="store_true", help="добавить текстовые планы")
+    args = parser.parse_args()
+
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        sys.exit("Не найдена переменная окружения DATABASE_URL.")
+    if dsn.startswith("postgres://"):
+        dsn = dsn.replace("postgres://", "postgresql://", 1)
+
+    # ClientCursor подставляет параметры на клиенте: EXPLAIN не принимает серверные параметры.
+    with psycopg.connect(dsn, cursor_factory=psycopg.ClientCursor) as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"CREATE SCHEMA {SCHEMA}")
+                cur.execute(f"SET LOCAL search_path TO {SCHEMA}")
+                for number, _, statements in migrations.MIGRATIONS:
+                    if number < INDEX_MIGRATION:
+                        for statement in statements:
+                            cur.execute(statement)
+                _seed(cur, args.appeals, args.editors, args.updates)
+                before = _explain(cur, args.text)
+
+                for number, _, statements in migrations.MIGRATIONS:
+                    if number == INDEX_MIGRATION:
+                        for statement in statements:
+                            cur.execute(statement)
+                cur.execute("ANALYZE appeals; ANALYZE editors; ANALYZE processed_updates;")
+                after = _explain(cur, args.text)
+        finally:
+            conn.rollback()
+
+    report = {
+        "rows": {"appeals": args.appeals, "editors": args.editors, "processed_updates": args.updates},
+        "queries": {name: {"before": before[name], "after": after[name]} for name in QUERIES},
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Замер холодного старта бота.
+
+Для каждого прогона в отдельном процессе измеряется:
+  - import_s — время `import main` (все модули, регистрация обработчиков);
+  - first_health_s — время от запуска gunicorn (как в Procfile) до первого
+    ответа 200 на GET /.
+
+Токен Telegram берётся из окружения; если его нет, подставляется фиктивный
+(сеть при импорте не нужна, фоновые проверки API просто завершатся ошибкой).
+С --importtime дополнительно печатаются самые медленные модули по данным
+`python -X importtime`.
+
+Запуск из корня репозитория:
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --skip-gunicorn --importtime
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("HJRBOT_TELEGRAM_TOKEN", "0:benchmark")
+    env.pop("WEBHOOK_BASE_URL", None)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, timeout=120,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import main завершился с ошибкой:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_first_health(timeout: float) -> float:
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "-w", "1", "--threads", "8", "main:app"],
+        cwd=ROOT, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"gunicorn завершился с кодом {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f"GET / не ответил за {timeout:.0f} с")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def slowest_imports(limit: int) -> list:
+    """Самые медленные модули по суммарному времени (мкс) из -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, timeout=120,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:       123 |       456 |   module"
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    rows.sort(key=lambda row: row["cumulative_us"], reverse=True)
+    return rows[:limit]
+
+
+def _summary(values: list) -> dict:
+    if not values:
+        return {}
+    return {
+        "runs": len(values),
+        "min": round(min(values), 4),
+        "median": round(statistics.median(values), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать первого ответа GET /")
+    parser.add_argument("--skip-gunicorn", action="store_true", help="замерить только импорт")
+    parser.add_argument("--importtime", type=int, nargs="?", const=15, default=0, metavar="N",
+                        help="показать N самых медленных модулей")
+    args = parser.parse_args()
+
+    import_times, health_times = [], []
+    for _ in range(args.runs):
+        import_times.append(measure_import())
+        if not args.skip_gunicorn:
+            health_times.append(measure_first_health(args.timeout))
+
+    report = {"import_s": _summary(import_times)}
+    if health_times:
+        report["first_health_s"] = _summary(health_times)
+    if args.importtime:
+        report["slowest_imports"] = slowest_imports(args.importtime)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
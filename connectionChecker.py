@@ -2,11 +2,50 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
+import logging
+import threading
 import psycopg
-import google.generativeai as genai
+from psycopg_pool import ConnectionPool
 from telebot import apihelper
 
-db_conn = None
+import migrations
+from geminiClient import GEMINI_MODEL_NAME
+
+# Пул соединений с PostgreSQL. Каждый вызов appealManager берёт соединение
+# из пула и возвращает его обратно, поэтому потоки gunicorn и фоновый
+# поток таймеров больше не делят один сокет.
+log = logging.getLogger("hjr-bot.connection")
+
+db_pool = None
+_pool_lock = threading.Lock()
+# Доступно ли расширение pg_trgm (индексированный поиск похожих апелляций).
+trgm_available = False
+# Миграции и проверка pg_trgm выполняются один раз за процесс, а не при каждом переподключении.
+_schema_ready = False
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Сколько секунд поток ждёт свободное соединение, прежде чем получить ошибку.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Проверки внешних API: таймаут одной проверки и пауза между повторами проваленных.
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "15"))
+HEALTH_RETRY_MIN = float(os.getenv("HEALTH_RETRY_MIN", "15"))
+HEALTH_RETRY_MAX = float(os.getenv("HEALTH_RETRY_MAX", "300"))
+
+PROBES = ("telegram", "gemini", "database")
+PROBE_TITLES = {"telegram": "Telegram API", "gemini": "Gemini API", "database": "PostgreSQL"}
+# Проверка БД включает открытие пула и миграции, поэтому ей нужно больше времени.
+PROBE_TIMEOUTS = {
+    "telegram": HEALTH_PROBE_TIMEOUT,
+    "gemini": HEALTH_PROBE_TIMEOUT,
+    "database": max(HEALTH_PROBE_TIMEOUT, DB_POOL_TIMEOUT + 10),
+}
+# ok: None — проверка ещё не выполнялась.
+_health = {name: {"ok": None, "detail": None, "checked_at": None, "latency_ms": None, "failures": 0} for name in PROBES}
+_health_cond = threading.Condition()
+_retry_thread = None
 
 def _normalize_dsn(dsn: str) -> str:
     if not dsn: return dsn
@@ -14,117 +53,259 @@ def _normalize_dsn(dsn: str) -> str:
         return dsn.replace("postgres://", "postgresql://", 1)
     return dsn
 
-def _create_and_migrate_tables(conn: psycopg.Connection):
+def _enable_trigram_search(conn: psycopg.Connection):
     """
-    Создаёт и/или обновляет таблицы в базе данных до актуальной схемы.
+    Включает pg_trgm и GIN-индекс по decision_text для поиска похожих апелляций.
+    Если расширение недоступно (нет прав), поиск работает без индекса.
     """
+    global trgm_available
     with conn.cursor() as cur:
-        # Основная таблица апелляций
-        cur.execute("""
-                    CREATE TABLE IF NOT EXISTS appeals (
-                                                           case_id INTEGER PRIMARY KEY,
-                                                           applicant_chat_id BIGINT,
-                                                           decision_text TEXT,
-                                                           applicant_arguments TEXT,
-                                                           applicant_answers JSONB,
-                                                           council_answers JSONB,
-                                                           total_voters INTEGER,
-                                                           status TEXT,
-                                                           expected_responses INTEGER,
-                                                           timer_expires_at TIMESTAMPTZ,
-                                                           ai_verdict TEXT,
-                                                           message_thread_id INTEGER,
-                                                           is_reviewed BOOLEAN DEFAULT FALSE,
-                                                           review_data JSONB,
-                                                           commit_hash VARCHAR(40),
-                        verdict_log_id INTEGER
-                        );
-                    """)
-
-        # Таблица состояний (FSM)
-        cur.execute("""
-                    CREATE TABLE IF NOT EXISTS user_states (
-                                                               user_id TEXT PRIMARY KEY,
-                                                               state TEXT,
-                                                               data JSONB,
-                                                               updated_at TIMESTAMPTZ DEFAULT NOW()
-                        );
-                    """)
-
-        # Таблица редакторов
-        cur.execute("""
-                    CREATE TABLE IF NOT EXISTS editors (
-                                                           user_id BIGINT PRIMARY KEY,
-                                                           username TEXT,
-                                                           first_name TEXT
-                    );
-                    """)
-
-        # --- НАЧАЛО ИЗМЕНЕНИЙ: Миграция схемы таблицы editors ---
         try:
-            cur.execute("ALTER TABLE editors ADD COLUMN IF NOT EXISTS is_inactive BOOLEAN DEFAULT FALSE;")
-            print("Миграция: Колонка 'is_inactive' успешно добавлена/проверена в 'editors'.")
-        except Exception:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            conn.commit()
+        except Exception as e:
             conn.rollback()
-
+            print(f"Миграция: Не удалось создать расширение pg_trgm: {e}")
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm';")
+        if cur.fetchone() is None:
+            trgm_available = False
+            print("Миграция: pg_trgm недоступен, поиск похожих апелляций будет работать без индекса.")
+            return
         try:
-            # Добавляем колонку role с ролью по умолчанию 'editor'
-            cur.execute("ALTER TABLE editors ADD COLUMN IF NOT EXISTS role TEXT DEFAULT 'editor';")
-            print("Миграция: Колонка 'role' успешно добавлена/проверена в 'editors'.")
-        except Exception:
+            cur.execute("CREATE INDEX IF NOT EXISTS appeals_decision_text_trgm_idx ON appeals USING gin (decision_text gin_trgm_ops);")
+            conn.commit()
+            trgm_available = True
+            print("Миграция: Индекс pg_trgm по 'decision_text' успешно создан/проверен.")
+        except Exception as e:
             conn.rollback()
-        # --- КОНЕЦ ИЗМЕНЕНИЙ ---
-
-    conn.commit()
-    print("Проверка и миграция таблиц завершена.")
+            trgm_available = False
+            print(f"Миграция: Не удалось создать индекс pg_trgm: {e}")
 
+def _open_pool(dsn: str) -> ConnectionPool:
+    pool = ConnectionPool(
+        dsn,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=max(DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE),
+        timeout=DB_POOL_TIMEOUT,
+        # Проверяем соединение при выдаче: разорванные соединения
+        # отбрасываются, и пул сам открывает новые взамен.
+        check=ConnectionPool.check_connection,
+        kwargs={"autocommit": False},
+        name="hjr-bot",
+        open=False,
+    )
+    try:
+        pool.open(wait=True, timeout=DB_POOL_TIMEOUT)
+    except Exception:
+        # Иначе пул продолжит открывать соединения в фоне, а ссылки на него уже не будет.
+        pool.close()
+        raise
+    return pool
 
 def check_db_connection() -> bool:
     """
-    Устанавливает соединение с PostgreSQL и проверяет структуру таблицы.
+    Открывает пул соединений с PostgreSQL (если он ещё не открыт) и, при первом
+    подключении процесса, применяет недостающие миграции схемы (migrations.py).
     """
-    global db_conn
+    global db_pool, _schema_ready
     dsn = _normalize_dsn(os.getenv("DATABASE_URL"))
     if not dsn:
         print("[ОШИБКА] PostgreSQL: Не найдена переменная окружения DATABASE_URL.")
         return False
     try:
-        db_conn = psycopg.connect(dsn, autocommit=False)
-        _create_and_migrate_tables(db_conn)
-        db_conn.autocommit = True
-        print("[OK] PostgreSQL: Соединение установлено и таблица проверена.")
+        with _pool_lock:
+            if db_pool is None or db_pool.closed:
+                db_pool = _open_pool(dsn)
+            if not _schema_ready:
+                with db_pool.connection() as conn:
+                    applied = migrations.run_migrations(conn)
+                    _enable_trigram_search(conn)
+                _schema_ready = True
+                print(f"Схема БД актуальна (версия {migrations.LATEST_VERSION}, применено миграций: {len(applied)}).")
+        print(f"[OK] PostgreSQL: Пул соединений открыт (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}) и схема проверена.")
         return True
     except Exception as e:
         print(f"[ОШИБКА] PostgreSQL: Не удалось подключиться или настроить таблицу. {e}")
         return False
 
+def start_listener(channel: str, on_notify, on_connect=None) -> threading.Thread:
+    """
+    Запускает фоновый поток, слушающий LISTEN <channel> на отдельном соединении.
+    on_notify(payload) вызывается на каждое уведомление; on_connect() — после
+    каждого (пере)подключения, чтобы подписчик мог сбросить устаревшие данные.
+    """
+    def _listen_forever():
+        while True:
+            dsn = _normalize_dsn(os.getenv("DATABASE_URL"))
+            try:
+                with psycopg.connect(dsn, autocommit=True) as conn:
+                    conn.execute(psycopg.sql.SQL("LISTEN {}").format(psycopg.sql.Identifier(channel)))
+                    log.info(f"Подписка LISTEN '{channel}' установлена.")
+                    if on_connect:
+                        on_connect()
+                    for notify in conn.notifies():
+                        try:
+                            on_notify(notify.payload)
+                        except Exception as e:
+                            log.error(f"Ошибка обработки уведомления '{channel}': {e}")
+            except Exception as e:
+                log.warning(f"Соединение LISTEN '{channel}' потеряно: {e}. Переподключение через 5 секунд.")
+            time.sleep(5)
+
+    thread = threading.Thread(target=_listen_forever, name=f"listen-{channel}", daemon=True)
+    thread.start()
+    return thread
+
+def get_pool_stats() -> dict:
+    """
+    Возвращает метрики пула соединений для мониторинга.
+    """
+    if db_pool is None:
+        return {"status": "not_initialized"}
+    stats = db_pool.get_stats()
+    size = stats.get("pool_size", 0)
+    available = stats.get("pool_available", 0)
+    queued = stats.get("requests_queued", 0)
+    wait_ms = stats.get("requests_wait_ms", 0)
+    return {
+        "status": "closed" if db_pool.closed else "open",
+        "min_size": db_pool.min_size,
+        "max_size": db_pool.max_size,
+        "size": size,
+        "in_use": size - available,
+        "available": available,
+        "waiting": stats.get("requests_waiting", 0),
+        "requests_total": stats.get("requests_num", 0),
+        "requests_queued": queued,
+        "wait_ms_total": wait_ms,
+        "wait_ms_avg": round(wait_ms / queued, 2) if queued else 0,
+        "timeouts": stats.get("requests_errors", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+    }
+
+def _probe_telegram(bot) -> str:
+    return f"подключен как @{bot.get_me().username}"
+
+def _probe_gemini() -> str:
+    gemini_api_key = os.getenv("GEMINI_API_KEY")
+    if not gemini_api_key:
+        raise RuntimeError("Не найден GEMINI_API_KEY.")
+    import google.generativeai as genai
+
+    genai.configure(api_key=gemini_api_key)
+    genai.get_model(GEMINI_MODEL_NAME)
+    return "ключ успешно прошел аутентификацию"
+
+def _probe_database() -> str:
+    if not check_db_connection():
+        raise RuntimeError("Не удалось подключиться или настроить таблицы.")
+    # Пул мог быть открыт раньше: проверяем, что база действительно отвечает.
+    with db_pool.connection() as conn:
+        conn.execute("SELECT 1")
+    return "пул соединений открыт, схема проверена"
+
+def _record_probe(name: str, ok: bool, detail: str, latency_ms: float):
+    with _health_cond:
+        state = _health[name]
+        state.update(ok=ok, detail=detail, checked_at=time.time(), latency_ms=round(latency_ms, 1))
+        state["failures"] = 0 if ok else state["failures"] + 1
+        _health_cond.notify_all()
+
+def _run_probes(bot, names) -> bool:
+    """Запускает проверки параллельно; проверка, не уложившаяся в свой таймаут, считается проваленной."""
+    probes = {"telegram": lambda: _probe_telegram(bot), "gemini": _probe_gemini, "database": _probe_database}
+    results = {}
+
+    def run(name):
+        started = time.perf_counter()
+        try:
+            outcome = (True, probes[name]())
+        except Exception as e:
+            outcome = (False, str(e))
+        results[name] = outcome + ((time.perf_counter() - started) * 1000,)
+
+    threads = [threading.Thread(target=run, args=(name,), name=f"probe-{name}", daemon=True) for name in names]
+    for thread in threads:
+        thread.start()
+    started = time.monotonic()
+    for name, thread in zip(names, threads):
+        thread.join(max(started + PROBE_TIMEOUTS[name] - time.monotonic(), 0))
+
+    all_ok = True
+    for name in names:
+        timeout = PROBE_TIMEOUTS[name]
+        ok, detail, latency_ms = results.get(name, (False, f"нет ответа за {timeout:.0f} с", timeout * 1000))
+        _record_probe(name, ok, detail, latency_ms)
+        print(f"[{'OK' if ok else 'ОШИБКА'}] {PROBE_TITLES[name]}: {detail} ({latency_ms:.0f} мс)")
+        all_ok = all_ok and ok
+    return all_ok
+
 def check_all_apis(bot) -> bool:
     """
-    Проверяет доступность всех API: Telegram, Gemini и PostgreSQL.
+    Параллельно проверяет доступность Telegram, Gemini и PostgreSQL.
+    Результаты сохраняются и доступны через health_status().
     """
     print("--- Начало проверки API ---")
+    if _run_probes(bot, PROBES):
+        print("--- Все проверки API пройдены успешно! ---")
+        return True
+    print(f"--- Недоступно: {', '.join(health_status()['degraded'])} ---")
+    return False
 
-    try:
-        bot_info = bot.get_me()
-        print(f"[OK] Telegram API: Успешно подключен как @{bot_info.username}")
-    except Exception as e:
-        print(f"[ОШИБКА] Telegram API: {e}")
-        return False
+def start_health_retries(bot):
+    """
+    Запускает фоновый поток, который повторяет проваленные проверки с
+    нарастающей паузой, пока все API не станут доступны.
+    """
+    global _retry_thread
 
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if not GEMINI_API_KEY:
-        print("[ОШИБКА] Gemini API: Не найден GEMINI_API_KEY.")
-        return False
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        genai.get_model("models/gemini-1.5-pro-latest")
-        print("[OK] Gemini API: Ключ успешно прошел аутентификацию.")
-    except Exception as e:
-        print(f"[ОШИБКА] Gemini API: {e}")
-        return False
+    def _retry_failed():
+        global _retry_thread
+        attempt = 0
+        while True:
+            with _health_cond:
+                failed = [name for name in PROBES if not _health[name]["ok"]]
+                if not failed:
+                    _retry_thread = None
+                    log.info("Все API доступны, бот вышел из ограниченного режима.")
+                    return
+            delay = min(HEALTH_RETRY_MAX, HEALTH_RETRY_MIN * 2 ** attempt)
+            log.warning(f"Недоступно: {', '.join(failed)}. Повторная проверка через {delay:.0f} с.")
+            time.sleep(delay)
+            _run_probes(bot, failed)
+            attempt += 1
 
-    if not check_db_connection():
-        return False
+    with _health_cond:
+        if _retry_thread is not None:
+            return
+        _retry_thread = threading.Thread(target=_retry_failed, name="health-retry", daemon=True)
+    _retry_thread.start()
+
+def wait_until_healthy(name: str, timeout: float = None) -> bool:
+    """Ждёт успешной проверки name (telegram, gemini или database)."""
+    with _health_cond:
+        return _health_cond.wait_for(lambda: _health[name]["ok"], timeout)
 
-    print("--- Все проверки API пройдены успешно! ---")
-    return True
\ No newline at end of file
+def health_status() -> dict:
+    """
+    Последние результаты проверок. degraded — проваленные проверки,
+    pending — ещё не выполненные; ready — все проверки пройдены.
+    """
+    now = time.time()
+    with _health_cond:
+        probes = {
+            name: {
+                "ok": state["ok"],
+                "detail": state["detail"],
+                "checked_ago_seconds": round(now - state["checked_at"], 1) if state["checked_at"] else None,
+                "latency_ms": state["latency_ms"],
+                "failures": state["failures"],
+            }
+            for name, state in _health.items()
+        }
+    return {
+        "ready": all(probe["ok"] for probe in probes.values()),
+        "degraded": [name for name, probe in probes.items() if probe["ok"] is False],
+        "pending": [name for name, probe in probes.items() if probe["ok"] is None],
+        "probes": probes,
+    }
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик дедлайнов дел (timer_expires_at).
+
+Держит min-heap ближайших дедлайнов и спит до следующего из них. appealManager
+будит его через условную переменную при каждой установке таймера. При старте
+и периодически (на случай изменений из других процессов) очередь
+перестраивается из БД, поэтому таймеры не теряются при перезапуске.
+Если обработчик дедлайна упал, дело повторяется через SCHEDULER_RETRY_SECONDS.
+"""
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from datetime import datetime, timezone
+
+log = logging.getLogger("hjr-bot.scheduler")
+
+# Как часто (в секундах) сверять очередь с БД.
+SCHEDULER_RESYNC_SECONDS = float(os.getenv("SCHEDULER_RESYNC_SECONDS", "600"))
+# Через сколько секунд повторить дедлайн, обработка которого завершилась ошибкой.
+SCHEDULER_RETRY_SECONDS = float(os.getenv("SCHEDULER_RETRY_SECONDS", "60"))
+
+
+def _to_timestamp(expires_at) -> float:
+    if isinstance(expires_at, datetime):
+        if expires_at.tzinfo is None:
+            # Таймеры пишутся через datetime.utcnow(), т.е. наивные даты — это UTC.
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return expires_at.timestamp()
+    return float(expires_at)
+
+
+class DeadlineScheduler:
+    def __init__(self, resync_interval: float = SCHEDULER_RESYNC_SECONDS):
+        self.resync_interval = resync_interval
+        self._cond = threading.Condition()
+        self._heap = []
+        # Актуальный дедлайн по каждому делу; устаревшие записи кучи пропускаются.
+        self._deadlines = {}
+        self._sequence = itertools.count()
+        # Номер последнего schedule/cancel по делу: rebuild не должен затирать
+        # изменения, сделанные после того, как из БД был прочитан снимок.
+        self._changed = {}
+        self.fired = 0
+
+    def schedule(self, case_id, expires_at):
+        """Ставит (или переносит) дедлайн дела и будит поток планировщика."""
+        if expires_at is None:
+            self.cancel(case_id)
+            return
+        due = _to_timestamp(expires_at)
+        with self._cond:
+            sequence = next(self._sequence)
+            self._deadlines[case_id] = due
+            self._changed[case_id] = sequence
+            heapq.heappush(self._heap, (due, sequence, case_id))
+            self._cond.notify()
+
+    def cancel(self, case_id):
+        with self._cond:
+            self._deadlines.pop(case_id, None)
+            self._changed[case_id] = next(self._sequence)
+
+    def snapshot_marker(self) -> int:
+        """Метка, которую нужно взять до чтения дедлайнов из БД и передать в rebuild(since=...)."""
+        with self._cond:
+            return next(self._sequence)
+
+    def rebuild(self, deadlines, since: int = None):
+        """
+        Заменяет очередь списком пар (case_id, timer_expires_at) из БД. Если
+        передана since, дела, которые ставились или снимались после неё, остаются
+        такими, как в памяти: снимок из БД мог их ещё не видеть.
+        """
+        with self._cond:
+            fresh = {case_id: _to_timestamp(expires_at) for case_id, expires_at in deadlines if expires_at}
+            if since is not None:
+                for case_id, sequence in self._changed.items():
+                    if sequence <= since:
+                        continue
+                    if case_id in self._deadlines:
+                        fresh[case_id] = self._deadlines[case_id]
+                    else:
+                        fresh.pop(case_id, None)
+                self._changed = {case_id: sequence for case_id, sequence in self._changed.items() if sequence > since}
+            self._deadlines = fresh
+            self._heap = [(due, next(self._sequence), case_id) for case_id, due in self._deadlines.items()]
+            heapq.heapify(self._heap)
+            self._cond.notify()
+        log.info(f"Очередь дедлайнов перестроена: {len(self._deadlines)} дел.")
+
+    def _next_due(self, now: float, resync_at: float):
+        """Ждёт ближайший дедлайн; возвращает case_id или None, если пора сверяться с БД."""
+        with self._cond:
+            while True:
+                while self._heap and self._deadlines.get(self._heap[0][2]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if self._heap and self._heap[0][0] <= now:
+                    _, _, case_id = heapq.heappop(self._heap)
+                    del self._deadlines[case_id]
+                    return case_id
+                if now >= resync_at:
+                    return None
+                timeout = resync_at - now
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - now)
+                self._cond.wait(timeout)
+                now = time.time()
+
+    def run(self, handler, loader):
+        """
+        Основной цикл: handler(case_id) вызывается по наступлении дедлайна,
+        loader() возвращает актуальные пары (case_id, timer_expires_at) из БД.
+        """
+        resync_at = 0.0
+        while True:
+            now = time.time()
+            if now >= resync_at:
+                try:
+                    since = self.snapshot_marker()
+                    self.rebuild(loader(), since)
+                except Exception as e:
+                    log.error(f"Не удалось перестроить очередь дедлайнов: {e}", exc_info=True)
+                resync_at = now + self.resync_interval
+            case_id = self._next_due(time.time(), resync_at)
+            if case_id is None:
+                continue
+            self.fired += 1
+            try:
+                handler(case_id)
+            except Exception as e:
+                log.error(f"Ошибка при обработке дедлайна дела #{case_id}: {e}", exc_info=True)
+                self._retry_later(case_id)
+
+    def _retry_later(self, case_id):
+        """Дедлайн уже снят с очереди: ставим повтор, если обработчик не назначил новый."""
+        with self._cond:
+            if case_id in self._deadlines:
+                return
+            self.schedule(case_id, time.time() + SCHEDULER_RETRY_SECONDS)
+        log.info(f"Дедлайн дела #{case_id} будет повторён через {SCHEDULER_RETRY_SECONDS:.0f} с.")
+
+    def stats(self) -> dict:
+        with self._cond:
+            next_due = min(self._deadlines.values()) if self._deadlines else None
+        return {
+            "scheduled": len(self._deadlines),
+            "next_due_in_seconds": round(next_due - time.time(), 1) if next_due is not None else None,
+            "fired": self.fired,
+        }
+
+
+deadline_scheduler = DeadlineScheduler()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Очередь финального рассмотрения дел.
+
+Финализация (запрос к Gemini, Telegraph, рассылка в Telegram) выполняется в
+ограниченном пуле потоков, а не в потоке планировщика или обработчика.
+Одно и то же дело не может финализироваться дважды одновременно.
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import appealManager
+
+log = logging.getLogger("hjr-bot.finalization")
+
+FINALIZE_CONCURRENCY = int(os.getenv("FINALIZE_CONCURRENCY", "2"))
+
+_context = {"bot": None, "commit_hash": "N/A", "bot_version": "dev-build"}
+
+_executor = ThreadPoolExecutor(max_workers=max(FINALIZE_CONCURRENCY, 1), thread_name_prefix="finalize")
+_lock = threading.Lock()
+_in_flight = set()
+_stats = {"submitted": 0, "deduplicated": 0, "running": 0, "completed": 0, "failed": 0}
+
+
+def configure(bot, commit_hash: str, bot_version: str):
+    """Сохраняет бота и версии, с которыми будут выноситься вердикты."""
+    _context.update(bot=bot, commit_hash=commit_hash, bot_version=bot_version)
+
+
+def submit_appeal_finalization(case_id, regenerate: bool = False) -> bool:
+    """
+    Ставит дело в очередь на финальное рассмотрение. Возвращает False, если оно уже в очереди.
+    regenerate=True запрашивает новый вердикт, даже если для того же промпта он уже сохранён.
+    """
+    return _submit(case_id, _finalize_appeal, regenerate)
+
+
+def submit_review_finalization(case_id, regenerate: bool = False) -> bool:
+    """Ставит дело в очередь на финальное рассмотрение после пересмотра."""
+    return _submit(case_id, _finalize_review, regenerate)
+
+
+# Из каких статусов /regenerate возвращает дело в работу и на какую стадию.
+REGENERATE_STAGES = {
+    'collecting': 'collecting',
+    appealManager.FINALIZE_FAILED_STATUS: 'collecting',
+    'closed': 'collecting',
+    'reviewing': 'reviewing',
+    appealManager.REVIEW_FINALIZE_FAILED_STATUS: 'reviewing',
+    'closed_after_review': 'reviewing',
+}
+
+
+def submit_regeneration(case_id):
+    """
+    Повторная финализация по команде /regenerate: возвращает дело на стадию
+    сбора ответов (или пересмотра) и запрашивает у модели новый вердикт, не
+    беря его из verdict_cache. Возвращает None, если дело поставлено в очередь,
+    иначе — текст причины отказа.
+    """
+    appeal_data = appealManager.get_appeal(case_id)
+    if not appeal_data:
+        return f"Дело №{case_id} не найдено."
+    status = appeal_data.get('status')
+    stage = REGENERATE_STAGES.get(status)
+    if stage is None:
+        return f"Дело №{case_id} в статусе '{status}' нельзя отправить на повторную финализацию."
+    with _lock:
+        if case_id in _in_flight:
+            return f"Дело №{case_id} уже финализируется."
+    if not appealManager.update_appeal_fields(case_id, status=stage, finalize_attempts=0):
+        return f"Не удалось обновить дело №{case_id}."
+    submit = submit_appeal_finalization if stage == 'collecting' else submit_review_finalization
+    if not submit(case_id, regenerate=True):
+        return f"Дело №{case_id} уже финализируется."
+    return None
+
+
+def _submit(case_id, target, regenerate: bool) -> bool:
+    with _lock:
+        if case_id in _in_flight:
+            _stats["deduplicated"] += 1
+            log.info(f"Дело #{case_id} уже в очереди на финализацию, повторная постановка пропущена.")
+            return False
+        _in_flight.add(case_id)
+        _stats["submitted"] += 1
+    _executor.submit(_run, case_id, target, regenerate)
+    return True
+
+
+def _run(case_id, target, regenerate):
+    with _lock:
+        _stats["running"] += 1
+    try:
+        target(case_id, regenerate)
+        outcome = "completed"
+    except Exception as e:
+        log.error(f"Ошибка при финализации дела #{case_id}: {e}", exc_info=True)
+        outcome = "failed"
+    finally:
+        with _lock:
+            _stats["running"] -= 1
+            _in_flight.discard(case_id)
+    with _lock:
+        _stats[outcome] += 1
+
+
+def _finalize_appeal(case_id, regenerate):
+    from geminiProcessor import finalize_appeal
+
+    appeal_data = appealManager.get_appeal(case_id)
+    if not appeal_data or appeal_data.get('status') != 'collecting':
+        log.info(f"Дело #{case_id} уже не на стадии сбора ответов, финализация не требуется.")
+        return
+    finalize_appeal(appeal_data, _context["bot"], _context["commit_hash"], _context["bot_version"], regenerate)
+
+
+def _finalize_review(case_id, regenerate):
+    from geminiProcessor import finalize_review
+
+    appeal_data = appealManager.get_appeal(case_id)
+    if not appeal_data or appeal_data.get('status') != 'reviewing':
+        log.info(f"Дело #{case_id} уже не на стадии пересмотра, финализация не требуется.")
+        return
+    finalize_review(appeal_data, _context["bot"], _context["commit_hash"], _context["bot_version"], regenerate)
+
+
+def get_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["in_flight"] = len(_in_flight)
+    stats["queued"] = stats["in_flight"] - stats["running"]
+    stats["concurrency"] = max(FINALIZE_CONCURRENCY, 1)
+    return stats
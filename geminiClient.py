@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Обёртка над generate_content с защитой от сбоев Gemini API.
+
+- token bucket: не более GEMINI_REQUESTS_PER_MINUTE запросов в минуту;
+- повтор временных ошибок (429, 5xx, таймауты) с экспоненциальной задержкой и джиттером;
+- circuit breaker: после GEMINI_BREAKER_THRESHOLD подряд неудачных вызовов
+  запросы не отправляются GEMINI_BREAKER_COOLDOWN секунд, затем проходит один пробный.
+
+Если ответ получить не удалось, generate бросает GeminiUnavailable. Временную
+недоступность вызывающий код переживает, откладывая дело (см. geminiProcessor);
+при permanent=True (промпт заблокирован, неверный запрос, нет доступа) повтор
+не поможет, и дело останавливается. rejected=True — запрос вообще не
+отправлялся (лимит частоты или открытый circuit breaker): это пауза, а не
+неудачная попытка.
+"""
+import os
+import time
+import random
+import logging
+import threading
+
+from metrics import Histogram
+from rateLimit import TokenBucket
+
+log = logging.getLogger("hjr-bot.gemini_client")
+
+# Модель для вердиктов и для context caching. Версия зафиксирована: кеширование
+# не работает с алиасами *-latest, а вердикт не должен зависеть от того,
+# удалось ли создать кеш.
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "models/gemini-1.5-pro-002")
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "10"))
+# Сколько ждать свободного токена, прежде чем отложить дело.
+GEMINI_RATE_LIMIT_WAIT = float(os.getenv("GEMINI_RATE_LIMIT_WAIT", "120"))
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "2"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "60"))
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "300"))
+
+TOKEN_BUCKETS = (1000, 2000, 5000, 10000, 20000, 30000, 50000, 100000)
+
+# Ошибки google.api_core и SDK, после которых повтор того же запроса не поможет
+# (сравниваются с именами всех классов в MRO исключения). Всё остальное,
+# включая сетевые ошибки requests и RetryError, считается временным.
+_PERMANENT_ERROR_NAMES = {
+    "InvalidArgument", "BadRequest", "PermissionDenied", "Forbidden", "Unauthenticated", "Unauthorized",
+    "NotFound", "FailedPrecondition", "BlockedPromptException", "StopCandidateException",
+}
+
+
+class GeminiUnavailable(Exception):
+    """
+    Ответ модели получить не удалось; retry_after — через сколько секунд пробовать снова.
+    permanent=True — ошибка не временная, и тот же запрос снова упадёт.
+    rejected=True — запрос отклонён локально и в API не уходил.
+    """
+
+    def __init__(self, message: str, retry_after: float = None, permanent: bool = False, rejected: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+        self.rejected = rejected
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # ValueError бросает response.text, если ответ заблокирован фильтрами.
+    if isinstance(error, ValueError):
+        return False
+    return not any(cls.__name__ in _PERMANENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = GEMINI_BREAKER_THRESHOLD, cooldown: float = GEMINI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self.opened_total = 0
+
+    def allow(self) -> float:
+        """Возвращает 0, если запрос можно отправлять, иначе — сколько секунд ещё ждать."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._probe_in_flight:
+                return self.cooldown
+            # Полуоткрытое состояние: пропускаем один пробный запрос.
+            self._probe_in_flight = True
+            return 0.0
+
+    def release_probe(self):
+        """Пробный запрос так и не был отправлен: следующий вызов allow() пропустит новый."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                log.info("Gemini API снова отвечает, circuit breaker закрыт.")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probe_in_flight or (self._opened_at is None and self._failures >= self.threshold):
+                if self._opened_at is None:
+                    self.opened_total += 1
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                log.warning(f"Gemini API недоступен ({self._failures} ошибок подряд), запросы приостановлены на {self.cooldown:.0f} с.")
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._probe_in_flight else "open"
+
+
+class GeminiClient:
+    def __init__(self, requests_per_minute: float = GEMINI_REQUESTS_PER_MINUTE, max_attempts: int = GEMINI_MAX_ATTEMPTS,
+                 rate_limit_wait: float = GEMINI_RATE_LIMIT_WAIT):
+        self.bucket = TokenBucket(requests_per_minute, per=60.0)
+        self.breaker = CircuitBreaker()
+        self.max_attempts = max(max_attempts, 1)
+        self.rate_limit_wait = rate_limit_wait
+        self.latency_ms = Histogram()
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.output_tokens = Histogram(TOKEN_BUCKETS)
+        self.cached_tokens = Histogram(TOKEN_BUCKETS)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "succeeded": 0, "retries": 0, "transient_errors": 0, "failed": 0, "rejected": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def generate(self, model, contents, **kwargs):
+        """model.generate_content(contents) с ограничением частоты, повторами и circuit breaker."""
+        if model is None:
+            raise GeminiUnavailable("Модель Gemini не инициализирована.")
+        for attempt in range(self.max_attempts):
+            # Сначала breaker: отклонённый им запрос не должен тратить токен лимита.
+            # Если до отказа уже были настоящие неудачные запросы, это неудачная попытка, а не пауза.
+            wait = self.breaker.allow()
+            if wait > 0:
+                self._count("rejected")
+                raise GeminiUnavailable("Gemini API временно недоступен (circuit breaker).", retry_after=wait, rejected=attempt == 0)
+            if not self.bucket.acquire(timeout=self.rate_limit_wait):
+                self.breaker.release_probe()
+                self._count("rejected")
+                raise GeminiUnavailable("Превышен лимит запросов к Gemini API.", retry_after=self.rate_limit_wait, rejected=attempt == 0)
+
+            self._count("requests")
+            started = time.perf_counter()
+            try:
+                response = model.generate_content(contents, **kwargs)
+                text = response.text  # бросает ValueError, если ответ заблокирован или пуст
+            except Exception as e:
+                self.latency_ms.observe((time.perf_counter() - started) * 1000)
+                if not is_transient(e):
+                    self.breaker.record_success()
+                    self._count("failed")
+                    raise GeminiUnavailable(f"Ошибка Gemini API: {e}", permanent=True) from e
+                self.breaker.record_failure()
+                self._count("transient_errors")
+                if attempt + 1 >= self.max_attempts:
+                    self._count("failed")
+                    raise GeminiUnavailable(f"Gemini API не ответил после {self.max_attempts} попыток: {e}") from e
+                delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+                log.warning(f"Временная ошибка Gemini API ({type(e).__name__}: {e}), повтор через {delay:.1f} с.")
+                self._count("retries")
+                time.sleep(delay)
+                continue
+
+            self.latency_ms.observe((time.perf_counter() - started) * 1000)
+            self.breaker.record_success()
+            self._count("succeeded")
+            self._observe_usage(response)
+            if not text:
+                raise GeminiUnavailable("Gemini API вернул пустой ответ.", permanent=True)
+            return response
+
+    def _observe_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        for histogram, field in (
+            (self.prompt_tokens, "prompt_token_count"),
+            (self.output_tokens, "candidates_token_count"),
+            (self.cached_tokens, "cached_content_token_count"),
+        ):
+            value = getattr(usage, field, None)
+            if value:
+                histogram.observe(value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(
+            breaker=self.breaker.state,
+            breaker_opened=self.breaker.opened_total,
+            latency_ms=self.latency_ms.snapshot(),
+            prompt_tokens=self.prompt_tokens.snapshot(),
+            output_tokens=self.output_tokens.snapshot(),
+            cached_tokens=self.cached_tokens.snapshot(),
+        )
+        return stats
+
+
+gemini_client = GeminiClient()
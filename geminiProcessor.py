@@ -2,43 +2,136 @@
 import os
 import logging
 import re
-import google.generativeai as genai
+import time
+import random
+import threading
 import appealManager
-from datetime import datetime
-from precedents import PRECEDENTS
+from datetime import datetime, timedelta
+from promptCache import prompt_cache, LocalCacheBackend
+from promptDocuments import prompt_documents, build_verdict_prefix
+from rulesIndex import RulesIndex
+from metrics import Histogram
+from verdictCache import verdict_cache, prompt_key
+from geminiClient import GeminiClient, gemini_client, GeminiUnavailable, GEMINI_MODEL_NAME
+import sendQueue
 from handlers.telegraph_helpers import post_to_telegraph, markdown_to_html
+from handlers.council_helpers import resolve_council_id
 
 log = logging.getLogger("hjr-bot.gemini")
 
-GEMINI_MODEL_NAME = "models/gemini-1.5-pro-latest"
+# Какой устав отправлять в промпт вердикта:
+#   full      — целиком (в кешируемом префиксе);
+#   retrieved — только разделы, найденные по делу (rulesIndex), и терминологию;
+#   compare   — в вердикт идёт full, по выборке дел теневым запросом считается и retrieved;
+#               токены и задержка обоих пишутся в /metrics.
+RULES_PROMPT_MODE = os.getenv("RULES_PROMPT_MODE", "full").strip().lower()
+# Режим compare: доля дел, по которым отправляется теневой запрос retrieved,
+# и его собственный лимит частоты (отдельно от лимита вердиктов).
+RULES_COMPARE_SAMPLE_RATE = float(os.getenv("RULES_COMPARE_SAMPLE_RATE", "0.2"))
+RULES_COMPARE_REQUESTS_PER_MINUTE = float(os.getenv("RULES_COMPARE_REQUESTS_PER_MINUTE", "2"))
+TOKEN_BUCKETS = (1000, 2000, 5000, 10000, 20000, 30000, 50000, 100000)
+# Через сколько секунд повторить финализацию, если ответ ИИ получить не удалось.
+GEMINI_REQUEUE_DELAY = float(os.getenv("GEMINI_REQUEUE_DELAY", "600"))
+# После стольких неудачных попыток подряд дело останавливается и передаётся Совету.
+GEMINI_MAX_REQUEUES = int(os.getenv("GEMINI_MAX_REQUEUES", "6"))
+
+_prompt_stats = {
+    variant: {"requests": 0, "latency_ms": Histogram(), "prompt_tokens": Histogram(TOKEN_BUCKETS)}
+    for variant in ("full", "retrieved")
+}
+_compare_skipped = {"sampled_out": 0, "no_spare_capacity": 0}
+
+# Теневые запросы compare: свой token bucket и circuit breaker, без повторов и
+# без ожидания токена, чтобы не отнимать лимит у вердиктов и не открывать их breaker.
+shadow_client = GeminiClient(RULES_COMPARE_REQUESTS_PER_MINUTE, max_attempts=1, rate_limit_wait=0)
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-gemini_model = None
 
-if GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-    except Exception as e:
-        print(f"[КРИТИЧЕСКАЯ ОШИБКА] Не удалось настроить Gemini API: {e}")
-else:
-    print("[КРИТИЧЕСКАЯ ОШИБКА] Не найден GEMINI_API_KEY.")
-
-def _read_file(filename: str, error_message: str) -> str:
-    try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        print(f"[ОШИБКА] Файл {filename} не найден.")
-        return error_message
-
-def get_verdict_from_gemini(appeal: dict, commit_hash: str, bot_version: str, log_id: int):
+# SDK Gemini импортируется и настраивается при первом запросе к модели, а не при старте процесса.
+_model_lock = threading.Lock()
+_model_state = {"model": None, "ready": False}
+
+def get_gemini_model():
+    """Возвращает модель Gemini, создавая её при первом обращении; None, если настроить не удалось."""
+    with _model_lock:
+        if _model_state["ready"]:
+            return _model_state["model"]
+        if not GEMINI_API_KEY:
+            print("[КРИТИЧЕСКАЯ ОШИБКА] Не найден GEMINI_API_KEY.")
+        else:
+            try:
+                import google.generativeai as genai
+
+                genai.configure(api_key=GEMINI_API_KEY)
+                _model_state["model"] = genai.GenerativeModel(GEMINI_MODEL_NAME)
+            except Exception as e:
+                # Неудачу не запоминаем: следующий запрос попробует снова.
+                print(f"[КРИТИЧЕСКАЯ ОШИБКА] Не удалось настроить Gemini API: {e}")
+                return None
+        _model_state["ready"] = True
+        if isinstance(prompt_cache.backend, LocalCacheBackend):
+            prompt_cache.backend.base_model = _model_state["model"]
+        return _model_state["model"]
+
+def _generate(kind: str, prefix: str, suffix: str):
+    """
+    Отправляет в модель только suffix, если префикс закеширован, иначе полный промпт.
+    Возвращает (ответ, имя модели, которая его дала).
+    """
+    gemini_model = get_gemini_model()
+    cached_model = prompt_cache.model_for(kind, prefix) if gemini_model else None
+    if cached_model is not None:
+        return gemini_client.generate(cached_model, suffix), prompt_cache.model_name
+    return _generate_uncached(prefix + suffix)
+
+def _generate_uncached(prompt: str, client: GeminiClient = gemini_client):
+    """Полный промпт без кеша префикса; возвращает (ответ, имя модели)."""
+    return client.generate(get_gemini_model(), prompt), GEMINI_MODEL_NAME
+
+def _retrieved_verdict_prompt(appeal: dict, documents, suffix: str) -> str:
+    """Промпт вердикта, в котором вместо всего устава — разделы, найденные по материалам дела."""
+    queries = [appeal.get('decision_text') or '', (appeal.get('applicant_answers') or {}).get('q1', '')]
+    queries += [answer.get('q1', '') for answer in appeal.get('council_answers') or []]
+    sections = documents.rules_index.retrieve(queries)
+    log.info(f"Для дела #{appeal.get('case_id')} выбраны разделы устава: {[s.section_id for s in sections]}")
+    return build_verdict_prefix(documents.instructions_head, RulesIndex.render(sections)) + suffix
+
+def _measured(variant: str, call):
+    """call() возвращает (ответ, имя модели); результат — (ответ, имя модели, токены промпта)."""
+    started = time.perf_counter()
+    response, model_name = call()
+    stats = _prompt_stats[variant]
+    stats["latency_ms"].observe((time.perf_counter() - started) * 1000)
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    if prompt_tokens:
+        stats["prompt_tokens"].observe(prompt_tokens)
+    stats["requests"] += 1
+    return response, model_name, prompt_tokens
+
+def get_prompt_stats() -> dict:
+    stats = {"mode": RULES_PROMPT_MODE}
+    for variant, values in _prompt_stats.items():
+        stats[variant] = {
+            "requests": values["requests"],
+            "latency_ms": values["latency_ms"].snapshot(),
+            "prompt_tokens": values["prompt_tokens"].snapshot(),
+        }
+    if RULES_PROMPT_MODE == "compare":
+        stats["compare"] = {"skipped": dict(_compare_skipped), "shadow_client": shadow_client.stats()}
+    return stats
+
+def get_verdict_from_gemini(appeal: dict, commit_hash: str, bot_version: str, log_id: int, documents=None, regenerate: bool = False):
+    """
+    Возвращает вердикт ИИ по делу. Если вердикт на точно такой же промпт уже
+    получен, он берётся из verdict_cache; regenerate=True принудительно
+    запрашивает новый вердикт у модели.
+    """
     if not appeal:
         return "Ошибка: Не удалось найти данные по делу."
 
     case_id = appeal.get('case_id')
-    project_rules = _read_file('rules.txt', "Устав проекта не найден.")
-    instructions = _read_file('instructions.txt', "Инструкции для ИИ не найдены.")
+    documents = documents or prompt_documents.current()
 
     created_at_dt = appeal.get('created_at')
     date_submitted = created_at_dt.strftime('%Y-%m-%d %H:%M UTC') if isinstance(created_at_dt, datetime) else "Неизвестно"
@@ -66,7 +159,7 @@ def get_verdict_from_gemini(appeal: dict, commit_hash: str, bot_version: str, lo
         council_full_text = "Совет не предоставил контраргументов в установленный срок."
 
     precedents_text = ""
-    similar_case = appealManager.find_similar_appeal(appeal.get('decision_text', ''), similarity_threshold=90)
+    similar_case = appealManager.find_similar_appeal(appeal.get('decision_text', ''), similarity_threshold=90, exclude_case_id=case_id)
     if similar_case:
         similar_case_data = appealManager.get_appeal(similar_case['case_id'])
         if similar_case_data:
@@ -75,23 +168,15 @@ def get_verdict_from_gemini(appeal: dict, commit_hash: str, bot_version: str, lo
 - **Предмет спора:** {similar_case_data.get('decision_text', 'не указано')}
 - **Вердикт:** {similar_case_data.get('ai_verdict', 'не указано')}
 """
-    if PRECEDENTS:
-        precedents_text += "\n\n**К сведению: Архивные прецеденты**\n"
-        for p in PRECEDENTS:
-            precedents_text += f"- Дело №{p['case_id']}: {p['summary']} Вердикт: {p['decision_summary']}\n"
-
 
-    final_instructions = instructions.format(case_id=case_id, commit_hash=commit_hash, log_id=log_id)
+    final_instructions = documents.render_instructions(case_id=case_id, commit_hash=commit_hash, log_id=log_id)
     final_instructions += f"\nВерсия релиза: {bot_version}"
     final_instructions += "\nОСОБОЕ ВНИМАНИЕ: При анализе строго придерживайтесь определений из раздела 'ТЕРМИНОЛОГИЯ' в уставе. **Сравни аргументы обеих сторон.**"
 
-    prompt = f"""
+    prefix = documents.verdict_prefix
+    suffix = f"""
 {final_instructions}
 {precedents_text}
-**Устав проекта для анализа:**
-<rules>
-{project_rules}
-</rules>
 **ДЕТАЛИ ДЕЛА №{case_id}**
 1.  **Дата подачи:** {date_submitted}
 2.  **Предмет спора (оспариваемое решение):**
@@ -104,18 +189,96 @@ def get_verdict_from_gemini(appeal: dict, commit_hash: str, bot_version: str, lo
     {council_full_text}
 """
 
-    if not gemini_model:
-        return "Ошибка: Модель Gemini не инициализирована."
+    if RULES_PROMPT_MODE == "retrieved":
+        prompt = _retrieved_verdict_prompt(appeal, documents, suffix)
+    else:
+        prompt = prefix + suffix
+    cache_key = prompt_key(GEMINI_MODEL_NAME, "verdict", prompt)
+    if not regenerate:
+        cached_verdict = verdict_cache.get(cache_key)
+        if cached_verdict is not None:
+            log.info(f"--- Вердикт по делу #{case_id} взят из кеша вердиктов (промпт не изменился) ---")
+            return cached_verdict
+
+    log.info(f"--- Отправка запроса в Gemini API по делу #{case_id} (модель: {GEMINI_MODEL_NAME}) ---")
+    if RULES_PROMPT_MODE == "retrieved":
+        response, model_name, _ = _measured("retrieved", lambda: _generate_uncached(prompt))
+    else:
+        response, model_name, full_tokens = _measured("full", lambda: _generate("verdict", prefix, suffix))
+        if RULES_PROMPT_MODE == "compare":
+            _compare_retrieved(appeal, documents, suffix, full_tokens)
+    log.info(f"--- Ответ от Gemini API по делу #{case_id} получен ---")
+    verdict_cache.put(cache_key, model_name, case_id, response.text, regenerated=regenerate)
+    return response.text
+
+def _compare_retrieved(appeal: dict, documents, suffix: str, full_tokens):
+    """
+    Режим compare: тот же запрос с найденными разделами устава, только для статистики.
+    Отправляется для доли RULES_COMPARE_SAMPLE_RATE дел и только пока у вердиктов
+    есть свободный токен и их circuit breaker закрыт.
+    """
+    case_id = appeal.get('case_id')
+    if random.random() >= RULES_COMPARE_SAMPLE_RATE:
+        _compare_skipped["sampled_out"] += 1
+        return
+    if gemini_client.bucket.wait_time() > 0 or gemini_client.breaker.state != "closed":
+        _compare_skipped["no_spare_capacity"] += 1
+        log.info(f"[RULES_COMPARE] Дело #{case_id}: теневой запрос пропущен, лимит Gemini API нужен для вердиктов.")
+        return
     try:
-        log.info(f"--- Отправка запроса в Gemini API по делу #{case_id} (модель: {GEMINI_MODEL_NAME}) ---")
-        response = gemini_model.generate_content(prompt)
-        log.info(f"--- Ответ от Gemini API по делу #{case_id} получен ---")
-        return response.text
+        _, _, retrieved_tokens = _measured(
+            "retrieved", lambda: _generate_uncached(_retrieved_verdict_prompt(appeal, documents, suffix), shadow_client)
+        )
+        log.info(f"[RULES_COMPARE] Дело #{case_id}: токенов промпта full={full_tokens}, retrieved={retrieved_tokens}")
     except Exception as e:
-        log.error(f"ОШИБКА Gemini API: {e}")
-        return f"Ошибка при обращении к ИИ-арбитру. Детали: {e}"
+        log.warning(f"[RULES_COMPARE] Не удалось получить вариант retrieved по делу #{case_id}: {e}")
+
+def _requeue_finalization(case_id, reason: str, delay: float = GEMINI_REQUEUE_DELAY):
+    """Оставляет дело на текущей стадии и переносит таймер: финализация повторится позже."""
+    expires_at = datetime.utcnow() + timedelta(seconds=delay)
+    log.error(f"[FINALIZE] Финализация дела #{case_id} отложена: {reason}. Повтор через {delay:.0f} с.")
+    appealManager.update_appeal_fields(case_id, timer_expires_at=expires_at)
+    appealManager.log_interaction("SYSTEM", "finalize_requeued", case_id, reason)
+
+def _stop_finalization(bot, appeal_data: dict, error: GeminiUnavailable, failed_status: str, attempts):
+    """Останавливает дело в статусе failed_status (без таймера) и сообщает об этом Совету."""
+    case_id = appeal_data['case_id']
+    reason = "ошибка не временная" if error.permanent else f"исчерпано {attempts} попыток"
+    log.error(f"[FINALIZE] Финализация дела #{case_id} остановлена ({reason}): {error}")
+    appealManager.update_appeal_fields(case_id, status=failed_status, timer_expires_at=None)
+    appealManager.log_interaction("SYSTEM", "finalize_failed", case_id, f"{reason}: {error}")
 
-def finalize_appeal(appeal_data: dict, bot, commit_hash: str, bot_version: str):
+    council_id = resolve_council_id()
+    if not council_id:
+        return
+    try:
+        with sendQueue.bulk():
+            bot.send_message(
+                council_id,
+                f"⚠️ Не удалось вынести вердикт по делу №{case_id} ({reason}).\n"
+                f"Ошибка: {error}\n\n"
+                f"Дело остановлено. Повторить финализацию: /regenerate {case_id}",
+                message_thread_id=appeal_data.get("message_thread_id"),
+            )
+    except Exception as e:
+        log.error(f"[ОШИБКА] Не удалось уведомить Совет об ошибке по делу #{case_id}: {e}")
+
+def _handle_gemini_failure(bot, appeal_data: dict, error: GeminiUnavailable, failed_status: str):
+    """
+    Временную ошибку переживаем, откладывая дело, но не больше GEMINI_MAX_REQUEUES раз.
+    Запрос, отклонённый лимитом частоты или circuit breaker, попыткой не считается.
+    """
+    case_id = appeal_data['case_id']
+    if error.rejected:
+        _requeue_finalization(case_id, f"запрос к ИИ отложен: {error}", error.retry_after or GEMINI_REQUEUE_DELAY)
+        return
+    attempts = appealManager.increment_finalize_attempts(case_id)
+    if not error.permanent and (attempts is None or attempts < GEMINI_MAX_REQUEUES):
+        _requeue_finalization(case_id, f"ответ ИИ не получен (попытка {attempts}): {error}", error.retry_after or GEMINI_REQUEUE_DELAY)
+        return
+    _stop_finalization(bot, appeal_data, error, failed_status, attempts)
+
+def finalize_appeal(appeal_data: dict, bot, commit_hash: str, bot_version: str, regenerate: bool = False):
     if not isinstance(appeal_data, dict) or 'case_id' not in appeal_data:
         print(f"[CRITICAL_ERROR] В finalize_appeal переданы некорректные данные.")
         return
@@ -129,13 +292,23 @@ def finalize_appeal(appeal_data: dict, bot, commit_hash: str, bot_version: str):
         appealManager.log_interaction("SYSTEM", "appeal_closed_invalid", case_id, "No valid arguments provided.")
         return
 
-    log_id = appealManager.log_interaction("SYSTEM", "finalize_start", case_id)
-
-    ai_verdict_text = get_verdict_from_gemini(appeal_data, commit_hash, bot_version, log_id)
-
-    appealManager.update_appeal(case_id, "ai_verdict", ai_verdict_text)
-    appealManager.update_appeal(case_id, "commit_hash", commit_hash)
-    appealManager.update_appeal(case_id, "verdict_log_id", log_id)
+    # ID вердикта входит в промпт: при повторной финализации используем тот же,
+    # чтобы промпт совпал и вердикт взялся из кеша.
+    log_id = appeal_data.get('verdict_log_id')
+    if not log_id:
+        log_id = appealManager.log_interaction("SYSTEM", "finalize_start", case_id)
+        if log_id is None:
+            # Без сохранённого ID следующая попытка собрала бы другой промпт и промахнулась мимо кеша.
+            _requeue_finalization(case_id, "не удалось получить ID вердикта")
+            return
+        appealManager.update_appeal_fields(case_id, verdict_log_id=log_id)
+
+    documents = prompt_documents.current()
+    try:
+        ai_verdict_text = get_verdict_from_gemini(appeal_data, commit_hash, bot_version, log_id, documents, regenerate)
+    except GeminiUnavailable as e:
+        _handle_gemini_failure(bot, appeal_data, e, appealManager.FINALIZE_FAILED_STATUS)
+        return
 
     created_at_dt = appeal_data.get('created_at')
     date_submitted = created_at_dt.strftime('%Y-%m-%d %H:%M UTC') if isinstance(created_at_dt, datetime) else "Неизвестно"
@@ -198,24 +371,34 @@ def finalize_appeal(appeal_data: dict, bot, commit_hash: str, bot_version: str):
         message_to_send = clean_verdict_markdown[:4000] + "\n\n_[Сообщение было урезано из-за ошибки публикации]_"
 
     try:
-        if applicant_chat_id:
-            bot.send_message(applicant_chat_id, message_to_send, parse_mode="Markdown")
-        if appeals_channel_id:
-            bot.send_message(appeals_channel_id, message_to_send, parse_mode="Markdown")
+        with sendQueue.bulk():
+            if applicant_chat_id:
+                bot.send_message(applicant_chat_id, message_to_send, parse_mode="Markdown")
+            if appeals_channel_id:
+                bot.send_message(appeals_channel_id, message_to_send, parse_mode="Markdown")
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось отправить вердикт по делу #{case_id}: {e}")
         appealManager.log_interaction("SYSTEM", "send_verdict_error", case_id, str(e))
 
-    appealManager.update_appeal(case_id, "status", "closed")
+    appealManager.update_appeal_fields(
+        case_id,
+        ai_verdict=ai_verdict_text,
+        commit_hash=commit_hash,
+        verdict_log_id=log_id,
+        rules_version=documents.rules_version,
+        finalize_attempts=0,
+        status="closed",
+    )
     appealManager.log_interaction("SYSTEM", "appeal_closed", case_id)
     log.info(f"[FINALIZE] Дело #{case_id} успешно закрыто.")
 
-def get_review_from_gemini(appeal: dict, commit_hash: str, bot_version: str, log_id: int):
+def get_review_from_gemini(appeal: dict, commit_hash: str, bot_version: str, log_id: int, documents=None, regenerate: bool = False):
     """
     Формирует усложненный промпт для ПЕРЕСМОТРА дела и получает финальный вердикт.
+    Как и get_verdict_from_gemini, переиспользует сохранённый вердикт на тот же промпт.
     """
     case_id = appeal.get('case_id')
-    project_rules = _read_file('rules.txt', "Устав проекта не найден.")
+    documents = documents or prompt_documents.current()
 
     review_data = appeal.get('review_data', {})
     new_arguments_list = review_data.get('new_arguments', [])
@@ -230,18 +413,14 @@ def get_review_from_gemini(appeal: dict, commit_hash: str, bot_version: str, log
     poll_text = f"Вопрос: '{poll_data.get('question', '')}', Результаты: "
     poll_text += ", ".join([f"'{opt.get('text')}': {opt.get('voter_count')} гол." for opt in poll_data.get('options', [])])
 
-    prompt = f"""
+    prefix = documents.review_prefix
+    suffix = f"""
 Ты — ИИ-арбитр высшей инстанции. Перед тобой дело №{case_id}, по которому уже был вынесен вердикт.
 Совет Редакторов провел голосование ({poll_text}) и решил пересмотреть это дело.
 Внимательно изучи **первоначальное решение** и **новые аргументы** от Совета.
 Твоя задача — **переоценить** свой прошлый анализ. Если ты считаешь, что новые аргументы являются весомыми и меняют суть дела, измени свой вердикт. Если нет — оставь его в силе, но **обязательно объясни, почему** новые аргументы не повлияли на твое решение.
 Это решение будет **окончательным и не подлежит дальнейшему обжалованию** (согласно пункту 8.6 Устава).
 
-**Устав проекта для анализа:**
-<rules>
-{project_rules}
-</rules>
-
 **ДЕТАЛИ ПЕРВОНАЧАЛЬНОГО ДЕЛА №{case_id}**
 {appeal.get('decision_text', '')}
 - Аргументы заявителя: {appeal.get('applicant_arguments', '')}
@@ -254,31 +433,38 @@ def get_review_from_gemini(appeal: dict, commit_hash: str, bot_version: str, log
 {new_arguments_text}
 """
 
-    if not gemini_model:
-        return "Ошибка: Модель Gemini не инициализирована."
-    try:
-        log.info(f"--- Отправка запроса на ПЕРЕСМОТР в Gemini API по делу #{case_id} ---")
-        response = gemini_model.generate_content(prompt)
-        log.info(f"--- Ответ на ПЕРЕСМОТР от Gemini API по делу #{case_id} получен ---")
-        return response.text
-    except Exception as e:
-        log.error(f"ОШИБКА Gemini API при пересмотре: {e}")
-        return f"Ошибка при обращении к ИИ-арбитру. Детали: {e}"
+    cache_key = prompt_key(GEMINI_MODEL_NAME, "review", prefix + suffix)
+    if not regenerate:
+        cached_verdict = verdict_cache.get(cache_key)
+        if cached_verdict is not None:
+            log.info(f"--- Вердикт по ПЕРЕСМОТРУ дела #{case_id} взят из кеша вердиктов ---")
+            return cached_verdict
+
+    log.info(f"--- Отправка запроса на ПЕРЕСМОТР в Gemini API по делу #{case_id} ---")
+    response, model_name = _generate("review", prefix, suffix)
+    log.info(f"--- Ответ на ПЕРЕСМОТР от Gemini API по делу #{case_id} получен ---")
+    verdict_cache.put(cache_key, model_name, case_id, response.text, regenerated=regenerate)
+    return response.text
 
-def finalize_review(appeal_data: dict, bot, commit_hash: str, bot_version: str):
+def finalize_review(appeal_data: dict, bot, commit_hash: str, bot_version: str, regenerate: bool = False):
     case_id = appeal_data['case_id']
     log.info(f"[FINALIZE_REVIEW] Начинаю ПЕРЕСМОТР дела #{case_id}")
 
-    log_id = appealManager.log_interaction("SYSTEM", "review_finalize_start", case_id)
+    review_data = appeal_data.get('review_data') or {}
+    log_id = review_data.get('verdict_log_id')
+    if not log_id:
+        log_id = appealManager.log_interaction("SYSTEM", "review_finalize_start", case_id)
+        if log_id is None:
+            _requeue_finalization(case_id, "не удалось получить ID вердикта")
+            return
+        appealManager.set_appeal_json_key(case_id, 'review_data', 'verdict_log_id', log_id)
 
-    ai_review_verdict = get_review_from_gemini(appeal_data, commit_hash, bot_version, log_id)
-
-    review_data = appeal_data.get('review_data', {})
-    review_data['final_verdict'] = ai_review_verdict
-    appealManager.update_appeal(case_id, "review_data", review_data)
-
-    appealManager.update_appeal(case_id, "commit_hash", commit_hash)
-    appealManager.update_appeal(case_id, "verdict_log_id", log_id)
+    documents = prompt_documents.current()
+    try:
+        ai_review_verdict = get_review_from_gemini(appeal_data, commit_hash, bot_version, log_id, documents, regenerate)
+    except GeminiUnavailable as e:
+        _handle_gemini_failure(bot, appeal_data, e, appealManager.REVIEW_FINALIZE_FAILED_STATUS)
+        return
 
     final_verdict_text = (
         f"⚖️ *Финальные итоги рассмотрения апелляции №{case_id} (ПОСЛЕ ПЕРЕСМОТРА)*\n\n"
@@ -305,13 +491,23 @@ def finalize_review(appeal_data: dict, bot, commit_hash: str, bot_version: str):
         else:
             message_to_send = final_verdict_text[:4000] + "\n\n_[Сообщение было урезано из-за ошибки публикации]_"
 
-        if applicant_chat_id:
-            bot.send_message(applicant_chat_id, message_to_send, parse_mode="Markdown")
-        if appeals_channel_id:
-            bot.send_message(appeals_channel_id, message_to_send, parse_mode="Markdown")
+        with sendQueue.bulk():
+            if applicant_chat_id:
+                bot.send_message(applicant_chat_id, message_to_send, parse_mode="Markdown")
+            if appeals_channel_id:
+                bot.send_message(appeals_channel_id, message_to_send, parse_mode="Markdown")
     except Exception as e:
         log.error(f"[ОШИБКА] Не удалось отправить вердикт по пересмотру дела #{case_id}: {e}")
 
-    appealManager.update_appeal(case_id, "status", "closed_after_review")
+    # Только ключ final_verdict: review_data целиком могли дополнить (/replyrecase) после загрузки дела.
+    appealManager.set_appeal_json_key(case_id, 'review_data', 'final_verdict', ai_review_verdict)
+    appealManager.update_appeal_fields(
+        case_id,
+        commit_hash=commit_hash,
+        verdict_log_id=log_id,
+        rules_version=documents.rules_version,
+        finalize_attempts=0,
+        status="closed_after_review",
+    )
     appealManager.log_interaction("SYSTEM", "appeal_closed_after_review", case_id)
     log.info(f"[FINALIZE_REVIEW] Дело #{case_id} успешно закрыто после пересмотра.")
\ No newline at end of file
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import appealManager
+from .fsm_context import get_state, register_state_middleware
 
 def register_all_handlers(bot):
     """
@@ -13,6 +14,8 @@ def register_all_handlers(bot):
 
     user_states = {}
 
+    register_state_middleware(bot)
+
     @bot.message_handler(commands=['help'])
     def send_help_text(message):
         help_text = """
@@ -49,14 +52,13 @@ TextCrafter (Создание постов)
 
     @bot.message_handler(commands=['cancel'], chat_types=['private'])
     def cancel_any_process(message):
-        user_id = message.from_user.id
-        state = appealManager.get_user_state(user_id)
-        if state:
-            if state.get("data", {}).get("case_id"):
-                case_id = state["data"]["case_id"]
-                if not str(state.get("state")).startswith("council_"):
+        ctx = get_state(message)
+        if ctx.exists():
+            if ctx.data.get("case_id"):
+                case_id = ctx.data["case_id"]
+                if not ctx.state.startswith("council_"):
                     appealManager.delete_appeal(case_id)
-            appealManager.delete_user_state(user_id)
+            ctx.delete()
             bot.send_message(message.chat.id, "Текущая операция отменена.")
         else:
             bot.send_message(message.chat.id, "У вас нет активных операций, которые можно было бы отменить.")
@@ -1,14 +1,17 @@
 # honjireview/hjr-bot/HJR-Bot-9aa44cfee942a8142d76d0d46064745fe48346ce/handlers/admin_flow.py
 # -*- coding: utf-8 -*-
 """
-Обработчики для команд, связанных с управлением списком редакторов.
+Обработчики для команд, связанных с управлением списком редакторов,
+и служебных команд Совета (/regenerate).
 """
 import os
 import logging
 from datetime import datetime, timedelta
 from telebot import types
 import appealManager
-from .council_helpers import resolve_council_id
+import finalizationQueue
+from telegramMetadata import telegram_metadata
+from .council_helpers import resolve_council_id, resolve_council_chat_id
 
 log = logging.getLogger("hjr-bot.admin_flow")
 
@@ -70,7 +73,7 @@ def register_admin_handlers(bot):
     @bot.message_handler(commands=['sync_editors'], chat_types=['private'])
     def sync_command(message):
         user_id = message.from_user.id
-        if not appealManager.is_user_an_editor(bot, user_id, resolve_council_id()):
+        if not appealManager.is_user_an_editor(bot, user_id, resolve_council_chat_id(bot)):
             return
 
         global last_sync_time
@@ -116,6 +119,25 @@ def register_admin_handlers(bot):
         else:
             bot.reply_to(message, "Произошла ошибка при обновлении статуса.")
 
+    @bot.message_handler(commands=['regenerate'])
+    def regenerate_command(message):
+        user_id = message.from_user.id
+        if not appealManager.is_user_an_editor(bot, user_id, resolve_council_chat_id(bot)):
+            return
+
+        parts = message.text.split()
+        if len(parts) != 2 or not parts[1].isdigit():
+            bot.reply_to(message, "Неверный формат. Используйте: `/regenerate <номер дела>`")
+            return
+
+        case_id = int(parts[1])
+        error = finalizationQueue.submit_regeneration(case_id)
+        if error:
+            bot.reply_to(message, error)
+            return
+        appealManager.log_interaction(user_id, "verdict_regenerate_requested", case_id)
+        bot.reply_to(message, f"Дело №{case_id} отправлено на повторную финализацию. Новый вердикт будет запрошен у ИИ заново.")
+
     @bot.message_handler(commands=['getid'], chat_types=['private'])
     def start_get_id_scan(message):
         user_id = message.from_user.id
@@ -135,8 +157,25 @@ def register_admin_handlers(bot):
         bot.answer_callback_query(call.id, "Режим сканирования остановлен.")
         bot.edit_message_text("Режим сканирования ID деактивирован.", call.message.chat.id, call.message.message_id)
 
+    @bot.chat_member_handler()
+    def handle_member_status_change(update):
+        # Состав чата изменился — число участников в кеше устарело
+        telegram_metadata.invalidate_chat(update.chat.id)
+        # Изменение статуса участника чата Совета сбрасывает кеш авторизации для него
+        if update.chat.id != resolve_council_chat_id(bot):
+            return
+        member = update.new_chat_member
+        if member.status not in appealManager.MEMBER_STATUSES:
+            appealManager.remove_editor(member.user.id)
+        appealManager.invalidate_editor_cache(update.chat.id, member.user.id, member.status)
+
     @bot.my_chat_member_handler()
     def handle_chat_member_update(update):
+        telegram_metadata.invalidate_chat(update.chat.id)
+        if update.chat.id == resolve_council_chat_id(bot):
+            # Права самого бота в чате Совета изменились — кешу проверок больше нельзя доверять
+            appealManager.invalidate_editor_cache()
+
         scanning_user = admin_states.get("scanning_user_id")
         if not scanning_user:
             return
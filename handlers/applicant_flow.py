@@ -7,7 +7,8 @@ from telebot import types
 import appealManager
 # ИСПРАВЛЕНО: Убран импорт get_discussion_context
 from .telegram_helpers import validate_appeal_link
-from .council_helpers import request_counter_arguments, resolve_council_id
+from .council_helpers import request_counter_arguments, resolve_council_chat_id
+from .fsm_context import get_state
 
 log = logging.getLogger("hjr-bot.applicant_flow")
 CHARACTER_LIMIT = 4000
@@ -42,17 +43,16 @@ def register_applicant_handlers(bot):
     @bot.message_handler(commands=["start"], chat_types=['private'])
     def send_welcome(message):
         user_id = message.from_user.id
-        is_editor = appealManager.is_user_an_editor(bot, user_id, resolve_council_id())
+        is_editor = appealManager.is_user_an_editor(bot, user_id, resolve_council_chat_id(bot))
 
         if not is_editor:
             bot.send_message(message.chat.id, "Эта функция доступна только для участников Совета Редакторов.")
             return
 
-        if appealManager.get_user_state(user_id) is not None:
+        if get_state(message).exists():
             bot.send_message(message.chat.id, "Вы уже находитесь в процессе. Чтобы начать заново, отмените его: /cancel.")
             return
 
-        appealManager.delete_user_state(user_id)
         markup = types.InlineKeyboardMarkup()
         appeal_button = types.InlineKeyboardButton("Подать апелляцию", callback_data="start_appeal")
         markup.add(appeal_button)
@@ -61,7 +61,7 @@ def register_applicant_handlers(bot):
     @bot.callback_query_handler(func=lambda call: call.data == "start_appeal")
     def handle_start_appeal_callback(call):
         user_id = call.from_user.id
-        is_editor = appealManager.is_user_an_editor(bot, user_id, resolve_council_id())
+        is_editor = appealManager.is_user_an_editor(bot, user_id, resolve_council_chat_id(bot))
 
         if not is_editor:
             bot.answer_callback_query(call.id, "Эта функция доступна только для участников Совета Редакторов.", show_alert=True)
@@ -72,15 +72,15 @@ def register_applicant_handlers(bot):
             bot.answer_callback_query(call.id, f"Вы не можете подать новую апелляцию, пока активна ваша предыдущая (дело #{active_case}).", show_alert=True)
             return
 
-        appealManager.set_user_state(user_id, AppealStates.WAITING_FOR_LINK)
+        get_state(call).set(AppealStates.WAITING_FOR_LINK)
         bot.answer_callback_query(call.id)
         bot.send_message(call.message.chat.id, "Пожалуйста, пришлите ссылку на сообщение или опрос, решение в котором вы хотите оспорить.\n\nДля отмены в любой момент введите /cancel")
 
     @bot.message_handler(
         func=lambda message: (
-                appealManager.get_user_state(message.from_user.id) is not None and
-                not str(appealManager.get_user_state(message.from_user.id).get('state', '')).startswith("council_") and
-                message.chat.type == 'private'
+                message.chat.type == 'private' and
+                get_state(message).exists() and
+                not get_state(message).state.startswith("council_")
         ),
         content_types=['text']
     )
@@ -92,11 +92,11 @@ def register_applicant_handlers(bot):
                 bot.reply_to(message, "Пожалуйста, завершите текущий процесс или отмените его командой /cancel.")
             return
 
-        state_data = appealManager.get_user_state(user_id)
-        if not state_data: return
+        ctx = get_state(message)
+        if not ctx.exists(): return
 
-        state = state_data.get("state")
-        data = state_data.get("data", {})
+        state = ctx.state
+        data = ctx.data
 
         if len(message.text) > CHARACTER_LIMIT:
             bot.reply_to(message, f"Вы превысили лимит символов ({CHARACTER_LIMIT}). Пожалуйста, сократите ваше сообщение.")
@@ -114,7 +114,7 @@ def register_applicant_handlers(bot):
             similar_case = appealManager.find_similar_appeal(decision_text)
             if similar_case and similar_case['similarity'] > 98:
                 bot.reply_to(message, f"Похоже, апелляция по этому решению уже была рассмотрена (дело №{similar_case['case_id']}). Подача дубликата отменена.")
-                appealManager.delete_user_state(user_id)
+                ctx.delete()
                 return
 
             new_case_id = random.randint(10000, 99999)
@@ -136,27 +136,27 @@ def register_applicant_handlers(bot):
             bot.send_message(message.chat.id, f"Ссылка принята. Вашему делу присвоен номер #{new_case_id}.")
 
             if content_data.get("type") == "poll":
-                appealManager.set_user_state(user_id, AppealStates.WAITING_VOTE_CONFIRM, data)
+                ctx.set(AppealStates.WAITING_VOTE_CONFIRM, data)
                 markup = types.InlineKeyboardMarkup()
                 markup.add(types.InlineKeyboardButton("Да", callback_data=f"vote_yes_{new_case_id}"), types.InlineKeyboardButton("Нет", callback_data=f"vote_no_{new_case_id}"))
                 bot.send_message(message.chat.id, "Вы принимали участие в этом голосовании?", reply_markup=markup)
             else:
-                appealManager.set_user_state(user_id, AppealStates.WAITING_MAIN_ARGUMENT, data)
+                ctx.set(AppealStates.WAITING_MAIN_ARGUMENT, data)
                 bot.send_message(message.chat.id, "Теперь, пожалуйста, изложите ваши основные аргументы.")
 
         elif state == AppealStates.WAITING_MAIN_ARGUMENT:
-            appealManager.update_appeal(data["case_id"], "applicant_arguments", message.text)
-            appealManager.set_user_state(user_id, AppealStates.WAITING_Q1, data)
+            appealManager.update_appeal_fields(data["case_id"], applicant_arguments=message.text)
+            ctx.set(AppealStates.WAITING_Q1, data)
             bot.send_message(message.chat.id, "Спасибо. Теперь ответьте на уточняющие вопросы.\n\nВопрос 1/3: Какой пункт устава, по вашему мнению, был нарушен?")
 
         elif state == AppealStates.WAITING_Q1:
             _update_appeal_answer(data["case_id"], "q1", message.text)
-            appealManager.set_user_state(user_id, AppealStates.WAITING_Q2, data)
+            ctx.set(AppealStates.WAITING_Q2, data)
             bot.send_message(message.chat.id, "Вопрос 2/3: Какой результат вы считаете справедливым в этой ситуации?")
 
         elif state == AppealStates.WAITING_Q2:
             _update_appeal_answer(data["case_id"], "q2", message.text)
-            appealManager.set_user_state(user_id, AppealStates.WAITING_Q3, data)
+            ctx.set(AppealStates.WAITING_Q3, data)
             bot.send_message(message.chat.id, "Вопрос 3/3: Есть ли какой-либо дополнительный контекст, который, по вашему мнению, важен для полного понимания дела?")
 
         elif state == AppealStates.WAITING_Q3:
@@ -168,29 +168,28 @@ def register_applicant_handlers(bot):
 
             if not appealManager.are_arguments_meaningful(main_args):
                 bot.send_message(message.chat.id, "Ваши основные аргументы кажутся слишком короткими или несодержательными. Пожалуйста, изложите вашу позицию более подробно, чтобы Совет мог ее рассмотреть.")
-                appealManager.set_user_state(user_id, AppealStates.WAITING_MAIN_ARGUMENT, data)
+                ctx.set(AppealStates.WAITING_MAIN_ARGUMENT, data)
                 return
 
-            appealManager.delete_user_state(user_id)
+            ctx.delete()
             bot.send_message(message.chat.id, "Спасибо, ваша апелляция полностью оформлена и отправлена на рассмотрение в Совет Редакторов. Вы получите уведомление, когда будет вынесен вердикт.")
             request_counter_arguments(bot, case_id)
 
     @bot.callback_query_handler(func=lambda call: call.data.startswith("vote_"))
     def handle_vote_confirm_callback(call):
-        user_id = call.from_user.id
-        state_data = appealManager.get_user_state(user_id)
-        if not (state_data and state_data.get("state") == AppealStates.WAITING_VOTE_CONFIRM):
+        ctx = get_state(call)
+        if ctx.state != AppealStates.WAITING_VOTE_CONFIRM:
             bot.answer_callback_query(call.id, "Это действие уже неактуально.", show_alert=True)
             return
 
         action, case_id_str = call.data.rsplit('_', 1)
         case_id = int(case_id_str)
-        data = state_data.get("data", {})
+        data = ctx.data
 
         appeal = appealManager.get_appeal(case_id)
         if not appeal:
             bot.answer_callback_query(call.id, f"Критическая ошибка: дело #{case_id} не найдено в базе данных.", show_alert=True)
-            appealManager.delete_user_state(user_id)
+            ctx.delete()
             return
 
         bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
@@ -201,25 +200,21 @@ def register_applicant_handlers(bot):
             if total_voters == 1:
                 bot.send_message(call.message.chat.id, "Вы не можете подать апелляцию на решение, в котором вы были единственным голосовавшим. Процесс отменен.")
                 appealManager.delete_appeal(case_id)
-                appealManager.delete_user_state(user_id)
+                ctx.delete()
                 bot.answer_callback_query(call.id)
                 return
 
             expected_responses = total_voters - 1 if total_voters is not None and total_voters > 0 else 0
-            appealManager.update_appeal(case_id, "expected_responses", expected_responses)
+            appealManager.update_appeal_fields(case_id, expected_responses=expected_responses)
             bot.send_message(call.message.chat.id, "Понятно. Ваш голос будет вычтен из общего числа для обеспечения объективности при сборе контраргументов.")
 
         elif action == "vote_no":
-            appealManager.update_appeal(case_id, "expected_responses", appeal.get("total_voters", 0))
+            appealManager.update_appeal_fields(case_id, expected_responses=appeal.get("total_voters", 0))
             bot.send_message(call.message.chat.id, "Понятно. Информация принята.")
 
-        appealManager.set_user_state(user_id, AppealStates.WAITING_MAIN_ARGUMENT, data)
+        ctx.set(AppealStates.WAITING_MAIN_ARGUMENT, data)
         bot.send_message(call.message.chat.id, "Теперь, пожалуйста, изложите ваши основные аргументы.")
         bot.answer_callback_query(call.id)
 
 def _update_appeal_answer(case_id, key, value):
-    appeal = appealManager.get_appeal(case_id)
-    if appeal:
-        current_answers = appeal.get("applicant_answers", {}) or {}
-        current_answers[key] = value
-        appealManager.update_appeal(case_id, "applicant_answers", current_answers)
\ No newline at end of file
+    appealManager.set_appeal_json_key(case_id, "applicant_answers", key, value)
\ No newline at end of file
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import logging
 import appealManager
-from .council_helpers import resolve_council_id
+from .council_helpers import resolve_council_chat_id
+from .fsm_context import get_state
 
 log = logging.getLogger("hjr-bot.council_flow")
 CHARACTER_LIMIT = 4000
@@ -21,7 +22,7 @@ def register_council_handlers(bot):
     def handle_reply(message):
         # ... (код без изменений) ...
         user_id = message.from_user.id
-        is_editor = appealManager.is_user_an_editor(bot, user_id, resolve_council_id())
+        is_editor = appealManager.is_user_an_editor(bot, user_id, resolve_council_chat_id(bot))
         if not is_editor:
             return
 
@@ -41,15 +42,14 @@ def register_council_handlers(bot):
             return
 
         data = {"case_id": case_id, "answers": {}}
-        appealManager.set_user_state(user_id, CouncilStates["MAIN_ARG"], data)
+        get_state(message).set(CouncilStates["MAIN_ARG"], data)
         log.info(f"[COUNCIL_FLOW] User {user_id} starts reply for case #{case_id}. State set to {CouncilStates['MAIN_ARG']}.")
         bot.send_message(message.chat.id, f"Вы отвечаете по делу #{case_id}.\n\nПожалуйста, изложите ваши основные контраргументы.")
 
     @bot.message_handler(
         func=lambda message: (
-                appealManager.get_user_state(message.from_user.id) is not None and
-                str(appealManager.get_user_state(message.from_user.id).get('state', '')).startswith(COUNCIL_STATE_PREFIX) and
-                message.chat.type == 'private'
+                message.chat.type == 'private' and
+                get_state(message).state.startswith(COUNCIL_STATE_PREFIX)
         ),
         content_types=['text']
     )
@@ -61,9 +61,9 @@ def register_council_handlers(bot):
                 bot.reply_to(message, "Пожалуйста, завершите процесс ответа или отмените его командой /cancel.")
             return
 
-        state_data = appealManager.get_user_state(user_id)
-        state = state_data.get("state")
-        data = state_data.get("data", {})
+        ctx = get_state(message)
+        state = ctx.state
+        data = ctx.data
         case_id = data.get("case_id")
 
         log.info(f"[COUNCIL_FLOW] Handling FSM for user {user_id}, case #{case_id}, state: {state}")
@@ -78,7 +78,7 @@ def register_council_handlers(bot):
             current_answers["main_arg"] = message.text
             data["answers"] = current_answers
             next_state = CouncilStates["Q1"]
-            appealManager.set_user_state(user_id, next_state, data)
+            ctx.set(next_state, data)
             log.info(f"[COUNCIL_FLOW] User {user_id} provided main_arg for case #{case_id}. New state: {next_state}")
             bot.send_message(message.chat.id, "Вопрос 1/2: На каких пунктах устава или правил основывается ваша позиция?")
 
@@ -86,7 +86,7 @@ def register_council_handlers(bot):
             current_answers["q1"] = message.text
             data["answers"] = current_answers
             next_state = CouncilStates["Q2"]
-            appealManager.set_user_state(user_id, next_state, data)
+            ctx.set(next_state, data)
             log.info(f"[COUNCIL_FLOW] User {user_id} provided q1 for case #{case_id}. New state: {next_state}")
             bot.send_message(message.chat.id, "Вопрос 2/2: Как вы оцениваете аргументы заявителя? Считаете ли вы их релевантными?")
 
@@ -98,7 +98,7 @@ def register_council_handlers(bot):
             if not appealManager.are_arguments_meaningful(main_args):
                 bot.send_message(message.chat.id, "Ваши основные контраргументы кажутся слишком короткими или несодержательными. Пожалуйста, изложите вашу позицию более подробно.")
                 # Возвращаем пользователя на шаг ввода основных контраргументов
-                appealManager.set_user_state(user_id, CouncilStates["MAIN_ARG"], data)
+                ctx.set(CouncilStates["MAIN_ARG"], data)
                 return
 
             responder_info = f"{message.from_user.first_name} (@{message.from_user.username or 'скрыто'})"
@@ -106,6 +106,6 @@ def register_council_handlers(bot):
 
             log.info(f"[COUNCIL_FLOW] User {user_id} provided q2 for case #{case_id}. Finalizing and saving answer.")
             appealManager.add_council_answer(case_id, current_answers)
-            appealManager.delete_user_state(user_id)
+            ctx.delete()
             log.info(f"[COUNCIL_FLOW] State for user {user_id} deleted. Reply process finished.")
             bot.send_message(message.chat.id, f"Спасибо, ваш ответ по делу #{case_id} принят.")
\ No newline at end of file
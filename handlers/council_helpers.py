@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 from typing import Optional, Union
 
 import appealManager
+from telegramMetadata import telegram_metadata
 
 log = logging.getLogger("hjr-bot.council_helpers")
 
@@ -42,6 +43,27 @@ def resolve_council_id() -> Optional[Union[int, str]]:
     log.error(f"[council_helpers] cannot resolve EDITORS_GROUP_ID: '{raw}'")
     return None
 
+def resolve_council_chat_id(bot) -> Optional[int]:
+    """
+    Числовой ID чата Совета. Апдейты Telegram всегда приходят с числовым chat.id,
+    поэтому сравнивать с ним и строить ключи кешей нужно по этому значению, даже
+    если EDITORS_GROUP_ID задан как '@username'. Кеширует результат.
+    """
+    if _RESOLVED.get("chat_id") is not None:
+        return _RESOLVED["chat_id"]
+    resolved = resolve_council_id()
+    if resolved is None or isinstance(resolved, int):
+        _RESOLVED["chat_id"] = resolved
+        return resolved
+    try:
+        chat_id = int(telegram_metadata.get_chat(bot, resolved).id)
+    except Exception as e:
+        log.error(f"[council_helpers] cannot get numeric id for {resolved}: {e}")
+        return None
+    _RESOLVED["chat_id"] = chat_id
+    log.info(f"[council_helpers] {resolved} resolved to chat id {chat_id}")
+    return chat_id
+
 def is_link_from_council(bot, parsed_from_chat_id: Union[int, str]) -> bool:
     """
     Проверяет, что parsed_from_chat_id соответствует EDITORS_GROUP_ID.
@@ -56,8 +78,8 @@ def is_link_from_council(bot, parsed_from_chat_id: Union[int, str]) -> bool:
             except Exception: pass
         if isinstance(resolved, str) and str(parsed_from_chat_id).lower() == str(resolved).lower():
             return True
-        target_chat = bot.get_chat(resolved)
-        parsed_chat = bot.get_chat(parsed_from_chat_id)
+        target_chat = telegram_metadata.get_chat(bot, resolved)
+        parsed_chat = telegram_metadata.get_chat(bot, parsed_from_chat_id)
         if target_chat and parsed_chat:
             if getattr(target_chat, "id", None) and getattr(parsed_chat, "id", None):
                 if int(target_chat.id) == int(parsed_chat.id):
@@ -83,7 +105,7 @@ def request_counter_arguments(bot, case_id: int):
     q1 = answers.get("q1", "(нет ответа)")
     q2 = answers.get("q2", "(нет ответа)")
     q3 = answers.get("q3", "(нет ответа)")
-    bot_username = bot.get_me().username
+    bot_username = telegram_metadata.get_me(bot).username
 
     request_text = (
         f"📣 *Запрос контраргументов по апелляции №{case_id}* 📣\n\n"
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Контекст состояния FSM в пределах одного апдейта Telegram.
+
+Middleware прикрепляет к сообщению/колбэку объект StateContext. Состояние
+из user_states читается при первом обращении и дальше переиспользуется всеми
+предикатами и обработчиками этого апдейта; запись идёт через тот же объект,
+поэтому один шаг FSM стоит не больше одного чтения и одной записи.
+"""
+import logging
+
+import appealManager
+
+log = logging.getLogger("hjr-bot.fsm_context")
+
+_CONTEXT_ATTR = "fsm_state"
+
+
+class StateContext:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._loaded = False
+        self._record = None
+
+    def _load(self):
+        if not self._loaded:
+            self._record = appealManager.get_user_state(self.user_id)
+            self._loaded = True
+        return self._record
+
+    def exists(self) -> bool:
+        return self._load() is not None
+
+    @property
+    def state(self) -> str:
+        record = self._load()
+        return str(record.get("state") or "") if record else ""
+
+    @property
+    def data(self) -> dict:
+        record = self._load()
+        if not record:
+            return {}
+        if record.get("data") is None:
+            record["data"] = {}
+        return record["data"]
+
+    def set(self, state, data=None):
+        appealManager.set_user_state(self.user_id, state, data)
+        self._record = {"state": state, "data": data or {}}
+        self._loaded = True
+
+    def delete(self):
+        appealManager.delete_user_state(self.user_id)
+        self._record = None
+        self._loaded = True
+
+
+def get_state(update_object) -> StateContext:
+    """
+    Возвращает контекст состояния для сообщения или колбэка.
+    Если middleware не отработал (например, апдейт пришёл в обход него), создаёт контекст на месте.
+    """
+    ctx = getattr(update_object, _CONTEXT_ATTR, None)
+    if ctx is None:
+        ctx = StateContext(update_object.from_user.id)
+        setattr(update_object, _CONTEXT_ATTR, ctx)
+    return ctx
+
+
+def register_state_middleware(bot):
+    """
+    Регистрирует middleware, создающий контекст состояния для каждого апдейта.
+    Требует apihelper.ENABLE_MIDDLEWARE = True до создания экземпляра бота.
+    """
+    @bot.middleware_handler(update_types=['message', 'callback_query'])
+    def attach_state_context(bot_instance, update_object):
+        if getattr(update_object, "from_user", None) is not None:
+            setattr(update_object, _CONTEXT_ATTR, StateContext(update_object.from_user.id))
@@ -3,7 +3,8 @@ import logging
 from datetime import datetime, timedelta
 import appealManager
 from .telegram_helpers import validate_appeal_link
-from .council_helpers import resolve_council_id
+from .council_helpers import resolve_council_chat_id
+from .fsm_context import get_state
 
 log = logging.getLogger("hjr-bot.review_flow")
 
@@ -20,7 +21,7 @@ def register_review_handlers(bot):
             bot.reply_to(message, "Эту команду можно использовать только в чате Совета.")
             return
 
-        council_id = resolve_council_id()
+        council_id = resolve_council_chat_id(bot)
         if message.chat.id != council_id:
             bot.reply_to(message, "Эту команду можно использовать только в официальном чате Совета Редакторов.")
             return
@@ -68,12 +69,14 @@ def register_review_handlers(bot):
                 "poll_message_id": sent_poll_msg.message_id,
                 "poll_id": sent_poll_msg.poll.id
             }
-            appealManager.update_appeal(case_id, "review_data", review_data)
-            appealManager.update_appeal(case_id, "status", "review_poll_pending")
-
-            # Устанавливаем таймер в базе данных на 5 часов
+            # Таймер голосования в базе данных — 5 часов
             expires_at = datetime.utcnow() + timedelta(hours=5)
-            appealManager.update_appeal(case_id, "timer_expires_at", expires_at)
+            appealManager.update_appeal_fields(
+                case_id,
+                review_data=review_data,
+                status="review_poll_pending",
+                timer_expires_at=expires_at,
+            )
 
             log.info(f"Создано голосование для пересмотра дела #{case_id}. Message ID: {sent_poll_msg.message_id}")
             bot.reply_to(message, f"Создано голосование для пересмотра дела №{case_id}. Голосование будет автоматически закрыто через 5 часов.")
@@ -89,7 +92,7 @@ def register_review_handlers(bot):
             return
 
         user_id = message.from_user.id
-        is_editor = appealManager.is_user_an_editor(bot, user_id, resolve_council_id())
+        is_editor = appealManager.is_user_an_editor(bot, user_id, resolve_council_chat_id(bot))
         if not is_editor:
             return
 
@@ -105,34 +108,29 @@ def register_review_handlers(bot):
             return
 
         data = {"case_id": case_id}
-        appealManager.set_user_state(user_id, REVIEW_STATE_WAITING_ARG, data)
+        get_state(message).set(REVIEW_STATE_WAITING_ARG, data)
         bot.send_message(message.chat.id, f"Изложите ваши новые аргументы по делу №{case_id}.")
 
     @bot.message_handler(
-        func=lambda message: (
-                appealManager.get_user_state(message.from_user.id) is not None and
-                str(appealManager.get_user_state(message.from_user.id).get('state', '')) == REVIEW_STATE_WAITING_ARG
-        ),
+        func=lambda message: get_state(message).state == REVIEW_STATE_WAITING_ARG,
         content_types=['text']
     )
     def handle_review_argument_fsm(message):
         user_id = message.from_user.id
-        state_data = appealManager.get_user_state(user_id)
-        case_id = state_data.get("data", {}).get("case_id")
+        ctx = get_state(message)
+        case_id = ctx.data.get("case_id")
 
         if not appealManager.are_arguments_meaningful(message.text):
             bot.reply_to(message, "Ваши аргументы слишком короткие. Пожалуйста, изложите позицию более развернуто.")
             return
 
-        appeal = appealManager.get_appeal(case_id)
-        review_data = appeal.get("review_data", {}) or {}
-        new_args = review_data.get("new_arguments", [])
-
         author_info = f"{message.from_user.first_name} (@{message.from_user.username or 'скрыто'})"
-        new_args.append({"author": author_info, "argument": message.text})
-
-        review_data["new_arguments"] = new_args
-        appealManager.update_appeal(case_id, "review_data", review_data)
+        arguments_count = appealManager.append_to_appeal_array(
+            case_id, "review_data", {"author": author_info, "argument": message.text}, key="new_arguments"
+        )
+        if arguments_count is None:
+            bot.reply_to(message, "Не удалось сохранить аргументы. Попробуйте ещё раз.")
+            return
         log.info(f"[REVIEW_FSM] Пользователь {user_id} добавил новый аргумент к делу #{case_id}.")
         bot.send_message(message.chat.id, f"Ваши новые аргументы по делу №{case_id} приняты.")
-        appealManager.delete_user_state(user_id)
\ No newline at end of file
+        ctx.delete()
\ No newline at end of file
@@ -5,6 +5,7 @@
 import logging
 from typing import Optional, Union, Dict, Any
 
+from telegramMetadata import telegram_metadata
 from .parse_link import parse_message_link
 from .council_helpers import is_link_from_council, resolve_council_id
 
@@ -12,7 +13,7 @@ log = logging.getLogger("hjr-bot.telegram_helpers")
 
 def get_chat_safe(bot, chat_id: Union[int, str]):
     try:
-        return bot.get_chat(chat_id)
+        return telegram_metadata.get_chat(bot, chat_id)
     except Exception as e:
         log.warning(f"[tg_helper] get_chat failed for {chat_id}: {e}")
         return None
@@ -130,10 +131,10 @@ def validate_appeal_link(bot, url: str, user_chat_id: int) -> (bool, Union[str,
 
     try:
         log.info(f"[VALIDATOR] DIAGNOSTIC Step 3: Checking source chat {from_chat}...")
-        chat_info = bot.get_chat(from_chat)
+        chat_info = telegram_metadata.get_chat(bot, from_chat)
         protect_content = getattr(chat_info, 'has_protected_content', False) or getattr(chat_info, 'protect_content', False)
         log.info(f"[VALIDATOR] DIAGNOSTIC: Source chat title: '{chat_info.title}', protect_content flag: {protect_content}")
-        bot_member_info = bot.get_chat_member(from_chat, bot.get_me().id)
+        bot_member_info = telegram_metadata.get_bot_member(bot, from_chat)
         log.info(f"[VALIDATOR] DIAGNOSTIC: Bot status in chat {from_chat} is '{bot_member_info.status}'.")
     except Exception as e:
         log.error(f"[VALIDATOR] FAILED DIAGNOSTIC Step 3: Could not get chat info for {from_chat}. Error: {e}")
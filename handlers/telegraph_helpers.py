@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import logging
+import threading
 from telegraph import Telegraph
 from telegraph.exceptions import TelegraphException
 # ИСПРАВЛЕНО: Импортируем стандартную и надежную библиотеку для конвертации
@@ -7,20 +8,29 @@ import markdown
 
 log = logging.getLogger("hjr-bot.telegraph")
 
-telegraph = Telegraph()
+_telegraph = None
+_telegraph_lock = threading.Lock()
 
-try:
-    access_token = telegraph.create_account(short_name='hjr-bot')
-    log.info(f"Аккаунт Telegraph успешно создан/загружен. Access Token: {access_token}")
-except TelegraphException as e:
-    log.warning(f"Не удалось создать аккаунт Telegraph, посты будут анонимными. Ошибка: {e}")
+def _get_telegraph() -> Telegraph:
+    """Клиент Telegraph; аккаунт создаётся при первой публикации, а не при импорте модуля."""
+    global _telegraph
+    with _telegraph_lock:
+        if _telegraph is None:
+            telegraph = Telegraph()
+            try:
+                telegraph.create_account(short_name='hjr-bot')
+                log.info("Аккаунт Telegraph успешно создан/загружен.")
+            except TelegraphException as e:
+                log.warning(f"Не удалось создать аккаунт Telegraph, посты будут анонимными. Ошибка: {e}")
+            _telegraph = telegraph
+        return _telegraph
 
 def post_to_telegraph(title: str, content_html: str) -> str:
     """
     Публикует контент в Telegra.ph и возвращает URL страницы.
     """
     try:
-        response = telegraph.create_page(
+        response = _get_telegraph().create_page(
             title=title,
             html_content=content_html
         )
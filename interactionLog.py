@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Буферизованная запись журнала действий (interaction_logs).
+
+write() не ходит в БД: событие получает log_id из заранее выделенного блока
+значений последовательности и ставится в буфер. Фоновый поток сбрасывает
+буфер одной командой COPY, когда в нём набирается LOG_FLUSH_SIZE событий или
+проходит LOG_FLUSH_INTERVAL секунд, и заранее добирает следующий блок
+log_id. При завершении процесса буфер сбрасывается хуком atexit в main.py —
+после того как разобраны очереди апдейтов, которые тоже пишут в журнал.
+
+Если БД недоступна, события остаются в буфере (не больше LOG_BUFFER_MAX, самые
+старые отбрасываются) и записываются при следующем сбросе. Если же БД отвергла
+сами данные, пачка пишется построчно: отбрасывается только плохая строка.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import psycopg
+
+from metrics import Histogram
+
+log = logging.getLogger("hjr-bot.interaction_log")
+
+LOG_FLUSH_SIZE = int(os.getenv("LOG_FLUSH_SIZE", "50"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))
+LOG_BUFFER_MAX = int(os.getenv("LOG_BUFFER_MAX", "10000"))
+# Сколько log_id выделять за один запрос к последовательности.
+LOG_ID_BLOCK = int(os.getenv("LOG_ID_BLOCK", "50"))
+
+COLUMNS = ("log_id", "user_id", "case_id", "action", "details", "created_at")
+
+# Ошибки связи с БД (в том числе таймаут пула и RuntimeError из _get_conn): пачка
+# возвращается в буфер. Остальные ошибки БД относятся к данным, и пачка пишется построчно.
+_CONNECTION_ERRORS = (psycopg.OperationalError, psycopg.InterfaceError, RuntimeError, ConnectionError)
+
+
+class InteractionLogWriter:
+    def __init__(self, get_conn, flush_size: int = LOG_FLUSH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL,
+                 id_block: int = LOG_ID_BLOCK):
+        """get_conn — контекстный менеджер, выдающий соединение из пула (appealManager._get_conn)."""
+        self._get_conn = get_conn
+        self.flush_size = max(flush_size, 1)
+        self.flush_interval = flush_interval
+        self.id_block = max(id_block, 1)
+        # Когда в запасе остаётся меньше стольких id, фоновый поток выделяет новый блок.
+        self.low_watermark = max(self.id_block // 4, 1)
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._ids = deque()
+        # Один сброс за раз: и фоновый поток, и сброс при завершении процесса.
+        self._flush_lock = threading.Lock()
+        self._allocate_lock = threading.Lock()
+        self._started = False
+        self.flush_ms = Histogram()
+        self._stats = {"written": 0, "flushes": 0, "failed_flushes": 0, "dropped": 0, "ids_allocated": 0, "sync_allocations": 0,
+                       "rejected_rows": 0}
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name="interaction-log", daemon=True).start()
+
+    def write(self, user_id, action, case_id=None, details="") -> int:
+        """Ставит событие в очередь на запись и возвращает его log_id (None, если id выделить не удалось)."""
+        log_id = self._next_id()
+        if log_id is None:
+            return None
+        row = (log_id, user_id, case_id, action, details, datetime.now(timezone.utc))
+        with self._cond:
+            self._buffer.append(row)
+            if len(self._buffer) > LOG_BUFFER_MAX:
+                del self._buffer[0]
+                self._stats["dropped"] += 1
+            if len(self._buffer) >= self.flush_size or len(self._ids) < self.low_watermark:
+                self._cond.notify()
+        return log_id
+
+    def _next_id(self):
+        with self._cond:
+            if self._ids:
+                return self._ids.popleft()
+        # Блок кончился раньше, чем фоновый поток успел его пополнить.
+        with self._cond:
+            self._stats["sync_allocations"] += 1
+        if not self._allocate():
+            return None
+        with self._cond:
+            return self._ids.popleft() if self._ids else None
+
+    def _allocate(self) -> bool:
+        """Выделяет блок log_id из последовательности interaction_logs одним запросом."""
+        with self._allocate_lock:
+            with self._cond:
+                # Пока ждали замок, блок мог выделить другой поток.
+                if len(self._ids) >= self.low_watermark:
+                    return True
+            try:
+                with self._get_conn() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            "SELECT nextval(pg_get_serial_sequence('interaction_logs', 'log_id')) FROM generate_series(1, %s)",
+                            (self.id_block,)
+                        )
+                        ids = [row[0] for row in cur.fetchall()]
+            except Exception as e:
+                log.error(f"[ОШИБКА] Не удалось выделить блок log_id: {e}")
+                return False
+            with self._cond:
+                self._ids.extend(ids)
+                self._stats["ids_allocated"] += len(ids)
+            return True
+
+    def flush(self) -> bool:
+        """Записывает накопленные события одним COPY; False, если записать не удалось."""
+        with self._flush_lock:
+            with self._cond:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return True
+            started = time.perf_counter()
+            try:
+                with self._get_conn() as conn:
+                    with conn.cursor() as cur:
+                        with cur.copy(f"COPY interaction_logs ({', '.join(COLUMNS)}) FROM STDIN") as copy:
+                            for row in rows:
+                                copy.write_row(row)
+                    conn.commit()
+                written = len(rows)
+            except _CONNECTION_ERRORS as e:
+                log.error(f"[ОШИБКА] Не удалось записать {len(rows)} событий в interaction_logs: {e}")
+                self._requeue(rows)
+                return False
+            except Exception as e:
+                log.warning(f"COPY в interaction_logs отклонён ({e}), записываю {len(rows)} событий по одному.")
+                written, unwritten = self._write_rows(rows)
+                if unwritten:
+                    self._requeue(unwritten)
+                    return False
+            self.flush_ms.observe((time.perf_counter() - started) * 1000)
+            with self._cond:
+                self._stats["written"] += written
+                self._stats["flushes"] += 1
+            return True
+
+    def _write_rows(self, rows):
+        """
+        Пишет события по одному, каждое в своей транзакции; строку, которую БД
+        отвергла, отбрасывает. Возвращает (сколько записано, что не успели
+        записать из-за потери связи с БД).
+        """
+        query = f"INSERT INTO interaction_logs ({', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * len(COLUMNS))})"
+        written = 0
+        for position, row in enumerate(rows):
+            try:
+                with self._get_conn() as conn:
+                    with conn.transaction():
+                        conn.execute(query, row)
+                written += 1
+            except _CONNECTION_ERRORS as e:
+                log.error(f"[ОШИБКА] Не удалось записать {len(rows) - position} событий в interaction_logs: {e}")
+                return written, rows[position:]
+            except Exception as e:
+                log.error(f"[ОШИБКА] Событие log_id={row[0]} ({row[3]}) отброшено, БД его не принимает: {e}")
+                with self._cond:
+                    self._stats["rejected_rows"] += 1
+        return written, []
+
+    def _requeue(self, rows):
+        """Возвращает события в начало буфера, сохраняя порядок."""
+        with self._cond:
+            self._buffer[:0] = rows
+            overflow = len(self._buffer) - LOG_BUFFER_MAX
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self._stats["dropped"] += overflow
+            self._stats["failed_flushes"] += 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                low_on_ids = len(self._ids) < self.low_watermark
+            healthy = self._allocate() if low_on_ids else True
+            healthy = self.flush() and healthy
+            if not healthy:
+                # БД недоступна: не долбим её чаще, чем раз в flush_interval.
+                time.sleep(self.flush_interval)
+                continue
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: len(self._buffer) >= self.flush_size or len(self._ids) < self.low_watermark,
+                    self.flush_interval,
+                )
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["buffered"] = len(self._buffer)
+            stats["ids_reserved"] = len(self._ids)
+        stats["flush_ms"] = self.flush_ms.snapshot()
+        return stats
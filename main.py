@@ -2,12 +2,13 @@
 
 import os
 import time
+import atexit
 import logging
 import subprocess
 from threading import Thread
 from flask import Flask, request, abort
 import telebot
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # --- ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ ---
 COMMIT_HASH = os.getenv("RAILWAY_GIT_COMMIT_SHA", "N/A")[:7]
@@ -23,46 +24,126 @@ log = logging.getLogger("hjr-bot")
 HJRBOT_TELEGRAM_TOKEN = os.getenv("HJRBOT_TELEGRAM_TOKEN")
 WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
 COUNCIL_CHAT_ID = os.getenv("EDITORS_GROUP_ID") # Используем для stop_poll
+# chat_member не приходит по умолчанию, а нужен для сброса кеша авторизации редакторов
+ALLOWED_UPDATES = telebot.util.update_types
 
 if not HJRBOT_TELEGRAM_TOKEN:
     raise RuntimeError("Не найден HJRBOT_TELEGRAM_TOKEN в окружении.")
 
 # --- Создание экземпляров ---
-bot = telebot.TeleBot(HJRBOT_TELEGRAM_TOKEN)
+# Middleware нужен для загрузки состояния FSM один раз на апдейт (handlers/fsm_context.py)
+telebot.apihelper.ENABLE_MIDDLEWARE = True
+# threaded=False: обработчики выполняются в потоках UpdateDispatcher, а не во внутреннем пуле telebot
+bot = telebot.TeleBot(HJRBOT_TELEGRAM_TOKEN, threaded=False)
 app = Flask(__name__)
 
 # --- Импорт модулей ---
 import connectionChecker
 import appealManager
+from deadlineScheduler import deadline_scheduler
+from telegramMetadata import telegram_metadata
+from promptCache import prompt_cache
+from promptDocuments import prompt_documents
+from verdictCache import verdict_cache
+from geminiClient import gemini_client
+import sendQueue
+from sendQueue import send_queue
+import finalizationQueue
+from updateDispatcher import UpdateDispatcher
+from updateDedup import update_deduplicator
 from handlers import register_all_handlers
 from handlers.council_helpers import resolve_council_id
 
 # --- Регистрация обработчиков ---
+# Все исходящие сообщения идут через общую очередь с лимитами Telegram (sendQueue.py)
+send_queue.install(bot)
 register_all_handlers(bot)
+finalizationQueue.configure(bot, COMMIT_HASH, BOT_VERSION)
+update_dispatcher = UpdateDispatcher(bot, deduplicator=update_deduplicator)
+update_dispatcher.start()
+
+def shutdown():
+    """Завершение процесса: сначала дообрабатываем принятые апдейты, потом сбрасываем журнал, куда они пишут."""
+    update_dispatcher.shutdown()
+    appealManager.interaction_log.flush()
+
+atexit.register(shutdown)
 
 # --- Webhook route и Health Check ---
 @app.post(f"/webhook/{HJRBOT_TELEGRAM_TOKEN}")
 def telegram_webhook():
     if request.headers.get("content-type") == "application/json":
         update = telebot.types.Update.de_json(request.get_data(as_text=True))
-        bot.process_new_updates([update])
+        if update_deduplicator.seen_recently(update.update_id):
+            return "ok", 200
+        if not update_dispatcher.submit(update):
+            update_deduplicator.forget(update.update_id)
+            # Очередь заполнена или процесс завершается: 503 заставит Telegram повторить доставку позже
+            return "busy", 503
         return "ok", 200
     abort(400)
 
 @app.get("/")
 def health_check():
+    degraded = connectionChecker.health_status()["degraded"]
+    if degraded:
+        return f"Bot is running (degraded: {', '.join(degraded)}).", 200
     return "Bot is running.", 200
 
-def startup_and_timer_tasks():
-    from geminiProcessor import finalize_appeal, finalize_review
-    from handlers.admin_flow import sync_editors_list
+@app.get("/ready")
+def readiness_check():
+    # Результаты последних проверок API; сами проверки здесь не выполняются.
+    status = connectionChecker.health_status()
+    return status, 200 if status["ready"] else 503
+
+@app.get("/metrics")
+def metrics():
+    from geminiProcessor import get_prompt_stats
+    return {
+        "health": connectionChecker.health_status(),
+        "db_pool": connectionChecker.get_pool_stats(),
+        "user_state_cache": appealManager.get_user_state_cache_stats(),
+        "deadline_scheduler": deadline_scheduler.stats(),
+        "finalization": finalizationQueue.get_stats(),
+        "updates": update_dispatcher.stats(),
+        "update_dedup": update_deduplicator.stats(),
+        "editor_cache": appealManager.get_editor_cache_stats(),
+        "telegram_metadata": telegram_metadata.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "prompt_documents": {"rules_version": prompt_documents.rules_version, "reloads": prompt_documents.reloads},
+        "verdict_prompts": get_prompt_stats(),
+        "verdict_cache": verdict_cache.stats(),
+        "gemini": gemini_client.stats(),
+        "send_queue": send_queue.stats(),
+        "interaction_log": appealManager.interaction_log.stats(),
+    }, 200
 
+def startup_and_timer_tasks():
     log.info("Запуск фоновых задач...")
-    time.sleep(3)
 
     if not connectionChecker.check_all_apis(bot):
-        log.error("Проверка API провалилась. Бот может работать некорректно.")
-        return
+        log.error("Часть API недоступна, бот работает в ограниченном режиме. Проверки повторяются в фоне.")
+        connectionChecker.start_health_retries(bot)
+
+    Thread(target=telegram_startup_tasks, name="telegram-startup", daemon=True).start()
+
+    # Без БД таймеры не загрузить: ждём, пока фоновая проверка её не дождётся.
+    connectionChecker.wait_until_healthy("database")
+    appealManager.interaction_log.start()
+    appealManager.start_state_cache_invalidation()
+    if not connectionChecker.trgm_available:
+        log.info("pg_trgm недоступен, строю индекс похожих апелляций в памяти...")
+        appealManager.start_similarity_index_rebuilds()
+
+    log.info("Запущен планировщик дедлайнов.")
+    deadline_scheduler.run(process_case_deadline, appealManager.get_timer_deadlines)
+
+def telegram_startup_tasks():
+    """Синхронизация редакторов и webhook: запускаются, как только доступны Telegram и БД."""
+    from handlers.admin_flow import sync_editors_list
+
+    connectionChecker.wait_until_healthy("telegram")
+    connectionChecker.wait_until_healthy("database")
 
     log.info("Запуск первоначальной синхронизации списка редакторов...")
     sync_editors_list(bot)
@@ -70,82 +151,74 @@ def startup_and_timer_tasks():
     if WEBHOOK_BASE_URL:
         webhook_url = f"{WEBHOOK_BASE_URL.strip('/')}/webhook/{HJRBOT_TELEGRAM_TOKEN}"
         current_webhook = bot.get_webhook_info()
-        if current_webhook.url != webhook_url:
+        if current_webhook.url != webhook_url or set(current_webhook.allowed_updates or []) != set(ALLOWED_UPDATES):
             log.info(f"Установка webhook на: {webhook_url}")
             bot.remove_webhook()
             time.sleep(0.5)
-            bot.set_webhook(url=webhook_url)
+            bot.set_webhook(url=webhook_url, allowed_updates=ALLOWED_UPDATES)
             log.info("Webhook успешно установлен.")
         else:
             log.info("Webhook уже установлен.")
     else:
         log.warning("WEBHOOK_BASE_URL не задан. Webhook не будет установлен.")
 
-    log.info("Запущена фоновая задача проверки таймеров.")
-    while True:
-        try:
-            active_appeals = appealManager.get_appeals_in_collection()
-            for appeal_data in active_appeals:
-                if not appeal_data or 'case_id' not in appeal_data:
-                    continue
-
-                case_id = appeal_data['case_id']
-                status = appeal_data.get('status')
-                expires_at = appeal_data.get('timer_expires_at')
-
-                # Проверяем, истек ли таймер
-                if not (expires_at and datetime.now(expires_at.tzinfo) > expires_at):
-                    # Если таймер не истек, проверяем на досрочное завершение для обычных апелляций
-                    if status == 'collecting':
-                        expected_responses = appeal_data.get('expected_responses')
-                        if expected_responses is not None and expected_responses > 0:
-                            council_answers = appeal_data.get('council_answers') or []
-                            if len(council_answers) >= expected_responses:
-                                log.info(f"Досрочное завершение для дела #{case_id}")
-                                finalize_appeal(appeal_data, bot, COMMIT_HASH, BOT_VERSION)
-                    continue # Переходим к следующему делу, если таймер не истек
-
-                # Если таймер истек, обрабатываем в зависимости от статуса
-                if status == 'collecting':
-                    log.info(f"Просроченный таймер для дела #{case_id}.")
-                    finalize_appeal(appeal_data, bot, COMMIT_HASH, BOT_VERSION)
-
-                elif status == 'review_poll_pending':
-                    log.info(f"Таймер голосования по пересмотру дела #{case_id} истек. Проверяю результаты.")
-                    review_data = appeal_data.get('review_data', {})
-                    poll_message_id = review_data.get('poll_message_id')
-
-                    if poll_message_id and COUNCIL_CHAT_ID:
-                        final_poll = bot.stop_poll(COUNCIL_CHAT_ID, poll_message_id)
-
-                        total_members = bot.get_chat_member_count(COUNCIL_CHAT_ID) - 1 # Вычитаем самого бота
-                        inactive_members = appealManager.count_inactive_editors()
-                        active_members = total_members - inactive_members
-                        threshold = active_members / 2
-
-                        for_votes = 0
-                        for opt in final_poll.options:
-                            if "да" in opt.text.lower():
-                                for_votes = opt.voter_count
-
-                        if for_votes > threshold:
-                            log.info(f"Пересмотр дела #{case_id} одобрен ({for_votes} > {threshold}).")
-                            appealManager.update_appeal(case_id, "status", "reviewing")
-                            new_expires_at = datetime.utcnow() + timedelta(hours=24)
-                            appealManager.update_appeal(case_id, "timer_expires_at", new_expires_at)
-                            bot.send_message(COUNCIL_CHAT_ID, f"📣 Пересмотр дела №{case_id} одобрен Советом. Начался 24-часовой сбор дополнительных аргументов через команду `/replyrecase {case_id}` в ЛС.", message_thread_id=appeal_data.get("message_thread_id"))
-                        else:
-                            log.info(f"Пересмотр дела #{case_id} отклонен ({for_votes} <= {threshold}).")
-                            appealManager.update_appeal(case_id, "status", "closed") # Возвращаем статус
-                            bot.send_message(COUNCIL_CHAT_ID, f"Пересмотр дела №{case_id} не набрал абсолютного большинства голосов и был отклонен.", message_thread_id=appeal_data.get("message_thread_id"))
-
-                elif status == 'reviewing':
-                    log.info(f"Просроченный таймер для ПЕРЕСМОТРА дела #{case_id}.")
-                    finalize_review(appeal_data, bot, COMMIT_HASH, BOT_VERSION)
-
-        except Exception as e:
-            log.error(f"Критическая ошибка в фоновой задаче: {e}", exc_info=True)
-        time.sleep(60)
+def process_case_deadline(case_id):
+    """
+    Вызывается планировщиком, когда наступил дедлайн дела.
+    Сама финализация выполняется в пуле finalizationQueue, чтобы не задерживать другие дедлайны.
+    """
+    appeal_data = appealManager.get_appeal(case_id)
+    if not appeal_data:
+        return
+
+    status = appeal_data.get('status')
+    expires_at = appeal_data.get('timer_expires_at')
+
+    # Таймер ещё не истек (его перенесли) — возвращаем дело в очередь на настоящий дедлайн.
+    # Досрочное завершение запускает сам add_council_answer.
+    if not (expires_at and datetime.now(expires_at.tzinfo) >= expires_at):
+        if expires_at and status in appealManager.TIMER_STATUSES:
+            deadline_scheduler.schedule(case_id, expires_at)
+        return
+
+    # Если таймер истек, обрабатываем в зависимости от статуса
+    if status == 'collecting':
+        log.info(f"Просроченный таймер для дела #{case_id}.")
+        finalizationQueue.submit_appeal_finalization(case_id)
+
+    elif status == 'review_poll_pending':
+        log.info(f"Таймер голосования по пересмотру дела #{case_id} истек. Проверяю результаты.")
+        review_data = appeal_data.get('review_data', {})
+        poll_message_id = review_data.get('poll_message_id')
+
+        if poll_message_id and COUNCIL_CHAT_ID:
+            final_poll = bot.stop_poll(COUNCIL_CHAT_ID, poll_message_id)
+
+            total_members = telegram_metadata.get_chat_member_count(bot, COUNCIL_CHAT_ID) - 1 # Вычитаем самого бота
+            inactive_members = appealManager.count_inactive_editors()
+            active_members = total_members - inactive_members
+            threshold = active_members / 2
+
+            for_votes = 0
+            for opt in final_poll.options:
+                if "да" in opt.text.lower():
+                    for_votes = opt.voter_count
+
+            if for_votes > threshold:
+                log.info(f"Пересмотр дела #{case_id} одобрен ({for_votes} > {threshold}).")
+                new_expires_at = datetime.utcnow() + timedelta(hours=24)
+                appealManager.update_appeal_fields(case_id, status="reviewing", timer_expires_at=new_expires_at)
+                with sendQueue.bulk():
+                    bot.send_message(COUNCIL_CHAT_ID, f"📣 Пересмотр дела №{case_id} одобрен Советом. Начался 24-часовой сбор дополнительных аргументов через команду `/replyrecase {case_id}` в ЛС.", message_thread_id=appeal_data.get("message_thread_id"))
+            else:
+                log.info(f"Пересмотр дела #{case_id} отклонен ({for_votes} <= {threshold}).")
+                appealManager.update_appeal(case_id, "status", "closed") # Возвращаем статус
+                with sendQueue.bulk():
+                    bot.send_message(COUNCIL_CHAT_ID, f"Пересмотр дела №{case_id} не набрал абсолютного большинства голосов и был отклонен.", message_thread_id=appeal_data.get("message_thread_id"))
+
+    elif status == 'reviewing':
+        log.info(f"Просроченный таймер для ПЕРЕСМОТРА дела #{case_id}.")
+        finalizationQueue.submit_review_finalization(case_id)
 
 background_thread = Thread(target=startup_and_timer_tasks, daemon=True)
 background_thread.start()
\ No newline at end of file
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Простые метрики в памяти процесса для /metrics.
+"""
+import bisect
+import threading
+
+# Границы корзин по умолчанию, в миллисекундах.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: счётчики значений <= каждой границы."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+            self._max = max(self._max, value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total, count, maximum = self._sum, self._count, self._max
+        buckets = {f"le_{bound}": counts[index] for index, bound in enumerate(self.buckets)}
+        buckets["le_inf"] = counts[-1]
+        return {
+            "count": count,
+            "avg": round(total / count, 2) if count else 0,
+            "max": round(maximum, 2),
+            "buckets": buckets,
+        }
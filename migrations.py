@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Версионные миграции схемы БД.
+
+MIGRATIONS — упорядоченный список (версия, описание, SQL-команды). Применённые
+версии записываются в таблицу schema_version, поэтому каждая миграция
+выполняется ровно один раз, в своей транзакции. Несколько процессов,
+стартующих одновременно, сериализуются через advisory lock. Если схема уже
+актуальна, run_migrations обходится парой лёгких запросов.
+
+Новые изменения схемы добавляются только новой миграцией в конец списка;
+применённые миграции не редактируются.
+
+Расширение pg_trgm сюда не входит: на него может не хватить прав, поэтому
+connectionChecker._enable_trigram_search пробует включить его при каждом
+старте процесса и работает без него, если не вышло.
+"""
+import logging
+
+log = logging.getLogger("hjr-bot.migrations")
+
+# Ключ pg_advisory_xact_lock для миграций (произвольная константа).
+MIGRATION_LOCK_KEY = 4_815_162_342
+
+# Статусы дел, у которых идёт таймер (appealManager.TIMER_STATUSES).
+_TIMER_STATUSES_SQL = "('collecting', 'reviewing', 'review_poll_pending')"
+
+MIGRATIONS = [
+    (1, "Базовая схема (таблицы, создававшиеся при каждом подключении)", [
+        """
+        CREATE TABLE IF NOT EXISTS appeals (
+            case_id INTEGER PRIMARY KEY,
+            applicant_chat_id BIGINT,
+            decision_text TEXT,
+            applicant_arguments TEXT,
+            applicant_answers JSONB,
+            council_answers JSONB,
+            total_voters INTEGER,
+            status TEXT,
+            expected_responses INTEGER,
+            timer_expires_at TIMESTAMPTZ,
+            ai_verdict TEXT,
+            message_thread_id INTEGER,
+            is_reviewed BOOLEAN DEFAULT FALSE,
+            review_data JSONB,
+            commit_hash VARCHAR(40),
+            verdict_log_id INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_states (
+            user_id TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+        # Уже обработанные апдейты Telegram (защита от повторной доставки webhook)
+        """
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id BIGINT PRIMARY KEY,
+            processed_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+        # Готовые вердикты по хешу промпта и модели
+        """
+        CREATE TABLE IF NOT EXISTS verdict_cache (
+            prompt_hash TEXT PRIMARY KEY,
+            model_name TEXT,
+            case_id INTEGER,
+            verdict TEXT,
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS editors (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT
+        )
+        """,
+        "ALTER TABLE editors ADD COLUMN IF NOT EXISTS is_inactive BOOLEAN DEFAULT FALSE",
+        "ALTER TABLE editors ADD COLUMN IF NOT EXISTS role TEXT DEFAULT 'editor'",
+        # Версии строк user_states: глобальная последовательность, чтобы версия
+        # росла монотонно даже после удаления и повторного создания строки.
+        "CREATE SEQUENCE IF NOT EXISTS user_states_version_seq",
+        "ALTER TABLE user_states ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0",
+        # Версия устава (хеш rules.txt), по которому вынесен вердикт
+        "ALTER TABLE appeals ADD COLUMN IF NOT EXISTS rules_version TEXT",
+    ]),
+    (2, "Колонки и таблицы, которые код использует, но схема не создавала", [
+        "ALTER TABLE appeals ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ",
+        "ALTER TABLE appeals ADD COLUMN IF NOT EXISTS applicant_info JSONB",
+        """
+        CREATE TABLE IF NOT EXISTS interaction_logs (
+            log_id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            case_id INTEGER,
+            action TEXT,
+            details TEXT,
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+    ]),
+    (3, "Индексы под частые запросы", [
+        # appealManager.get_timer_deadlines: только дела с идущим таймером
+        f"""
+        CREATE INDEX IF NOT EXISTS appeals_timer_active_idx
+            ON appeals (timer_expires_at)
+            WHERE status IN {_TIMER_STATUSES_SQL}
+        """,
+        # appealManager.get_active_appeal_by_user: условие повторяет запрос, чтобы планировщик мог взять частичный индекс
+        """
+        CREATE INDEX IF NOT EXISTS appeals_applicant_id_active_idx
+            ON appeals (((applicant_info->>'id')::bigint))
+            WHERE status != 'closed' AND status != 'closed_after_review'
+        """,
+        # appealManager.find_editor_by_username
+        "CREATE INDEX IF NOT EXISTS editors_username_idx ON editors (username)",
+        # appealManager.purge_processed_updates
+        "CREATE INDEX IF NOT EXISTS processed_updates_processed_at_idx ON processed_updates (processed_at)",
+    ]),
+    (4, "Время события в interaction_logs (журнал пишется пачками с опозданием)", [
+        "ALTER TABLE interaction_logs ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ DEFAULT NOW()",
+    ]),
+    (5, "Счётчик неудачных попыток финализации (geminiProcessor)", [
+        "ALTER TABLE appeals ADD COLUMN IF NOT EXISTS finalize_attempts INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    """Последняя применённая версия схемы (0, если schema_version ещё нет)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return 0
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cur.fetchone()[0]
+
+
+def run_migrations(conn, target: int = LATEST_VERSION) -> list:
+    """
+    Применяет недостающие миграции до версии target включительно.
+    Возвращает список применённых версий; при ошибке транзакция миграции
+    откатывается и исключение пробрасывается дальше.
+    """
+    version = current_version(conn)
+    conn.commit()
+    if version >= target:
+        return []
+
+    applied = []
+    for number, description, statements in MIGRATIONS:
+        if number > target:
+            break
+        if number <= version:
+            continue
+        with conn.cursor() as cur:
+            try:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TIMESTAMPTZ DEFAULT NOW()
+                    )
+                """)
+                # Пока ждали замок, миграцию мог применить другой процесс.
+                cur.execute("SELECT 1 FROM schema_version WHERE version = %s", (number,))
+                if cur.fetchone() is None:
+                    for statement in statements:
+                        cur.execute(statement)
+                    cur.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (number, description)
+                    )
+                    applied.append(number)
+                    print(f"Миграция {number}: {description} — применена.")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                log.error(f"Миграция {number} ({description}) не применена.", exc_info=True)
+                raise
+    return applied
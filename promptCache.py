@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Кеширование статического префикса промпта (устав, инструкции, архивные
+прецеденты) через context caching Gemini.
+
+Префикс регистрируется один раз и идентифицируется хешем содержимого: если
+rules.txt или instructions.txt изменились, создаётся новый кеш, а старый
+удаляется. В запросе к модели остаётся только часть, относящаяся к делу.
+Если кеш создать не удалось (нет API-ключа, модель не поддерживает кеширование,
+префикс меньше минимального размера), model_for возвращает None и вызывающий
+код отправляет полный промпт.
+
+Бэкенд задаётся переменной GEMINI_CONTEXT_CACHE:
+  gemini — context caching Gemini API (по умолчанию);
+  local  — локальная заглушка того же интерфейса, без сети (для тестов);
+  off    — кеширование отключено.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+from geminiClient import GEMINI_MODEL_NAME
+
+log = logging.getLogger("hjr-bot.prompt_cache")
+
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "gemini").strip().lower()
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# Пауза перед повторной попыткой создать кеш после ошибки.
+_RETRY_AFTER_FAILURE_SECONDS = 600
+# Кеш продлевается заранее, чтобы он не истёк посреди запроса.
+_REFRESH_MARGIN_SECONDS = 60
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class GeminiCacheBackend:
+    """Обёртка над genai.caching.CachedContent."""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL_NAME):
+        self.model_name = model_name
+
+    def create(self, display_name: str, prefix: str, ttl_seconds: int):
+        from google.generativeai import caching
+
+        return caching.CachedContent.create(
+            model=self.model_name,
+            display_name=display_name,
+            contents=[prefix],
+            ttl=timedelta(seconds=ttl_seconds),
+        )
+
+    def extend(self, cached, ttl_seconds: int):
+        cached.update(ttl=timedelta(seconds=ttl_seconds))
+
+    def delete(self, cached):
+        cached.delete()
+
+    def model(self, cached):
+        import google.generativeai as genai
+
+        return genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+
+class _LocalCachedContent:
+    def __init__(self, display_name: str, prefix: str):
+        self.name = f"cachedContents/local-{display_name}"
+        self.display_name = display_name
+        self.prefix = prefix
+
+
+class _LocalCachedModel:
+    """Модель поверх локального кеша: дописывает префикс к запросу и передаёт его base_model."""
+
+    def __init__(self, cached: _LocalCachedContent, base_model):
+        self._cached = cached
+        self._base_model = base_model
+
+    def generate_content(self, contents, **kwargs):
+        if self._base_model is None:
+            raise RuntimeError("Базовая модель для локального кеша не задана.")
+        return self._base_model.generate_content(self._cached.prefix + contents, **kwargs)
+
+
+class LocalCacheBackend:
+    """Заглушка API кеширования без сети: хранит префиксы в памяти процесса."""
+
+    name = "local"
+
+    def __init__(self, base_model=None, model_name: str = GEMINI_MODEL_NAME):
+        self.base_model = base_model
+        self.model_name = model_name
+        self.created = []
+        self.deleted = []
+
+    def create(self, display_name: str, prefix: str, ttl_seconds: int):
+        cached = _LocalCachedContent(display_name, prefix)
+        self.created.append(cached.name)
+        return cached
+
+    def extend(self, cached, ttl_seconds: int):
+        pass
+
+    def delete(self, cached):
+        self.deleted.append(cached.name)
+
+    def model(self, cached):
+        return _LocalCachedModel(cached, self.base_model)
+
+
+class _Entry:
+    def __init__(self, digest: str):
+        self.digest = digest
+        self.cached = None
+        self.model = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+        # Кеш создаёт или продлевает другой поток.
+        self.refreshing = False
+
+
+class PromptPrefixCache:
+    def __init__(self, backend=None, ttl_seconds: int = GEMINI_CONTEXT_CACHE_TTL):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = {"hits": 0, "created": 0, "extended": 0, "failures": 0, "fallbacks": 0}
+
+    @property
+    def model_name(self) -> str:
+        """Модель, к которой привязаны кеши (None, если кеширование отключено)."""
+        return self.backend.model_name if self.backend is not None else None
+
+    def model_for(self, kind: str, prefix: str):
+        """
+        Возвращает модель, привязанную к кешу префикса kind ('verdict', 'review'),
+        или None, если кеширование недоступно и нужно отправить полный промпт.
+        Сетевые вызовы (создание, продление) выполняются вне замка: пока один
+        поток создаёт кеш, остальные не ждут его, а отправляют полный промпт.
+        """
+        if self.backend is None:
+            return None
+        digest = content_hash(prefix)
+        now = time.monotonic()
+        stale = None
+        with self._lock:
+            entry = self._entries.get(kind)
+            if entry is None or entry.digest != digest:
+                if entry is not None:
+                    stale = entry.cached
+                entry = self._entries[kind] = _Entry(digest)
+
+            if entry.model is not None and now < entry.expires_at - _REFRESH_MARGIN_SECONDS:
+                self._stats["hits"] += 1
+                return entry.model
+            if entry.refreshing or (entry.model is None and now < entry.retry_at):
+                if entry.model is not None and now < entry.expires_at:
+                    self._stats["hits"] += 1
+                    return entry.model
+                self._stats["fallbacks"] += 1
+                return None
+            entry.refreshing = True
+            cached, model = entry.cached, entry.model
+
+        if stale is not None:
+            self._delete(stale)
+        try:
+            outcome = "extended"
+            if cached is not None:
+                try:
+                    self.backend.extend(cached, self.ttl_seconds)
+                except Exception:
+                    # Кеш уже истёк на стороне API — создаём заново.
+                    cached = None
+            if cached is None:
+                cached = self.backend.create(f"hjr-{kind}-{digest[:12]}", prefix, self.ttl_seconds)
+                model = self.backend.model(cached)
+                outcome = "created"
+                log.info(f"Создан кеш префикса '{kind}' ({digest[:12]}, {len(prefix)} символов).")
+        except Exception as e:
+            with self._lock:
+                entry.refreshing = False
+                entry.cached = entry.model = None
+                entry.retry_at = now + _RETRY_AFTER_FAILURE_SECONDS
+                self._stats["failures"] += 1
+                self._stats["fallbacks"] += 1
+            log.warning(f"Не удалось создать кеш префикса '{kind}', используется полный промпт: {e}")
+            return None
+
+        with self._lock:
+            entry.refreshing = False
+            superseded = self._entries.get(kind) is not entry
+            if not superseded:
+                entry.cached, entry.model = cached, model
+                entry.expires_at = now + self.ttl_seconds
+                self._stats[outcome] += 1
+        if superseded:
+            # Пока создавали кеш, префикс сменился: этот кеш больше никому не нужен.
+            self._delete(cached)
+            return None
+        return model
+
+    def _delete(self, cached):
+        try:
+            self.backend.delete(cached)
+        except Exception as e:
+            log.warning(f"Не удалось удалить устаревший кеш префикса: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["prefixes"] = {kind: entry.digest[:12] for kind, entry in self._entries.items() if entry.model is not None}
+        stats["backend"] = self.backend.name if self.backend is not None else "off"
+        return stats
+
+
+def _make_backend():
+    if GEMINI_CONTEXT_CACHE == "gemini":
+        return GeminiCacheBackend()
+    if GEMINI_CONTEXT_CACHE == "local":
+        return LocalCacheBackend()
+    return None
+
+
+prompt_cache = PromptPrefixCache(_make_backend())
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Реестр документов для промптов: rules.txt и instructions.txt.
+
+Файлы читаются один раз; дальше не чаще раза в DOCUMENTS_CHECK_INTERVAL
+секунд проверяется их mtime, и при изменении содержимого (по хешу)
+документы перезагружаются. При каждой загрузке заранее собираются
+статические части промптов, разбирается шаблон инструкций и строится индекс
+разделов устава (rulesIndex). current() возвращает согласованный неизменяемый
+снимок — один и тот же на всё время подготовки вердикта, даже если файл
+поменяется посередине.
+"""
+import os
+import time
+import string
+import hashlib
+import logging
+import threading
+
+from precedents import PRECEDENTS
+from rulesIndex import RulesIndex
+
+log = logging.getLogger("hjr-bot.documents")
+
+DOCUMENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DOCUMENTS_CHECK_INTERVAL = float(os.getenv("DOCUMENTS_CHECK_INTERVAL", "5"))
+
+RULES_FALLBACK = "Устав проекта не найден."
+INSTRUCTIONS_FALLBACK = "Инструкции для ИИ не найдены."
+
+
+class CompiledTemplate:
+    """Шаблон str.format, разобранный один раз; render не парсит строку заново."""
+
+    def __init__(self, template: str):
+        self.template = template
+        self._parts = list(string.Formatter().parse(template))
+        # Быстрый путь только для простых полей вида {name} без спецификаторов.
+        self._simple = all(
+            not (conversion or format_spec) and (field is None or field.isidentifier())
+            for _, field, format_spec, conversion in self._parts
+        )
+
+    def render(self, **values) -> str:
+        if not self._simple:
+            return self.template.format(**values)
+        chunks = []
+        for literal, field, _, _ in self._parts:
+            chunks.append(literal)
+            if field is not None:
+                chunks.append(str(values[field]))
+        return "".join(chunks)
+
+
+def _split_instructions(instructions: str):
+    """
+    Делит шаблон инструкций на статическую часть (до первой строки с
+    плейсхолдером) и шаблон, который заполняется для каждого дела.
+    """
+    lines = instructions.splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        if '{' in line:
+            return "".join(lines[:index]), "".join(lines[index:])
+    return instructions, ""
+
+
+def _archived_precedents_text() -> str:
+    if not PRECEDENTS:
+        return ""
+    text = "\n\n**К сведению: Архивные прецеденты**\n"
+    for p in PRECEDENTS:
+        text += f"- Дело №{p['case_id']}: {p['summary']} Вердикт: {p['decision_summary']}\n"
+    return text
+
+
+def build_verdict_prefix(instructions_head: str, project_rules: str) -> str:
+    """Общая для всех дел часть промпта вердикта: кешируется на стороне модели."""
+    return f"""
+{instructions_head}
+{_archived_precedents_text()}
+**Устав проекта для анализа:**
+<rules>
+{project_rules}
+</rules>
+"""
+
+
+def build_review_prefix(project_rules: str) -> str:
+    """Общая для всех пересмотров часть промпта: устав проекта."""
+    return f"""
+**Устав проекта для анализа:**
+<rules>
+{project_rules}
+</rules>
+"""
+
+
+class PromptSnapshot:
+    """Согласованный набор документов и собранных из них частей промпта."""
+
+    def __init__(self, rules: str, instructions: str, rules_version: str):
+        self.rules = rules
+        self.instructions = instructions
+        self.rules_version = rules_version
+        instructions_head, instructions_tail = _split_instructions(instructions)
+        self.instructions_template = CompiledTemplate(instructions_tail)
+        self.instructions_head = instructions_head
+        self.verdict_prefix = build_verdict_prefix(instructions_head, rules)
+        self.review_prefix = build_review_prefix(rules)
+        self.rules_index = RulesIndex(rules)
+
+    def render_instructions(self, case_id, commit_hash, log_id) -> str:
+        return self.instructions_template.render(case_id=case_id, commit_hash=commit_hash, log_id=log_id)
+
+
+class _Document:
+    def __init__(self, filename: str, fallback: str):
+        self.path = os.path.join(DOCUMENTS_DIR, filename)
+        self.fallback = fallback
+        self.text = fallback
+        self.digest = None
+        self.mtime = None
+        self.missing = False
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает файл, если изменился mtime. Возвращает True, если изменилось содержимое."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return False
+            with open(self.path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except OSError as e:
+            if not self.missing:
+                # Пишем в лог только при переходе в состояние ошибки, а не на каждый вызов.
+                log.error(f"Не удалось прочитать {self.path}: {e}. Используется заглушка.")
+                self.missing = True
+            self.mtime = None
+            if self.text == self.fallback:
+                return False
+            self.text, self.digest = self.fallback, None
+            return True
+        if self.missing:
+            log.info(f"Файл {self.path} снова доступен.")
+            self.missing = False
+        self.mtime = mtime
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if digest == self.digest:
+            return False
+        self.text, self.digest = text, digest
+        return True
+
+
+class PromptDocuments:
+    def __init__(self, check_interval: float = DOCUMENTS_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._rules = _Document("rules.txt", RULES_FALLBACK)
+        self._instructions = _Document("instructions.txt", INSTRUCTIONS_FALLBACK)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._next_check = 0.0
+        self.reloads = 0
+
+    def current(self) -> PromptSnapshot:
+        now = time.monotonic()
+        with self._lock:
+            if self._snapshot is None or now >= self._next_check:
+                self._next_check = now + self.check_interval
+                changed = self._rules.reload_if_changed()
+                changed = self._instructions.reload_if_changed() or changed
+                if changed or self._snapshot is None:
+                    rules_version = self._rules.digest[:12] if self._rules.digest else "missing"
+                    self._snapshot = PromptSnapshot(self._rules.text, self._instructions.text, rules_version)
+                    self.reloads += 1
+                    log.info(f"Документы промпта загружены (версия устава: {rules_version}).")
+            return self._snapshot
+
+    @property
+    def rules_version(self) -> str:
+        return self.current().rules_version
+
+
+prompt_documents = PromptDocuments()
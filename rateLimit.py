@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Token bucket для ограничения частоты запросов к внешним API.
+"""
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Не более rate запросов за per секунд, с запасом на всплеск до capacity.
+    block_for(seconds) запрещает выдачу токенов на заданное время (например,
+    по retry_after из ответа 429).
+    """
+
+    def __init__(self, rate: float, per: float = 1.0, capacity: float = None):
+        self.rate_per_second = rate / per
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Сколько секунд ждать до появления tokens токенов (0 — уже есть); ничего не забирает."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            available = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+            return 0.0 if available >= tokens else (tokens - available) / self.rate_per_second
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Забирает токены и возвращает 0, либо возвращает, сколько секунд подождать (ничего не забирая)."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate_per_second
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        """Ждёт токены; возвращает False, если не дождался за timeout секунд."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def block_for(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Поиск релевантных разделов устава для промпта вердикта.
+
+rules.txt состоит из нескольких документов (заголовки вида ____Название____),
+внутри которых разделы начинаются строками "N. Заголовок" или "N.0. Заголовок",
+а пункты нумеруются как N.M. Нумерация начинается заново в каждом документе,
+поэтому раздел идентифицируется парой (документ, номер раздела).
+
+Разделы индексируются BM25 по словам, усечённым до общей основы (без внешних
+зависимостей и морфологии). Явные ссылки на пункты в запросе ("п. 2.3")
+дополнительно поднимают разделы, где есть такой пункт. Разделы терминологии
+включаются всегда.
+"""
+import re
+import math
+from collections import Counter
+
+RULES_RETRIEVAL_TOP_K = 4
+# Вес совпадения номера пункта относительно BM25.
+CLAUSE_MATCH_BOOST = 5.0
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Длина, до которой усекаются слова: грубая замена стемминга для русского текста.
+STEM_LENGTH = 6
+
+_DOCUMENT_TITLE_RE = re.compile(r'^_{2,}\s*(.+?)\s*_{2,}\s*$')
+_SECTION_START_RE = re.compile(r'^(\d+)\.(?:0\.)?\s+\S')
+_CLAUSE_RE = re.compile(r'^(\d+\.\d+(?:\.\d+)?)\.?\s')
+_CLAUSE_REF_RE = re.compile(r'(?<![\d.])(\d{1,2}\.\d{1,2}(?:\.\d{1,2})?)(?![\d])')
+_TERMINOLOGY_RE = re.compile(r'^\s*терминология\s*$', re.IGNORECASE)
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: str):
+    return [word[:STEM_LENGTH] for word in _WORD_RE.findall(text.lower()) if len(word) > 2 and not word.isdigit()]
+
+
+def clause_refs(text: str) -> set:
+    return set(_CLAUSE_REF_RE.findall(text or ""))
+
+
+class RuleSection:
+    def __init__(self, index: int, document: str, title: str, lines: list, is_terminology: bool = False):
+        self.index = index
+        self.document = document
+        self.title = title
+        self.text = "\n".join(lines).strip()
+        self.is_terminology = is_terminology
+        self.clauses = {m.group(1) for line in lines if (m := _CLAUSE_RE.match(line.strip()))}
+
+    @property
+    def section_id(self) -> str:
+        return f"{self.document} / {self.title}"
+
+
+def split_sections(rules_text: str) -> list:
+    """Делит устав на разделы в исходном порядке."""
+    sections = []
+    document = ""
+    title = ""
+    lines = []
+    is_terminology = False
+
+    def flush():
+        if any(line.strip() for line in lines):
+            sections.append(RuleSection(len(sections), document, title or document, list(lines), is_terminology))
+
+    for line in rules_text.splitlines():
+        stripped = line.strip()
+        doc_match = _DOCUMENT_TITLE_RE.match(stripped)
+        if doc_match:
+            flush()
+            document, title, lines, is_terminology = doc_match.group(1), "", [line], False
+            continue
+        if _TERMINOLOGY_RE.match(stripped) or _SECTION_START_RE.match(stripped):
+            flush()
+            title, lines, is_terminology = stripped, [line], bool(_TERMINOLOGY_RE.match(stripped))
+            continue
+        lines.append(line)
+    flush()
+    return sections
+
+
+class RulesIndex:
+    def __init__(self, rules_text: str):
+        self.sections = split_sections(rules_text)
+        self._term_freqs = [Counter(tokenize(section.text)) for section in self.sections]
+        self._lengths = [sum(freqs.values()) for freqs in self._term_freqs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        doc_freq = Counter()
+        for freqs in self._term_freqs:
+            doc_freq.update(freqs.keys())
+        total = len(self.sections)
+        self._idf = {term: math.log(1 + (total - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def _bm25(self, index: int, query_terms: Counter) -> float:
+        freqs = self._term_freqs[index]
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[index] / (self._avg_length or 1))
+        score = 0.0
+        for term, query_count in query_terms.items():
+            tf = freqs.get(term)
+            if tf:
+                score += self._idf[term] * tf * (BM25_K1 + 1) / (tf + norm) * query_count
+        return score
+
+    def retrieve(self, queries, top_k: int = RULES_RETRIEVAL_TOP_K) -> list:
+        """
+        Возвращает разделы терминологии и top_k разделов, наиболее релевантных
+        текстам queries, в порядке следования в уставе.
+        """
+        query_text = "\n".join(q for q in queries if q)
+        query_terms = Counter(tokenize(query_text))
+        refs = clause_refs(query_text)
+        scored = []
+        for section in self.sections:
+            if section.is_terminology:
+                continue
+            score = self._bm25(section.index, query_terms) + CLAUSE_MATCH_BOOST * len(refs & section.clauses)
+            if score > 0:
+                scored.append((score, section.index))
+        scored.sort(reverse=True)
+        chosen = {index for _, index in scored[:top_k]}
+        return [s for s in self.sections if s.is_terminology or s.index in chosen]
+
+    @staticmethod
+    def render(sections) -> str:
+        """Собирает выбранные разделы в текст для <rules>, с заголовками документов."""
+        chunks = []
+        document = None
+        for section in sections:
+            if section.document != document:
+                document = section.document
+                if not section.text.startswith("__"):
+                    chunks.append(f"____{document}____")
+            chunks.append(section.text)
+        return "\n\n".join(chunks)
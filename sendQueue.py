@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Общая очередь исходящих сообщений Telegram.
+
+install(bot) подменяет у экземпляра бота send_message, send_poll,
+copy_message и forward_message (reply_to идёт через send_message): вызов
+ставится в очередь и ждёт отправки, поэтому вызывающий код по-прежнему
+получает Message или исключение. Отправку выполняют несколько потоков с
+учётом лимитов Telegram:
+  - общий token bucket на ~30 сообщений в секунду;
+  - свой bucket на каждый чат: ~20 в минуту для групп и каналов, ~1 в секунду для личных чатов;
+  - при 429 чат блокируется на retry_after, и сообщение отправляется повторно.
+
+Есть две полосы: interactive (ответы в диалогах, по умолчанию) и bulk
+(рассылка вердиктов и итогов голосований, см. bulk()). Пока в interactive
+есть готовое к отправке сообщение, bulk ждёт.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from metrics import Histogram
+from rateLimit import TokenBucket
+
+log = logging.getLogger("hjr-bot.send_queue")
+
+SEND_GLOBAL_PER_SECOND = float(os.getenv("SEND_GLOBAL_PER_SECOND", "30"))
+SEND_GROUP_PER_MINUTE = float(os.getenv("SEND_GROUP_PER_MINUTE", "20"))
+SEND_PRIVATE_PER_SECOND = float(os.getenv("SEND_PRIVATE_PER_SECOND", "1"))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "4"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+# Через сколько секунд простоя удалять bucket чата.
+_CHAT_BUCKET_IDLE_SECONDS = 600
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+WRAPPED_METHODS = ("send_message", "send_poll", "copy_message", "forward_message")
+
+_lane = threading.local()
+
+
+@contextmanager
+def bulk():
+    """Сообщения, отправленные внутри блока, идут по низкоприоритетной полосе."""
+    previous = getattr(_lane, "name", INTERACTIVE)
+    _lane.name = BULK
+    try:
+        yield
+    finally:
+        _lane.name = previous
+
+
+def _current_lane() -> str:
+    return getattr(_lane, "name", INTERACTIVE)
+
+
+def _is_group_chat(chat_id) -> bool:
+    if isinstance(chat_id, str):
+        text = chat_id.strip()
+        if text.startswith("@"):
+            return True
+        try:
+            chat_id = int(text)
+        except ValueError:
+            return True
+    return chat_id is not None and chat_id < 0
+
+
+def _retry_after(error) -> float:
+    """retry_after из ответа 429 (ApiTelegramException) или None для других ошибок."""
+    if getattr(error, "error_code", None) != 429:
+        return None
+    parameters = (getattr(error, "result_json", None) or {}).get("parameters") or {}
+    return float(parameters.get("retry_after", 1))
+
+
+class _Job:
+    def __init__(self, lane: str, chat_id, call, args, kwargs):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.call = call
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.attempts = 0
+
+
+class SendQueue:
+    def __init__(self, workers: int = SEND_WORKERS):
+        self.workers = max(workers, 1)
+        self.global_bucket = TokenBucket(SEND_GLOBAL_PER_SECOND)
+        self._chat_buckets = {}
+        self._chat_last_used = {}
+        self._lanes = {lane: deque() for lane in LANES}
+        self._cond = threading.Condition()
+        self._started = False
+        self._next_cleanup = 0.0
+        self.delivery_ms = {lane: Histogram() for lane in LANES}
+        self._stats = {"sent": 0, "failed": 0, "rate_limited": 0, "retried": 0}
+
+    def install(self, bot):
+        """Направляет отправку сообщений бота через очередь."""
+        for name in WRAPPED_METHODS:
+            original = getattr(bot, name)
+            setattr(bot, name, self._wrap(original))
+        self.start()
+
+    def _wrap(self, original):
+        def queued(*args, **kwargs):
+            chat_id = kwargs["chat_id"] if "chat_id" in kwargs else (args[0] if args else None)
+            return self.submit(chat_id, original, *args, **kwargs).result()
+        queued.__name__ = getattr(original, "__name__", "queued")
+        queued.__doc__ = getattr(original, "__doc__", None)
+        return queued
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name=f"send-queue-{index}", daemon=True).start()
+
+    def submit(self, chat_id, call, *args, **kwargs) -> Future:
+        job = _Job(_current_lane(), chat_id, call, args, kwargs)
+        with self._cond:
+            self._lanes[job.lane].append(job)
+            self._cond.notify()
+        return job.future
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            if _is_group_chat(chat_id):
+                bucket = TokenBucket(SEND_GROUP_PER_MINUTE, per=60.0)
+            else:
+                bucket = TokenBucket(SEND_PRIVATE_PER_SECOND, capacity=3)
+            self._chat_buckets[key] = bucket
+        self._chat_last_used[key] = time.monotonic()
+        return bucket
+
+    def _cleanup_buckets(self, now: float):
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + _CHAT_BUCKET_IDLE_SECONDS
+        for key, last_used in list(self._chat_last_used.items()):
+            if now - last_used > _CHAT_BUCKET_IDLE_SECONDS:
+                self._chat_last_used.pop(key, None)
+                self._chat_buckets.pop(key, None)
+
+    def _take_ready_job(self):
+        """Под замком: первое сообщение (interactive раньше bulk), которое можно отправить сейчас, или время ожидания."""
+        self._cleanup_buckets(time.monotonic())
+        global_wait = self.global_bucket.wait_time()
+        if global_wait > 0:
+            return None, global_wait
+        wait = None
+        for lane in LANES:
+            jobs = self._lanes[lane]
+            for index, job in enumerate(jobs):
+                chat_wait = self._chat_bucket(job.chat_id).try_acquire()
+                if chat_wait > 0:
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+                    continue
+                # Общий bucket берётся только здесь, под тем же замком, поэтому токен точно есть.
+                self.global_bucket.try_acquire()
+                del jobs[index]
+                return job, None
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job, wait = self._take_ready_job()
+                while job is None:
+                    self._cond.wait(wait)
+                    job, wait = self._take_ready_job()
+            self._send(job)
+
+    def _send(self, job: _Job):
+        job.attempts += 1
+        try:
+            result = job.call(*job.args, **job.kwargs)
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None and job.attempts <= SEND_MAX_RETRIES:
+                log.warning(f"Telegram ограничил отправку в чат {job.chat_id}: повтор через {retry_after:.0f} с.")
+                with self._cond:
+                    self._stats["rate_limited"] += 1
+                    self._stats["retried"] += 1
+                    self._chat_bucket(job.chat_id).block_for(retry_after)
+                    self._lanes[job.lane].appendleft(job)
+                    self._cond.notify()
+                return
+            with self._cond:
+                self._stats["failed"] += 1
+                if retry_after is not None:
+                    self._stats["rate_limited"] += 1
+            job.future.set_exception(e)
+            return
+        self.delivery_ms[job.lane].observe((time.perf_counter() - job.enqueued_at) * 1000)
+        with self._cond:
+            self._stats["sent"] += 1
+        job.future.set_result(result)
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = {lane: len(jobs) for lane, jobs in self._lanes.items()}
+            stats["chats_tracked"] = len(self._chat_buckets)
+        stats["delivery_ms"] = {lane: histogram.snapshot() for lane, histogram in self.delivery_ms.items()}
+        return stats
+
+
+send_queue = SendQueue()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Индекс текстов оспариваемых решений в памяти процесса.
+Используется для поиска похожих апелляций, если в PostgreSQL нет pg_trgm.
+Содержит только закрытые дела: строится при старте, периодически
+перестраивается, пополняется при закрытии дела и опрашивается пакетно
+через rapidfuzz.process.extract вместо цикла fuzz.ratio.
+"""
+import bisect
+import logging
+import threading
+from rapidfuzz import fuzz, process
+
+log = logging.getLogger("hjr-bot.similarity_index")
+
+
+def _length_window(length: int, score_cutoff: float):
+    """
+    Диапазон длин текстов, которые в принципе могут набрать fuzz.ratio >= score_cutoff:
+    ratio не превышает 200 * min(a, b) / (a + b).
+    """
+    if score_cutoff <= 0:
+        return 0, float("inf")
+    cutoff = min(score_cutoff, 100)
+    return length * cutoff / (200 - cutoff), length * (200 - cutoff) / cutoff
+
+
+class DecisionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Параллельные списки, отсортированные по (длина текста, case_id).
+        self._keys = []
+        self._texts = []
+        self._lengths = {}
+        self.ready = False
+
+    def build(self, records):
+        """Полностью перестраивает индекс из пар (case_id, decision_text)."""
+        entries = {}
+        for case_id, text in records:
+            if text:
+                entries[case_id] = text
+        ordered = sorted(entries.items(), key=lambda item: (len(item[1]), item[0]))
+        with self._lock:
+            self._keys = [(len(text), case_id) for case_id, text in ordered]
+            self._texts = [text for _, text in ordered]
+            self._lengths = {case_id: len(text) for case_id, text in ordered}
+            self.ready = True
+        log.info(f"Индекс похожих апелляций построен: {len(ordered)} дел.")
+
+    def add(self, case_id, text):
+        self.remove(case_id)
+        if not text:
+            return
+        key = (len(text), case_id)
+        with self._lock:
+            position = bisect.bisect_left(self._keys, key)
+            self._keys.insert(position, key)
+            self._texts.insert(position, text)
+            self._lengths[case_id] = len(text)
+
+    def remove(self, case_id):
+        with self._lock:
+            length = self._lengths.pop(case_id, None)
+            if length is None:
+                return
+            position = bisect.bisect_left(self._keys, (length, case_id))
+            del self._keys[position]
+            del self._texts[position]
+
+    def query(self, text: str, score_cutoff: float, limit: int = 5, exclude_case_id=None) -> list:
+        """Возвращает до limit пар (case_id, score) со схожестью fuzz.ratio не ниже score_cutoff."""
+        if not text:
+            return []
+        min_length, max_length = _length_window(len(text), score_cutoff)
+        with self._lock:
+            low = bisect.bisect_left(self._keys, (min_length,))
+            high = bisect.bisect_right(self._keys, (max_length, float("inf")))
+            keys = self._keys[low:high]
+            texts = self._texts[low:high]
+        results = process.extract(
+            text, texts, scorer=fuzz.ratio, limit=limit + 1, score_cutoff=score_cutoff
+        )
+        matches = []
+        for _, score, position in results:
+            case_id = keys[position][1]
+            if case_id == exclude_case_id:
+                continue
+            matches.append((case_id, score))
+        return matches[:limit]
+
+    def __len__(self):
+        return len(self._lengths)
+
+
+decision_index = DecisionIndex()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Кеш редко меняющихся метаданных Telegram: get_me, get_chat,
+get_chat_member_count и статус самого бота в чате.
+
+У каждого вида запроса свой TTL. Одновременные промахи по одному ключу
+схлопываются: в API идёт один запрос, остальные потоки ждут его результат.
+Ошибки не кешируются. Записи по чату сбрасываются через invalidate_chat
+(обработчики chat_member/my_chat_member).
+"""
+import os
+import logging
+import threading
+
+from ttlCache import TTLCache
+
+log = logging.getLogger("hjr-bot.tg_metadata")
+
+METADATA_TTLS = {
+    "me": float(os.getenv("METADATA_ME_TTL", "3600")),
+    "chat": float(os.getenv("METADATA_CHAT_TTL", "600")),
+    "member_count": float(os.getenv("METADATA_MEMBER_COUNT_TTL", "60")),
+    "bot_member": float(os.getenv("METADATA_BOT_MEMBER_TTL", "300")),
+}
+
+
+def _chat_key(chat_id):
+    """Приводит '-100…' и -100… к одному ключу, а @username — к нижнему регистру."""
+    if isinstance(chat_id, str):
+        text = chat_id.strip()
+        try:
+            return int(text)
+        except ValueError:
+            return text.lower()
+    return chat_id
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TelegramMetadataCache:
+    def __init__(self, ttls: dict = METADATA_TTLS, maxsize: int = 512):
+        self.ttls = dict(ttls)
+        self._cache = TTLCache(maxsize=maxsize, ttl=max(self.ttls.values()))
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {kind: {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0} for kind in self.ttls}
+
+    def _get(self, kind: str, key, fetch):
+        cache_key = (kind, key)
+        found, value = self._cache.lookup(cache_key)
+        if found:
+            with self._lock:
+                self._stats[kind]["hits"] += 1
+            return value
+
+        with self._lock:
+            flight = self._flights.get(cache_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[cache_key] = _Flight()
+                self._stats[kind]["misses"] += 1
+            else:
+                self._stats[kind]["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fetch()
+            self._cache.set(cache_key, flight.value, ttl=self.ttls[kind])
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats[kind]["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(cache_key, None)
+            flight.done.set()
+
+    def get_me(self, bot):
+        return self._get("me", None, bot.get_me)
+
+    def get_chat(self, bot, chat_id):
+        return self._get("chat", _chat_key(chat_id), lambda: bot.get_chat(chat_id))
+
+    def get_chat_member_count(self, bot, chat_id) -> int:
+        return self._get("member_count", _chat_key(chat_id), lambda: bot.get_chat_member_count(chat_id))
+
+    def get_bot_member(self, bot, chat_id):
+        """Статус самого бота в чате (get_chat_member с ID бота)."""
+        return self._get("bot_member", _chat_key(chat_id), lambda: bot.get_chat_member(chat_id, self.get_me(bot).id))
+
+    def invalidate_chat(self, chat_id):
+        """Сбрасывает все записи по чату (по числовому ID; записи по @username истекут по TTL)."""
+        for kind in ("chat", "member_count", "bot_member"):
+            self._cache.pop((kind, _chat_key(chat_id)))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            kinds = {kind: dict(counters) for kind, counters in self._stats.items()}
+        for counters in kinds.values():
+            total = counters["hits"] + counters["misses"] + counters["coalesced"]
+            counters["hit_rate"] = round(counters["hits"] / total, 4) if total else 0
+        cache_stats = self._cache.stats()
+        return {"size": cache_stats["size"], "evictions": cache_stats["evictions"], "kinds": kinds}
+
+
+telegram_metadata = TelegramMetadataCache()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Защита от повторной обработки апдейтов Telegram.
+
+Telegram повторяет доставку webhook, если ответ был медленным. Повторы
+отсекаются в два этапа: кольцевой буфер последних update_id в памяти
+процесса (проверяется прямо в webhook) и таблица processed_updates в БД с
+коротким сроком хранения (проверяется перед обработкой, работает между
+процессами gunicorn).
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+import appealManager
+
+log = logging.getLogger("hjr-bot.update_dedup")
+
+UPDATE_DEDUP_BUFFER_SIZE = int(os.getenv("UPDATE_DEDUP_BUFFER_SIZE", "10000"))
+UPDATE_DEDUP_TTL_SECONDS = int(os.getenv("UPDATE_DEDUP_TTL_SECONDS", "86400"))
+# Как часто удалять из БД устаревшие update_id.
+_PURGE_INTERVAL_SECONDS = 600
+
+
+class UpdateDeduplicator:
+    def __init__(self, buffer_size: int = UPDATE_DEDUP_BUFFER_SIZE, ttl_seconds: int = UPDATE_DEDUP_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._recent = deque(maxlen=buffer_size)
+        self._recent_set = set()
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+        self._stats = {"checked": 0, "local_hits": 0, "db_hits": 0}
+
+    def seen_recently(self, update_id: int) -> bool:
+        """Быстрая проверка в памяти процесса; запоминает update_id, если он новый."""
+        with self._lock:
+            self._stats["checked"] += 1
+            if update_id in self._recent_set:
+                self._stats["local_hits"] += 1
+                return True
+            if len(self._recent) == self._recent.maxlen:
+                self._recent_set.discard(self._recent[0])
+            self._recent.append(update_id)
+            self._recent_set.add(update_id)
+            return False
+
+    def forget(self, update_id: int):
+        """Убирает update_id из буфера, например если апдейт не удалось поставить в очередь."""
+        with self._lock:
+            if update_id not in self._recent_set:
+                return
+            self._recent_set.discard(update_id)
+            # Иначе устаревшая запись в кольце потом вытеснила бы из множества
+            # этот же update_id, доставленный повторно, и окно дедупликации сжалось бы.
+            # Обычно это последний добавленный элемент.
+            if self._recent and self._recent[-1] == update_id:
+                self._recent.pop()
+            else:
+                self._recent.remove(update_id)
+
+    def claim(self, update_id: int) -> bool:
+        """
+        Регистрирует update_id в БД. Возвращает False, если апдейт уже обрабатывался
+        (в том числе другим процессом).
+        """
+        self._purge_if_due()
+        claimed = appealManager.claim_update_id(update_id)
+        if not claimed:
+            with self._lock:
+                self._stats["db_hits"] += 1
+            log.info(f"Апдейт {update_id} уже обработан, повтор пропущен.")
+        return claimed
+
+    def _purge_if_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + _PURGE_INTERVAL_SECONDS
+        appealManager.purge_processed_updates(self.ttl_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["buffer_size"] = len(self._recent)
+        hits = stats["local_hits"] + stats["db_hits"]
+        stats["hit_rate"] = round(hits / stats["checked"], 4) if stats["checked"] else 0
+        return stats
+
+
+update_deduplicator = UpdateDeduplicator()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновая обработка апдейтов Telegram.
+
+Webhook только разбирает апдейт, кладёт его в очередь и сразу отвечает 200.
+Апдейты распределяются по шардам по ID пользователя (или чата): у каждого
+шарда своя очередь и один поток, поэтому апдейты одного пользователя
+обрабатываются строго по порядку, а разные пользователи — параллельно.
+Если очередь шарда заполнена, submit возвращает False, а webhook отвечает
+503, чтобы Telegram повторил доставку позже. Если передан deduplicator,
+перед обработкой вызывается его claim(update_id), и повторы пропускаются.
+
+При завершении процесса (хук atexit в main.py; gunicorn выполняет его, когда
+воркер выходит по SIGTERM) shutdown перестаёт принимать апдейты — webhook
+отвечает 503 — и ждёт не дольше UPDATE_DRAIN_TIMEOUT секунд, пока шарды
+разберут свои очереди.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+
+from metrics import Histogram
+
+log = logging.getLogger("hjr-bot.dispatcher")
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+# Общая ёмкость очередей; делится поровну между шардами.
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# Сколько секунд при завершении ждать, пока шарды разберут очереди.
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "20"))
+
+_KEYED_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "my_chat_member", "chat_member",
+    "poll_answer", "inline_query", "chat_join_request", "channel_post", "edited_channel_post",
+)
+
+
+def _shard_key(update):
+    """Ключ упорядочивания: ID пользователя, иначе ID чата, иначе update_id."""
+    for field in _KEYED_UPDATE_FIELDS:
+        payload = getattr(update, field, None)
+        if payload is None:
+            continue
+        user = getattr(payload, "from_user", None) or getattr(payload, "user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(payload, "chat", None)
+        if chat is not None:
+            return chat.id
+    return update.update_id
+
+
+class _Shard:
+    def __init__(self, index: int, queue_size: int):
+        self.index = index
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.latency_ms = Histogram()
+        self.queue_wait_ms = Histogram()
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+
+class UpdateDispatcher:
+    def __init__(self, bot, workers: int = UPDATE_WORKERS, queue_size: int = UPDATE_QUEUE_SIZE, deduplicator=None):
+        self.bot = bot
+        self.deduplicator = deduplicator
+        self.workers = max(workers, 1)
+        shard_queue_size = max(queue_size // self.workers, 1)
+        self._shards = [_Shard(index, shard_queue_size) for index in range(self.workers)]
+        self._lock = threading.Lock()
+        self._started = False
+        self._stopping = False
+        self.accepted = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for shard in self._shards:
+            threading.Thread(target=self._work, args=(shard,), name=f"update-shard-{shard.index}", daemon=True).start()
+        log.info(f"Запущено {self.workers} шардов обработки апдейтов (очередь шарда: {self._shards[0].queue.maxsize}).")
+
+    def submit(self, update) -> bool:
+        """Ставит апдейт в очередь его шарда. Возвращает False, если очередь заполнена или идёт завершение."""
+        if self._stopping:
+            return False
+        shard = self._shards[hash(_shard_key(update)) % self.workers]
+        try:
+            shard.queue.put_nowait((update, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                shard.rejected += 1
+            log.warning(f"Очередь шарда {shard.index} заполнена, апдейт {update.update_id} отклонён.")
+            return False
+        with self._lock:
+            self.accepted += 1
+        return True
+
+    def shutdown(self, timeout: float = UPDATE_DRAIN_TIMEOUT) -> bool:
+        """
+        Перестаёт принимать апдейты и ждёт, пока шарды обработают уже принятые.
+        Возвращает False, если за timeout секунд очереди разобрать не успели.
+        """
+        with self._lock:
+            if self._stopping:
+                return True
+            self._stopping = True
+        deadline = time.monotonic() + timeout
+        for shard in self._shards:
+            with shard.queue.all_tasks_done:
+                while shard.queue.unfinished_tasks:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        left = sum(other.queue.unfinished_tasks for other in self._shards)
+                        log.warning(f"Не дождались обработки {left} апдейтов за {timeout:g} с, завершаемся.")
+                        return False
+                    shard.queue.all_tasks_done.wait(remaining)
+        log.info("Очереди апдейтов разобраны, обработка остановлена.")
+        return True
+
+    def _work(self, shard: _Shard):
+        while True:
+            update, enqueued_at = shard.queue.get()
+            started = time.perf_counter()
+            shard.queue_wait_ms.observe((started - enqueued_at) * 1000)
+            try:
+                if self.deduplicator is None or self.deduplicator.claim(update.update_id):
+                    self.bot.process_new_updates([update])
+                failed = False
+            except Exception as e:
+                log.error(f"Ошибка при обработке апдейта {update.update_id}: {e}", exc_info=True)
+                failed = True
+            finally:
+                shard.queue.task_done()
+            shard.latency_ms.observe((time.perf_counter() - started) * 1000)
+            with self._lock:
+                if failed:
+                    shard.failed += 1
+                else:
+                    shard.processed += 1
+
+    def stats(self) -> dict:
+        shards = []
+        with self._lock:
+            accepted = self.accepted
+            for shard in self._shards:
+                shards.append({
+                    "shard": shard.index,
+                    "backlog": shard.queue.qsize(),
+                    "processed": shard.processed,
+                    "failed": shard.failed,
+                    "rejected": shard.rejected,
+                    "latency_ms": shard.latency_ms.snapshot(),
+                    "queue_wait_ms": shard.queue_wait_ms.snapshot(),
+                })
+        return {
+            "accepted": accepted,
+            "rejected": sum(shard["rejected"] for shard in shards),
+            "processed": sum(shard["processed"] for shard in shards),
+            "failed": sum(shard["failed"] for shard in shards),
+            "queue_depth": sum(shard["backlog"] for shard in shards),
+            "queue_size": sum(shard.queue.maxsize for shard in self._shards),
+            "workers": self.workers,
+            "stopping": self._stopping,
+            "shards": shards,
+        }
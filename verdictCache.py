@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Кеш готовых вердиктов по содержимому промпта.
+
+Ключ — хеш имени модели и точного текста промпта. Вердикты хранятся в
+таблице verdict_cache, перед ней стоит TTL-кеш в памяти. Если финализация
+упала после ответа модели (или не ушли сообщения в Telegram), повторная
+финализация того же неизменного дела берёт вердикт отсюда, а не из Gemini.
+Сохраняются только успешные ответы модели, тексты ошибок сюда не попадают.
+"""
+import os
+import hashlib
+import logging
+import threading
+
+import appealManager
+from ttlCache import TTLCache
+
+log = logging.getLogger("hjr-bot.verdict_cache")
+
+VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL", "3600"))
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "256"))
+
+
+def prompt_key(model_name: str, kind: str, prompt: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model_name, kind, prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class VerdictCache:
+    def __init__(self, maxsize: int = VERDICT_CACHE_SIZE, ttl: float = VERDICT_CACHE_TTL):
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {"db_hits": 0, "stored": 0, "regenerated": 0}
+
+    def get(self, key: str):
+        """Возвращает сохранённый вердикт или None."""
+        found, verdict = self._memory.lookup(key)
+        if found:
+            return verdict
+        verdict = appealManager.get_stored_verdict(key)
+        if verdict is not None:
+            self._memory.set(key, verdict)
+            with self._lock:
+                self._stats["db_hits"] += 1
+        return verdict
+
+    def put(self, key: str, model_name: str, case_id, verdict: str, regenerated: bool = False):
+        if not verdict:
+            return
+        self._memory.set(key, verdict)
+        appealManager.store_verdict(key, model_name, case_id, verdict)
+        with self._lock:
+            self._stats["stored"] += 1
+            if regenerated:
+                self._stats["regenerated"] += 1
+
+    def stats(self) -> dict:
+        memory = self._memory.stats()
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(memory_hits=memory["hits"], memory_size=memory["size"], lookups=memory["hits"] + memory["misses"])
+        return stats
+
+
+verdict_cache = VerdictCache()